@@ -0,0 +1,361 @@
+import json
+from collections import deque
+
+from history import format_timestamp
+from pipeline import Stage
+
+# Alert events kept in memory, for /api/alerts and stream clients catching up
+EVENT_LOG_SIZE = 500
+# Consecutive samples a condition must hold before an alert fires or clears
+DEBOUNCE_SAMPLES = 2
+# Degrees Celsius a temperature must drop below a threshold to clear its
+# alert, for rules and trip points that do not specify their own
+DEFAULT_HYSTERESIS = 2.0
+# Alert severity of each kind of thermal zone trip point
+TRIP_SEVERITY = {'critical': 'critical', 'hot': 'critical', 'passive': 'warning', 'active': 'info'}
+# Sensor fields rules can select on
+SELECTABLE = ('id', 'kind', 'device', 'type', 'label', 'group')
+
+class AlertState:
+    """Debounced state of one rule for one sensor
+
+    update() gets True while the firing condition holds, False once the
+    clearing condition holds and None in between (the hysteresis band, or
+    no reading): the state only flips after `debounce` consecutive samples
+    call for it.
+    """
+
+    __slots__ = ('active', 'pending', 'since', 'value')
+
+    def __init__(self):
+        self.active = False
+        self.pending = 0
+        self.since = None
+        self.value = None
+
+    def update(self, condition, debounce):
+        """Returns True when the alert fires, False when it clears, otherwise None"""
+        if condition is None or condition == self.active:
+            self.pending = 0
+            return None
+        self.pending += 1
+        if self.pending < debounce:
+            return None
+        self.pending = 0
+        self.active = condition
+        return condition
+
+class Rule:
+    """A condition checked on every sample, separately for each sensor it applies to
+
+    sensors selects them: 'cpu' for the CPU temperature, or a dict of
+    Sensor fields to match (see SELECTABLE), e.g. {'group': 'core'}.
+    bind() resolves the selection whenever the inventory changes and
+    check() returns the AlertState condition and the value it looked at.
+    """
+
+    kind = None
+    kinds = ('zone', 'temp')  # sensor kinds a dict selection applies to
+
+    def __init__(self, name, sensors='cpu', severity='warning', debounce=DEBOUNCE_SAMPLES):
+        if sensors != 'cpu' and not (isinstance(sensors, dict) and set(sensors) <= set(SELECTABLE)):
+            raise ValueError(f"Rule {name!r}: sensors must be 'cpu' or a dict of {', '.join(SELECTABLE)}")
+        if debounce < 1:
+            raise ValueError(f"Rule {name!r}: debounce must be at least 1")
+        self.name = name
+        self.sensors = sensors
+        self.severity = severity
+        self.debounce = debounce
+
+    def bind(self, temps, fans):
+        """The sensors this rule applies to (None standing for the CPU temperature)"""
+        if self.sensors == 'cpu':
+            return [None]
+        return [sensor for sensor in temps + fans if sensor.kind in self.kinds and
+                all(getattr(sensor, field) == value for field, value in self.sensors.items())]
+
+    def check(self, sensor, sample, results):
+        raise NotImplementedError
+
+    def message(self, sensor, value, firing):
+        raise NotImplementedError
+
+    def forget(self, sensor_id):
+        """Drop any per-sensor state kept for a sensor that went away"""
+
+    def to_dict(self):
+        return {'name': self.name, 'type': self.kind, 'sensors': self.sensors,
+                'severity': self.severity, 'debounce': self.debounce}
+
+def reading(sensor, sample, results):
+    if sensor is None:
+        return results.get('cpu')
+    if sensor.kind == 'fan':
+        return sample.fans.get(sensor.id)
+    return sample.temps.get(sensor.id)
+
+def subject(sensor):
+    return 'CPU' if sensor is None else sensor.name
+
+class ThresholdRule(Rule):
+    """Fires at or above threshold, clears at or below threshold - hysteresis"""
+
+    kind = 'threshold'
+
+    def __init__(self, name, threshold, sensors='cpu', hysteresis=DEFAULT_HYSTERESIS, **options):
+        super().__init__(name, sensors, **options)
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+
+    def check(self, sensor, sample, results):
+        value = reading(sensor, sample, results)
+        if value is None:
+            return None, None
+        if value >= self.threshold:
+            return True, value
+        if value <= self.threshold - self.hysteresis:
+            return False, value
+        return None, value
+
+    def message(self, sensor, value, firing):
+        if firing:
+            return f"{subject(sensor)} at {value:.1f}°C, at or above {self.threshold:.1f}°C"
+        return f"{subject(sensor)} back down to {value:.1f}°C"
+
+    def to_dict(self):
+        return dict(super().to_dict(), threshold=self.threshold, hysteresis=self.hysteresis)
+
+class TripPointRule(ThresholdRule):
+    """One trip point of a thermal zone, as read from sysfs at discovery"""
+
+    kind = 'trip_point'
+
+    def __init__(self, zone, index, trip_type, temperature, hysteresis):
+        super().__init__(f"trip:{zone.id}:{index}", temperature, {'id': zone.id},
+                         DEFAULT_HYSTERESIS if hysteresis is None else hysteresis,
+                         severity=TRIP_SEVERITY.get(trip_type, 'warning'))
+        self.trip_type = trip_type
+
+    def message(self, sensor, value, firing):
+        if firing:
+            return (f"{subject(sensor)} at {value:.1f}°C reached its {self.trip_type} trip point "
+                    f"({self.threshold:.1f}°C)")
+        return f"{subject(sensor)} back down to {value:.1f}°C, below its {self.trip_type} trip point"
+
+    def to_dict(self):
+        return dict(super().to_dict(), trip_type=self.trip_type)
+
+class RateOfRiseRule(Rule):
+    """Fires while a temperature climbs faster than degrees_per_second
+
+    The rate is taken over the last `window` seconds of samples and only
+    once at least half a window is held. It clears once the rate drops to
+    clear_rate (half of degrees_per_second by default).
+    """
+
+    kind = 'rate_of_rise'
+
+    def __init__(self, name, degrees_per_second, sensors='cpu', window=10.0, clear_rate=None, **options):
+        super().__init__(name, sensors, **options)
+        if window <= 0:
+            raise ValueError(f"Rule {name!r}: window must be positive")
+        self.degrees_per_second = degrees_per_second
+        self.window = window
+        self.clear_rate = degrees_per_second / 2 if clear_rate is None else clear_rate
+        self.recent = {}  # sensor id -> deque of (monotonic, value)
+
+    def check(self, sensor, sample, results):
+        value = reading(sensor, sample, results)
+        if value is None:
+            return None, None
+        recent = self.recent.setdefault('cpu' if sensor is None else sensor.id, deque())
+        recent.append((sample.monotonic, value))
+        while sample.monotonic - recent[0][0] > self.window:
+            recent.popleft()
+        elapsed = sample.monotonic - recent[0][0]
+        if elapsed < self.window / 2:
+            return None, None
+        rate = (value - recent[0][1]) / elapsed
+        if rate >= self.degrees_per_second:
+            return True, rate
+        if rate <= self.clear_rate:
+            return False, rate
+        return None, rate
+
+    def message(self, sensor, value, firing):
+        if firing:
+            return f"{subject(sensor)} rising at {value:.2f}°C/s over {self.window:g}s"
+        return f"{subject(sensor)} rising at {value:.2f}°C/s, back to normal"
+
+    def forget(self, sensor_id):
+        self.recent.pop(sensor_id, None)
+
+    def to_dict(self):
+        return dict(super().to_dict(), degrees_per_second=self.degrees_per_second, window=self.window,
+                    clear_rate=self.clear_rate)
+
+class FanStallRule(Rule):
+    """Fires when a fan turns slower than min_rpm while the CPU is at or above hot
+
+    Fans are often stopped on purpose while the system is cool, so a slow
+    fan alone is not an alert. It clears once the fan is back above
+    min_rpm or the CPU cools to hot - hysteresis.
+    """
+
+    kind = 'fan_stall'
+    kinds = ('fan',)
+
+    def __init__(self, name, hot, sensors=None, min_rpm=200, hysteresis=DEFAULT_HYSTERESIS, **options):
+        super().__init__(name, {'kind': 'fan'} if sensors is None else sensors, **options)
+        if self.sensors == 'cpu':
+            raise ValueError(f"Rule {name!r}: sensors must select fans")
+        self.hot = hot
+        self.min_rpm = min_rpm
+        self.hysteresis = hysteresis
+
+    def check(self, sensor, sample, results):
+        speed = sample.fans.get(sensor.id)
+        temperature = results.get('cpu')
+        if speed is None or temperature is None:
+            return None, speed
+        if speed >= self.min_rpm or temperature <= self.hot - self.hysteresis:
+            return False, speed
+        if temperature >= self.hot:
+            return True, speed
+        return None, speed
+
+    def message(self, sensor, value, firing):
+        if firing:
+            return f"{subject(sensor)} at {value} RPM while the CPU is at or above {self.hot:.1f}°C"
+        return f"{subject(sensor)} at {value} RPM, no longer stalled while hot"
+
+    def to_dict(self):
+        return dict(super().to_dict(), hot=self.hot, min_rpm=self.min_rpm, hysteresis=self.hysteresis)
+
+RULE_TYPES = {rule.kind: rule for rule in (ThresholdRule, RateOfRiseRule, FanStallRule)}
+
+def rule_from_dict(data):
+    """Build a rule from its JSON form: {"type": ..., "name": ..., other arguments}"""
+    data = dict(data)
+    rule_type = RULE_TYPES.get(data.pop('type', None))
+    if rule_type is None:
+        raise ValueError(f"Unknown alert rule type in {data!r}; use one of {', '.join(RULE_TYPES)}")
+    try:
+        return rule_type(**data)
+    except TypeError as e:
+        raise ValueError(f"Invalid alert rule {data!r}: {e}")
+
+def load_rules(path):
+    """Read alert rules from a JSON file holding a list of rule objects"""
+    with open(path) as f:
+        return [rule_from_dict(data) for data in json.load(f)]
+
+class AlertEngine(Stage):
+    """Evaluates alert rules on every sample and logs when alerts fire or clear
+
+    Runs as a pipeline stage after 'cpu', so rules see the same single
+    read pass as every other derived metric and the cost per tick depends
+    only on the number of rules and sensors, not on who is watching. Every
+    thermal zone trip point becomes a rule of its own next to the
+    configured ones.
+
+    Events go to a bounded in-memory log. events is republished as a new
+    tuple after every tick that added any, so readers on other threads can
+    use it without locks. The result of the stage is the list of alerts
+    currently firing and the id of the newest event.
+    """
+
+    name = 'alerts'
+
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+        names = [rule.name for rule in self.rules]
+        if len(set(names)) != len(names):
+            raise ValueError("Alert rule names must be unique")
+        self.active_rules = list(self.rules)
+        self.rule_info = [rule.to_dict() for rule in self.rules]
+        self._bindings = []  # (rule, sensor, state) for every sensor of every rule
+        self._states = {}    # (rule name, sensor id) -> AlertState
+        self._active = {}    # (rule name, sensor id) -> (rule, sensor, state)
+        self._log = deque(maxlen=EVENT_LOG_SIZE)
+        self.events = ()
+        self.last_event_id = 0
+
+    def configure(self, temps, fans):
+        """Bind rules to the current sensors; alerts of sensors still present carry on"""
+        trip_rules = [TripPointRule(zone, index, *trip)
+                      for zone in temps for index, trip in enumerate(zone.trips)]
+        self.active_rules = trip_rules + self.rules
+        self.rule_info = [rule.to_dict() for rule in self.active_rules]
+        bindings, states, active = [], {}, {}
+        for rule in self.active_rules:
+            for sensor in rule.bind(temps, fans):
+                key = (rule.name, 'cpu' if sensor is None else sensor.id)
+                state = self._states.get(key) or AlertState()
+                states[key] = state
+                bindings.append((rule, sensor, state))
+                if state.active:
+                    active[key] = (rule, sensor, state)
+        rules = {rule.name: rule for rule in self.rules}
+        for rule_name, sensor_id in self._states.keys() - states.keys():
+            if rule_name in rules:
+                rules[rule_name].forget(sensor_id)
+        self._bindings, self._states, self._active = bindings, states, active
+
+    def run(self, sample, results):
+        logged = False
+        for rule, sensor, state in self._bindings:
+            condition, value = rule.check(sensor, sample, results)
+            change = state.update(condition, rule.debounce)
+            if state.active and value is not None:
+                state.value = value
+            if change is None:
+                continue
+            key = (rule.name, 'cpu' if sensor is None else sensor.id)
+            if change:
+                state.since = sample.timestamp_ms
+                self._active[key] = (rule, sensor, state)
+            else:
+                self._active.pop(key, None)
+            self._record(rule, sensor, value, change, sample.timestamp_ms)
+            logged = True
+        if logged:
+            self.events = tuple(self._log)
+        return {
+            'active': [
+                {
+                    'rule': rule.name,
+                    'sensor': None if sensor is None else sensor.id,
+                    'severity': rule.severity,
+                    'since': format_timestamp(state.since),
+                    'value': state.value,
+                    'message': rule.message(sensor, state.value, True)
+                }
+                for rule, sensor, state in self._active.values()
+            ],
+            'last_event_id': self.last_event_id
+        }
+
+    def _record(self, rule, sensor, value, firing, timestamp_ms):
+        self.last_event_id += 1
+        message = rule.message(sensor, value, firing)
+        self._log.append({
+            'id': self.last_event_id,
+            'timestamp': format_timestamp(timestamp_ms),
+            'state': 'firing' if firing else 'resolved',
+            'rule': rule.name,
+            'type': rule.kind,
+            'sensor': None if sensor is None else sensor.id,
+            'severity': rule.severity,
+            'value': value,
+            'message': message
+        })
+        print(f"Alert {'firing' if firing else 'resolved'} ({rule.severity}): {message}")
+
+    def events_after(self, event_id):
+        """Logged events newer than event_id, oldest first"""
+        events = self.events
+        start = len(events)
+        while start and events[start - 1]['id'] > event_id:
+            start -= 1
+        return list(events[start:])
@@ -1,300 +1,1553 @@
 #!/usr/bin/env python3
 
-from flask import Flask, jsonify, render_template_string
+from flask import Flask, Response, jsonify, request, send_file
 from flask_cors import CORS
 import os
-import glob
+import argparse
 import time
 import threading
 import json
+import gzip
+import tempfile
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 
+from alerts import AlertEngine, load_rules
+from assets import IMMUTABLE, Dashboard
+from history import HistoryStore, MappedHistoryStore, RollupStore, format_timestamp, lttb
+from live import LiveEncoder
+from live import event as encode_event
+from matrix import SCALE as HEATMAP_SCALE, MatrixRollup, MatrixStore, column_percentiles, downsample
+from metrics import (CONTENT_TYPE as METRICS_CONTENT_TYPE, FINE_BUCKETS, Histogram, Timings, percentiles,
+                     read_latency_info, render_metrics)
+from sensors import SYSFS_ROOT, SensorRegistry, SysfsReader, SysfsScanner
+from pipeline import (FanDutyStage, PackageMaxStage, Pipeline, PrimaryCpuStage, Reading, Sample, Snapshot,
+                      StatsStage, TypeAverageStage)
+from shm import SharedMonitorClient, SnapshotPublisher
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for cross-origin requests
 
-class ThermalMonitor:
+def backing_device(path):
+    """Identify the device behind a sysfs sensor file
+
+    hwmon and thermal zone directories link to their device through a
+    'device' symlink; sensors without one are their own device.
+    """
+    directory = os.path.dirname(path)
+    device_link = os.path.join(directory, 'device')
+    if os.path.exists(device_link):
+        return os.path.realpath(device_link)
+    return os.path.realpath(directory)
+
+class BatchReader:
+    """Reads one tick's worth of sensors without letting any device stall it
+
+    Sensors are grouped by backing device. A device's sensors are always
+    read one after another, since drivers serialize access to the chip
+    anyway. Devices whose reads are measured to be slow (IPMI/BMC-backed
+    hwmon, Super I/O chips, ACPI methods) each get their own job on a
+    bounded worker pool, and all fast devices share one more job, so the
+    sampling thread itself only waits until the tick's deadline. Whatever
+    has not been read by then is left out of that tick. A device still
+    busy with an earlier read is not queued again, and is treated as slow
+    from then on, so a hung driver ties up at most one worker.
+
+    With max_workers=0 every device is read serially on the calling thread.
+    """
+
+    # A device whose reads average more than this many seconds gets its own job
+    SLOW_THRESHOLD = 0.001
+    # Weight of the newest measurement in each device's latency average
+    LATENCY_SMOOTHING = 0.2
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._pool = None
+        self._devices = {}      # path -> device
+        self._latency = {}      # device -> smoothed read time of the whole group
+        self._slow = set()
+        self._busy = {}         # device -> monotonic time its current read started
+        self._lock = threading.Lock()  # guards _latency, _slow and _busy across workers
+        self.timeouts = 0
+
+    def device_of(self, path):
+        device = self._devices.get(path)
+        if device is None:
+            device = self._devices[path] = backing_device(path)
+        return device
+
+    def _read_group(self, device, members, results):
+        with self._lock:
+            self._busy[device] = time.monotonic()
+        started = time.perf_counter()
+        try:
+            for path, read in members:
+                results[path] = read(path)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                del self._busy[device]
+
+        with self._lock:
+            average = self._latency.get(device, elapsed)
+            average += (elapsed - average) * self.LATENCY_SMOOTHING
+            self._latency[device] = average
+            if average > self.SLOW_THRESHOLD:
+                self._slow.add(device)
+            elif average < self.SLOW_THRESHOLD / 2:
+                self._slow.discard(device)
+
+    def _read_groups(self, groups, results):
+        for device, members in groups:
+            self._read_group(device, members, results)
+
+    def read(self, jobs, timeout):
+        """Run [(path, read)] and return {path: read(path)} for one tick
+
+        Paths missing from the result were not read before the deadline.
+        """
+        deadline = time.monotonic() + timeout
+        groups = {}
+        for path, read in jobs:
+            groups.setdefault(self.device_of(path), []).append((path, read))
+
+        results = {}
+        if self.max_workers <= 0:
+            self._read_groups(groups.items(), results)
+            return results
+
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix='sensor-read')
+        with self._lock:
+            busy = set(self._busy)
+        futures = []
+        fast = []
+        for device, members in groups.items():
+            if device in busy:
+                continue  # still stuck in an earlier tick
+            if device in self._slow:
+                futures.append(self._pool.submit(self._read_group, device, members, results))
+            else:
+                fast.append((device, members))
+        if fast:
+            futures.append(self._pool.submit(self._read_groups, fast, results))
+
+        wait(futures, timeout=max(0, deadline - time.monotonic()))
+        readings = dict(results)
+        with self._lock:
+            overran = list(self._busy)
+            # Overran the deadline: isolate them so they can't hold up the others
+            self._slow.update(overran)
+        self.timeouts += len(overran)
+        return readings
+
+    def info(self):
+        return {
+            'workers': self.max_workers,
+            'devices': len(self._latency),
+            'slow_devices': len(self._slow),
+            'busy_devices': len(self._busy),
+            'timeouts': self.timeouts
+        }
+
+class SensorHealth:
+    """Read health of one sensor, with a circuit breaker and backoff
+
+    The circuit starts closed. After FAILURE_THRESHOLD consecutive failed
+    reads (errors, or reads slower than the latency budget) it opens and the
+    sensor is skipped until its backoff expires. The next read is then a
+    half-open trial: success closes the circuit again, failure reopens it
+    with the backoff doubled, up to MAX_BACKOFF seconds.
+    """
+
+    FAILURE_THRESHOLD = 3
+    BASE_BACKOFF = 1.0
+    MAX_BACKOFF = 300.0
+
     def __init__(self):
-        self.thermal_zones = []
-        self.fan_sensors = []
-        self.temperature_history = deque(maxlen=100)
-        self.current_temps = {}
-        self.current_fans = {}
-        self.stats = {
-            'avg_temp': 0,
-            'max_temp': 0,
-            'min_temp': 100,
-            'cpu_temp': 0
-        }
-        self.discover_thermal_zones()
-        self.discover_fan_sensors()
-        self.start_monitoring()
-    
-    def discover_thermal_zones(self):
-        """Discover available thermal zones"""
-        thermal_pattern = '/sys/class/thermal/thermal_zone*/temp'
-        temp_files = glob.glob(thermal_pattern)
-        
-        for temp_file in temp_files:
-            zone_path = os.path.dirname(temp_file)
-            zone_num = temp_file.split('thermal_zone')[1].split('/')[0]
-            
-            # Try to read the thermal zone type
-            type_file = os.path.join(zone_path, 'type')
-            zone_type = 'unknown'
-            try:
-                with open(type_file, 'r') as f:
-                    zone_type = f.read().strip()
-            except:
-                pass
-            
-            self.thermal_zones.append({
-                'id': zone_num,
-                'path': temp_file,
-                'type': zone_type,
-                'name': f"Zone {zone_num} ({zone_type})"
-            })
-        
-        print(f"Discovered {len(self.thermal_zones)} thermal zones:")
-        for zone in self.thermal_zones:
-            print(f"  - {zone['name']}: {zone['path']}")
-    
-    def discover_fan_sensors(self):
-        """Discover available fan sensors"""
-        fan_sensors = []
-        
-        # Search through all hwmon directories
-        hwmon_pattern = '/sys/class/hwmon/hwmon*'
-        hwmon_dirs = glob.glob(hwmon_pattern)
-        
-        for hwmon_dir in hwmon_dirs:
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.total_failures = 0
+        self.backoff = 0.0
+        self.retry_at = 0.0
+        self.last_error = None
+        self.last_latency = None
+        self.latency = Histogram(FINE_BUCKETS)
+
+    def allow(self, now):
+        """Whether the sensor should be read at monotonic time now"""
+        if self.state == 'open':
+            if now < self.retry_at:
+                return False
+            self.state = 'half_open'
+        return True
+
+    def record_success(self, latency):
+        """Record a good read; returns True if the circuit just closed"""
+        self.last_latency = latency
+        self.latency.observe(latency)
+        recovered = self.state != 'closed'
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.backoff = 0.0
+        return recovered
+
+    def record_failure(self, error, latency, now):
+        """Record a failed read; returns True if the circuit just opened"""
+        self.last_latency = latency
+        self.latency.observe(latency)
+        self.last_error = error
+        self.consecutive_failures += 1
+        self.total_failures += 1
+        if self.state == 'half_open':
+            self.backoff = min(self.backoff * 2, self.MAX_BACKOFF)
+        elif self.state == 'closed' and self.consecutive_failures >= self.FAILURE_THRESHOLD:
+            self.backoff = self.BASE_BACKOFF
+        else:
+            return False
+        opened = self.state == 'closed'
+        self.state = 'open'
+        self.retry_at = now + self.backoff
+        return opened
+
+    def info(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'total_failures': self.total_failures,
+            'backoff': self.backoff,
+            'last_error': self.last_error,
+            'last_latency_ms': None if self.last_latency is None else self.last_latency * 1000
+        }
+
+class RollingWindow:
+    """Rolling average/minimum/maximum over the last N samples or N seconds
+
+    Each sample is added in O(1) amortized time: the average comes from a
+    running sum, and the minimum and maximum from monotonic deques whose
+    fronts always hold the current extremes.
+    """
+
+    # Recompute the running sum from scratch this often to shed float drift
+    RESUM_INTERVAL = 10000
+
+    def __init__(self, name, samples=None, seconds=None):
+        if samples is None and seconds is None:
+            raise ValueError(f"Window {name!r} needs a sample count or a duration")
+        self.name = name
+        self.samples = samples
+        self.seconds = seconds
+        self._values = deque()  # (index, time, value)
+        self._min = deque()     # (index, value), values increasing
+        self._max = deque()     # (index, value), values decreasing
+        self._sum = 0.0
+        self._index = 0
+
+    def add(self, value, now):
+        """Add a sample taken at monotonic time now"""
+        index = self._index
+        self._index += 1
+
+        self._values.append((index, now, value))
+        self._sum += value
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((index, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((index, value))
+
+        self._evict(now)
+        if index % self.RESUM_INTERVAL == 0:
+            self._sum = sum(entry[2] for entry in self._values)
+
+    def _evict(self, now):
+        values = self._values
+        while values and (
+            (self.samples is not None and len(values) > self.samples) or
+            (self.seconds is not None and now - values[0][1] > self.seconds)
+        ):
+            index, _, value = values.popleft()
+            self._sum -= value
+            if self._min[0][0] == index:
+                self._min.popleft()
+            if self._max[0][0] == index:
+                self._max.popleft()
+
+    def summary(self):
+        count = len(self._values)
+        if not count:
+            return {'avg_temp': None, 'max_temp': None, 'min_temp': None, 'count': 0}
+        return {
+            'avg_temp': self._sum / count,
+            'max_temp': self._max[0][1],
+            'min_temp': self._min[0][1],
+            'count': count
+        }
+
+class DeadlineScheduler:
+    """Runs a callback on a background thread at fixed monotonic deadlines
+
+    Deadlines are start + n * period, so the time spent in the callback
+    does not accumulate into drift. When a tick overruns one or more
+    deadlines the missed ticks are skipped and counted rather than run back
+    to back. Per-tick latency (callback duration) and jitter (start delay
+    past the deadline) are kept for the last SAMPLE_WINDOW ticks.
+    """
+
+    SAMPLE_WINDOW = 1024
+
+    def __init__(self, period, callback):
+        if period <= 0:
+            raise ValueError("Sampling period must be positive")
+        self.period = period
+        self.callback = callback
+        self.ticks = 0
+        self.missed_ticks = 0
+        self.latencies = deque(maxlen=self.SAMPLE_WINDOW)
+        self.jitters = deque(maxlen=self.SAMPLE_WINDOW)
+        self.latency_histogram = Histogram()
+        self.jitter_histogram = Histogram()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop ticking; returns once a tick already under way has finished"""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        deadline = time.monotonic()
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self.jitters.append(started - deadline)
+            self.jitter_histogram.observe(started - deadline)
             try:
-                # Get the device name
-                name_file = os.path.join(hwmon_dir, 'name')
-                device_name = 'unknown'
-                try:
-                    with open(name_file, 'r') as f:
-                        device_name = f.read().strip()
-                except:
-                    pass
-                
-                # Look for fan input files
-                fan_pattern = os.path.join(hwmon_dir, 'fan*_input')
-                fan_files = glob.glob(fan_pattern)
-                
-                for fan_file in fan_files:
-                    fan_num = fan_file.split('fan')[1].split('_')[0]
-                    
-                    # Try to read the fan label
-                    label_file = os.path.join(hwmon_dir, f'fan{fan_num}_label')
-                    fan_label = f'Fan {fan_num}'
-                    try:
-                        with open(label_file, 'r') as f:
-                            fan_label = f.read().strip()
-                    except:
-                        pass
-                    
-                    # Test if we can read the fan speed
-                    try:
-                        with open(fan_file, 'r') as f:
-                            speed = int(f.read().strip())
-                            if speed >= 0:  # Valid fan speed
-                                fan_sensors.append({
-                                    'id': f"{device_name}_{fan_num}",
-                                    'path': fan_file,
-                                    'label': fan_label,
-                                    'device': device_name,
-                                    'fan_num': fan_num,
-                                    'name': f"{device_name} - {fan_label}"
-                                })
-                    except:
-                        pass
-                        
+                self.callback()
             except Exception as e:
-                print(f"Error scanning {hwmon_dir}: {e}")
-        
-        self.fan_sensors = fan_sensors
+                print(f"Error in sampling tick: {e}")
+            finished = time.monotonic()
+            self.latencies.append(finished - started)
+            self.latency_histogram.observe(finished - started)
+            self.ticks += 1
+
+            deadline += self.period
+            if finished > deadline:
+                # Overran: skip to the next deadline still ahead of us
+                missed = int((finished - deadline) // self.period) + 1
+                self.missed_ticks += missed
+                deadline += missed * self.period
+            self._stop.wait(deadline - time.monotonic())
+
+    def info(self):
+        def milliseconds(values):
+            return {name: None if value is None else value * 1000
+                    for name, value in percentiles(values).items()}
+        return {
+            'interval': self.period,
+            'ticks': self.ticks,
+            'missed_ticks': self.missed_ticks,
+            'latency_ms': milliseconds(self.latencies),
+            'jitter_ms': milliseconds(self.jitters),
+            'histograms': {
+                'latency': self.latency_histogram.info(),
+                'jitter': self.jitter_histogram.info()
+            }
+        }
+
+# Seconds between samples; sub-second periods are supported
+SAMPLE_INTERVAL = 1.0
+# Share of the sampling period that sensor reads may take before being dropped
+READ_BUDGET = 0.8
+# Worker threads used to read sensors off the sampling thread; with at
+# least 2, one hung driver cannot stop the other sensors from being read
+READ_WORKERS = 4
+# Reads slower than this many seconds count as failures
+READ_LATENCY_BUDGET = 0.05
+# Seconds between checks for hotplugged or removed sensor devices (0 disables)
+RESCAN_INTERVAL = 5.0
+
+# Rolling windows reported in stats; the first one also feeds the
+# top-level avg_temp/max_temp/min_temp values
+DEFAULT_STATS_WINDOWS = [
+    {'name': '20_samples', 'samples': 20},
+    {'name': '1m', 'seconds': 60},
+    {'name': '15m', 'seconds': 15 * 60},
+    {'name': '1h', 'seconds': 60 * 60}
+]
+
+# Raw samples kept per sensor: an hour at one sample per second. Longer
+# ranges are read from the rollups, which cost a sixtieth of that per hour
+HISTORY_CAPACITY = 60 * 60
+# Points returned by /api/history
+HISTORY_RESPONSE_LIMIT = 100
+# Sensor columns a new on-disk raw history file starts with; it doubles
+# whenever more are needed
+HISTORY_MAX_COLUMNS = 128
+# Rollup resolutions kept next to the raw history: (name, bucket ms, buckets kept)
+HISTORY_ROLLUPS = [
+    ('1m', 60 * 1000, 30 * 24 * 60),   # 30 days of minutes
+    ('1h', 60 * 60 * 1000, 365 * 24)   # a year of hours
+]
+
+# Raw per-core samples kept; longer heatmaps are read from the rollup
+CORE_HISTORY_CAPACITY = 6 * 60 * 60
+# Per-core rollup: (bucket ms, buckets kept), a week of minutes
+CORE_ROLLUP = (60 * 1000, 7 * 24 * 60)
+# Time tiles in a heatmap unless max_points asks for others, and the cap
+HEATMAP_TILES = 240
+HEATMAP_MAX_TILES = 2000
+# Heatmap windows holding more raw samples than this use the rollup
+HEATMAP_RAW_SAMPLES = 3600
+# Inventory cache file kept in TEMP_MONITOR_DATA_DIR
+INVENTORY_CACHE_NAME = 'inventory.json'
+
+class ThermalMonitor:
+    def __init__(self, stats_windows=DEFAULT_STATS_WINDOWS, history_capacity=HISTORY_CAPACITY,
+                 data_dir=None, interval=SAMPLE_INTERVAL, read_workers=READ_WORKERS,
+                 rescan_interval=RESCAN_INTERVAL, sysfs_root=SYSFS_ROOT, reader=None, inventory_cache=None,
+                 alert_rules=()):
+        """Set up the monitor without touching sysfs; start() finds the sensors and samples them
+
+        inventory_cache is a file to keep the sensor inventory in between
+        runs (see SysfsScanner). alert_rules are checked on every sample,
+        along with the thermal zones' trip points (see AlertEngine).
+        """
+        self.thermal_zones = []  # thermal zones, then hwmon temperature inputs
+        self.fan_sensors = []
+        self.inventory_version = 0
+        self.open_history(data_dir, history_capacity)
+        self.temp_readings = ()
+        self.fan_readings = ()
+        self.reader = reader if reader is not None else SysfsReader()
+        self.batch_reader = BatchReader(read_workers)
+        self.sensor_health = {}
+        self.syscalls_per_tick = 0
+        self.scheduler = DeadlineScheduler(interval, self.sample)
+        self.sequence = 0
+        self.sample_ready = threading.Condition()
+        self.listeners = []  # called with each published snapshot
+        self.stats_windows = [RollingWindow(**spec) for spec in stats_windows]
+        self.stats_stage = StatsStage(self.stats_windows)
+        self.alerts = AlertEngine(alert_rules)
+        self.pipeline = Pipeline([
+            PrimaryCpuStage(),
+            self.stats_stage,
+            PackageMaxStage(),
+            TypeAverageStage(),
+            FanDutyStage(),
+            self.alerts
+        ])
+        self.derived = {}
+        self.snapshot = self.build_snapshot()
+        self.core_history = MatrixStore(CORE_HISTORY_CAPACITY)
+        self.core_rollup = MatrixRollup(*CORE_ROLLUP)
+        self.registry = SensorRegistry()
+        self.scanner = SysfsScanner(sysfs_root, inventory_cache)
+        self._retired_paths = deque()
+        self.rescanner = None
+        if rescan_interval:
+            self.rescanner = DeadlineScheduler(rescan_interval, lambda: self.discover_sensors(report=True))
+        self.started = False
+
+    def discover(self):
+        """Find the sensors and get ready to sample them; returns self
+
+        start() does this first. Calling it alone allows driving sample()
+        by hand, without the background threads.
+        """
+        self.discover_sensors()
+        self.apply_inventory()
+        restored = f" ({self.scanner.cache_hits} from the inventory cache)" if self.scanner.cache_hits else ""
+        print(f"Discovered {len(self.thermal_zones)} temperature sensors{restored}:")
+        for zone in self.thermal_zones:
+            print(f"  - {zone.name}: {zone.path}")
         print(f"Discovered {len(self.fan_sensors)} fan sensors:")
         for fan in self.fan_sensors:
-            print(f"  - {fan['name']}: {fan['path']}")
-    
-    def read_fan_speed(self, fan_file):
-        """Read fan speed from a fan sensor file"""
+            print(f"  - {fan.name}: {fan.path}")
+        return self
+
+    def start(self):
+        """Discover the sensors and start sampling them in the background"""
+        if self.started:
+            return
+        self.started = True
+        self.discover()
+        self.start_monitoring()
+
+    def discover_sensors(self, report=False):
+        """Pick up sensors that appeared or disappeared since the last scan
+
+        Runs on the rescan thread. Only sysfs entries that changed are read
+        (see SysfsScanner); the sampling thread switches over to the new
+        inventory at its next tick. Returns True if anything changed.
+        """
+        added, removed = self.scanner.scan()
+        if not added and not removed:
+            return False
+        for sensor_id in removed:
+            sensor = self.registry.get(sensor_id)
+            if sensor is not None:
+                self._retired_paths.append(sensor.path)
+                if report:
+                    print(f"Sensor removed: {sensor.name} ({sensor.path})")
+        if report:
+            for sensor in added:
+                print(f"Sensor added: {sensor.name} ({sensor.path})")
+        return self.registry.update(added, removed)
+
+    def apply_inventory(self):
+        """Sample the registry's current sensors from now on
+
+        Only called from the sampling thread (or before it starts), so file
+        handles and history columns are never touched by two threads.
+        """
+        version = self.registry.version
+        while self._retired_paths:
+            path = self._retired_paths.popleft()
+            if self.registry.by_path(path) is None:
+                self.reader.close(path)
+                self.sensor_health.pop(path, None)
+        self.thermal_zones = self.registry.find(kind='zone') + self.registry.find(kind='temp')
+        self.fan_sensors = self.registry.find(kind='fan')
+        self.pipeline.configure(self.thermal_zones, self.fan_sensors)
+        self.add_history_columns()
+        self.inventory_version = version
+
+    def read_sensor(self, path):
+        """Read an integer sensor file, honouring its circuit breaker
+
+        Returns None when the read failed or the sensor is backing off.
+        Errors are only logged when a sensor starts failing or recovers.
+        """
+        health = self.sensor_health.get(path)
+        if health is None:
+            health = self.sensor_health[path] = SensorHealth()
+        if not health.allow(time.monotonic()):
+            return None
+
+        started = time.perf_counter()
         try:
-            with open(fan_file, 'r') as f:
-                # Fan speed is in RPM
-                speed_rpm = int(f.read().strip())
-                return speed_rpm
-        except Exception as e:
-            print(f"Error reading {fan_file}: {e}")
+            value = self.reader.read_int(path)
+        except (OSError, ValueError) as e:
+            latency = time.perf_counter() - started
+            if health.record_failure(str(e), latency, time.monotonic()):
+                print(f"Error reading {path}: {e}; backing off {health.backoff:.0f}s")
             return None
+
+        latency = time.perf_counter() - started
+        if latency > READ_LATENCY_BUDGET:
+            error = f"read took {latency * 1000:.1f} ms"
+            if health.record_failure(error, latency, time.monotonic()):
+                print(f"Sensor {path} is too slow ({error}); backing off {health.backoff:.0f}s")
+        elif health.record_success(latency):
+            print(f"Sensor {path} recovered")
+        return value
+
+    def health_info(self, path):
+        health = self.sensor_health.get(path)
+        return health.info() if health else SensorHealth().info()
+
+    def read_fan_speed(self, fan_file):
+        """Read fan speed from a fan sensor file"""
+        # Fan speed is in RPM
+        return self.read_sensor(fan_file)
     
     def read_temperature(self, temp_file):
         """Read temperature from a thermal zone file"""
-        try:
-            with open(temp_file, 'r') as f:
-                # Temperature is in millidegrees Celsius
-                temp_millidegrees = int(f.read().strip())
-                return temp_millidegrees / 1000.0
-        except Exception as e:
-            print(f"Error reading {temp_file}: {e}")
+        # Temperature is in millidegrees Celsius
+        temp_millidegrees = self.read_sensor(temp_file)
+        if temp_millidegrees is None:
             return None
+        return temp_millidegrees / 1000.0
     
-    def get_cpu_temperature(self):
-        """Get the primary CPU temperature"""
-        # Priority order for CPU temperature zones
-        cpu_types = ['x86_pkg_temp', 'cpu_thermal', 'coretemp', 'acpi-0']
-        
-        # First, try to find a zone with CPU-related type
-        for cpu_type in cpu_types:
-            for zone in self.thermal_zones:
-                if cpu_type.lower() in zone['type'].lower():
-                    temp = self.read_temperature(zone['path'])
-                    if temp is not None:
-                        return temp
-        
-        # If no specific CPU zone found, use the first available zone
-        for zone in self.thermal_zones:
-            temp = self.read_temperature(zone['path'])
+    def read_pass(self):
+        """Read every sensor once and return the tick's Sample
+
+        Readings pair a value with the Sensor descriptor it came from, so
+        nothing about the sensor is copied per tick. They are kept for the
+        next snapshot as temp_readings and fan_readings.
+        """
+        zones, fans = self.thermal_zones, self.fan_sensors
+        jobs = [(zone.path, self.read_temperature) for zone in zones]
+        jobs += [(fan.path, self.read_fan_speed) for fan in fans]
+        readings = self.batch_reader.read(jobs, self.scheduler.period * READ_BUDGET)
+        timestamp_ms = time.time_ns() // 1_000_000
+
+        temp_readings = []
+        for zone in zones:
+            temp = readings.get(zone.path)
             if temp is not None:
-                return temp
-        
-        return None
-    
-    def update_temperatures(self):
-        """Update all temperature readings"""
-        temps = {}
-        valid_temps = []
-        
+                temp_readings.append(Reading(zone, temp))
+        fan_readings = []
+        for fan in fans:
+            speed = readings.get(fan.path)
+            if speed is not None:
+                fan_readings.append(Reading(fan, speed))
+        self.temp_readings = tuple(temp_readings)
+        self.fan_readings = tuple(fan_readings)
+        return Sample(timestamp_ms, time.monotonic(), self.temp_readings, self.fan_readings)
+
+    def add_stage(self, stage):
+        """Register a derived-metric stage; its results appear under 'derived' in snapshots"""
+        self.pipeline.add(stage)
+        stage.configure(self.thermal_zones, self.fan_sensors)
+
+    def open_history(self, data_dir, capacity):
+        """Set up the raw history and its rollups
+
+        With a data directory the stores are memory-mapped ring files in it,
+        so a restarted process picks up where the previous one stopped.
+        Without one they are in memory and, like the ring files' pages, only
+        take up space as samples arrive.
+        """
+        self.data_dir = data_dir
+        if data_dir is not None:
+            os.makedirs(data_dir, exist_ok=True)
+
+        def open_store(name, capacity, max_columns):
+            if data_dir is None:
+                return HistoryStore(capacity)
+            return MappedHistoryStore(os.path.join(data_dir, f"{name}.ring"), capacity, max_columns)
+
+        self.history = open_store('raw', capacity, HISTORY_MAX_COLUMNS)
+        self.rollups = {
+            name: RollupStore(open_store(name, buckets, 3 * HISTORY_MAX_COLUMNS), bucket_ms)
+            for name, bucket_ms, buckets in HISTORY_ROLLUPS
+        }
+        if len(self.history):
+            print(f"Restored {len(self.history)} history samples from {data_dir}")
+            # The buckets open when the last process stopped were never written
+            for name, rollup in self.rollups.items():
+                replayed = rollup.replay(self.history)
+                if replayed:
+                    print(f"Replayed {replayed} samples into the {name} rollup")
+
+    def add_history_columns(self):
+        """Give every discovered zone and fan its own history column
+
+        Per-core, per-CCD and per-package sensors also get a column in the
+        core matrix.
+        """
+        self.history.add_column('cpu')
         for zone in self.thermal_zones:
-            temp = self.read_temperature(zone['path'])
-            if temp is not None:
-                temps[zone['id']] = {
-                    'temperature': temp,
-                    'type': zone['type'],
-                    'name': zone['name']
-                }
-                valid_temps.append(temp)
-        
-        self.current_temps = temps
-        
-        # Update statistics
-        if valid_temps:
-            cpu_temp = self.get_cpu_temperature()
-            if cpu_temp is not None:
-                self.stats['cpu_temp'] = cpu_temp
-                self.temperature_history.append({
-                    'timestamp': datetime.now().isoformat(),
-                    'temperature': cpu_temp
-                })
-                
-                # Calculate statistics from history
-                recent_temps = [entry['temperature'] for entry in list(self.temperature_history)[-20:]]
-                if recent_temps:
-                    self.stats['avg_temp'] = sum(recent_temps) / len(recent_temps)
-                    self.stats['max_temp'] = max(recent_temps)
-                    self.stats['min_temp'] = min(recent_temps)
-    
-    def update_fans(self):
-        """Update all fan speed readings"""
-        fans = {}
-        
+            self.history.add_column(f"zone:{zone.id}")
         for fan in self.fan_sensors:
-            speed = self.read_fan_speed(fan['path'])
-            if speed is not None:
-                fans[fan['id']] = {
-                    'speed': speed,
-                    'label': fan['label'],
-                    'device': fan['device'],
-                    'name': fan['name']
-                }
-        
-        self.current_fans = fans
-    
+            self.history.add_column(f"fan:{fan.id}")
+        core_keys = [zone.id for zone in self.thermal_zones if zone.group]
+        self.core_history.add_columns(core_keys)
+        self.core_rollup.add_columns(core_keys)
+
+    def record_history(self, sample, derived):
+        """Append the readings of the current tick to the history stores"""
+        values = {'cpu': derived.get('cpu')}
+        for zone_id, temp in sample.temps.items():
+            values[f"zone:{zone_id}"] = temp
+        for fan_id, speed in sample.fans.items():
+            values[f"fan:{fan_id}"] = speed
+        timestamp = sample.timestamp_ms
+        self.history.append(timestamp, values)
+        for rollup in self.rollups.values():
+            rollup.add(timestamp, values)
+        if self.core_history.width:
+            self.core_history.append(timestamp, sample.temps)
+            self.core_rollup.add(timestamp, sample.temps)
+
+    def build_snapshot(self, sequence=0, monotonic=None):
+        """Build a Snapshot of the readings taken in the current tick"""
+        stats = self.stats_stage.stats
+        return Snapshot(
+            sequence,
+            datetime.now().isoformat(),
+            stats['cpu_temp'],
+            stats,
+            self.temp_readings,
+            self.fan_readings,
+            {name: value for name, value in self.derived.items() if name not in ('cpu', 'stats')},
+            len(self.history),
+            monotonic
+        )
+
+    def publish_snapshot(self, monotonic=None):
+        """Publish the finished tick under the next sequence number
+
+        The snapshot is built before taking the lock and published by
+        swapping the one reference, so readers of self.snapshot never wait
+        on the sampler and never see a half-built tick.
+        """
+        snapshot = self.build_snapshot(self.sequence + 1, monotonic)
+        with self.sample_ready:
+            self.snapshot = snapshot
+            self.sequence = snapshot.sequence
+            self.sample_ready.notify_all()
+        for listener in self.listeners:
+            listener(snapshot)
+
+    def wait_for_snapshot(self, after_sequence, timeout=None):
+        """Block until a snapshot newer than after_sequence is published
+
+        Returns the latest snapshot, or None if the timeout expired first.
+        """
+        with self.sample_ready:
+            self.sample_ready.wait_for(lambda: self.sequence > after_sequence, timeout)
+        snapshot = self.snapshot
+        if snapshot.sequence > after_sequence:
+            return snapshot
+        return None
+
+    def sample(self):
+        """Take one sample of every sensor, derive metrics from it and publish it
+
+        Sensors are read exactly once per tick; the pipeline's stages only
+        see the resulting Sample.
+        """
+        if self.registry.version != self.inventory_version:
+            self.apply_inventory()
+        syscalls_before = self.reader.syscalls
+        started = time.perf_counter()
+        sample = self.read_pass()
+        self.pipeline.record('read', time.perf_counter() - started)
+        self.syscalls_per_tick = self.reader.syscalls - syscalls_before
+
+        self.derived = self.pipeline.run(sample)
+        started = time.perf_counter()
+        self.record_history(sample, self.derived)
+        self.pipeline.record('history', time.perf_counter() - started)
+        self.publish_snapshot(sample.monotonic)
+
+    def sampler_info(self):
+        """Describe the sampling loop: tick and stage timings, missed ticks and syscall cost"""
+        return dict(
+            self.scheduler.info(),
+            stages=self.pipeline.info(),
+            syscalls_per_tick=self.syscalls_per_tick,
+            open_handles=self.reader.open_handles,
+            reads=self.batch_reader.info()
+        )
+
+    def read_latency_info(self):
+        """Per-sensor read latency and the time spent on temperatures and fans"""
+        histograms = {path: health.latency for path, health in self.sensor_health.items()}
+        return read_latency_info(self.thermal_zones, self.fan_sensors, histograms, self.sequence)
+
+    def alert_events(self, after_id=0):
+        """Logged alert events newer than after_id, oldest first"""
+        return self.alerts.events_after(after_id)
+
+    def alert_rules(self):
+        """Every alert rule in force, trip points included"""
+        return self.alerts.rule_info
+
     def start_monitoring(self):
         """Start background temperature and fan monitoring"""
-        def monitor_loop():
-            while True:
-                self.update_temperatures()
-                self.update_fans()
-                time.sleep(1)  # Update every second
-        
-        monitor_thread = threading.Thread(target=monitor_loop, daemon=True)
-        monitor_thread.start()
-
-# Initialize thermal monitor
-thermal_monitor = ThermalMonitor()
+        self.scheduler.start()
+        if self.rescanner is not None:
+            self.rescanner.start()
+
+class ResponseCache:
+    """Serializes each endpoint's payload once per sampling tick
+
+    Entries are keyed by endpoint and tagged with the snapshot sequence they
+    were built from. Until the next tick is published every request gets the
+    same encoded bytes, both raw and gzip-compressed. Builders return a
+    payload to be encoded as JSON, or bytes that are cached as they are.
+    The time spent building payloads and encoding them (JSON and gzip) is
+    kept per endpoint, the part of the key before any ':'.
+
+    Each key has its own build lock, so concurrent misses on one endpoint
+    build it once while a slow build of another (a long /api/history
+    range, say) holds up nobody else. The shared lock only guards the
+    entry and lock tables, never a build.
+    """
+
+    def __init__(self, compress_level=6, max_entries=256):
+        self.compress_level = compress_level
+        self.max_entries = max_entries
+        self._entries = {}
+        self._build_locks = {}  # key -> lock held while that key is built
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.build_timings = Timings(FINE_BUCKETS)
+        self.encode_timings = Timings(FINE_BUCKETS)
+
+    def peek(self, key, sequence):
+        """Return (body, gzipped_body) if key is cached at sequence, otherwise None"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == sequence:
+            self.hits += 1
+            return entry[1], entry[2]
+        return None
+
+    def get(self, key, sequence, build):
+        """Return (body, gzipped_body) for key at sequence, building it on a miss"""
+        cached = self.peek(key, sequence)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            build_lock = self._build_locks.get(key)
+            if build_lock is None:
+                build_lock = self._build_locks[key] = threading.Lock()
+        with build_lock:
+            # Another request may have built it while we waited for the lock
+            cached = self.peek(key, sequence)
+            if cached is not None:
+                return cached
+
+            self.misses += 1
+            started = time.perf_counter()
+            payload = build()
+            built = time.perf_counter()
+            if isinstance(payload, bytes):
+                body = payload
+            else:
+                body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+            gzipped = gzip.compress(body, self.compress_level)
+            endpoint = key.split(':', 1)[0]
+            self.build_timings.observe(endpoint, built - started)
+            self.encode_timings.observe(endpoint, time.perf_counter() - built)
+
+            with self._lock:
+                entry = self._entries.get(key)
+                if len(self._entries) >= self.max_entries and entry is None:
+                    # Parameterized routes can produce many keys; drop stale ones
+                    self._entries = {k: e for k, e in self._entries.items() if e[0] >= sequence}
+                    self._build_locks = {k: lock for k, lock in self._build_locks.items()
+                                         if k in self._entries or lock.locked()}
+                    if len(self._entries) >= self.max_entries:
+                        return body, gzipped
+                # Never replace a newer entry with one built for a lagging reader
+                if entry is None or entry[0] < sequence:
+                    self._entries[key] = (sequence, body, gzipped)
+        return body, gzipped
+
+    def info(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0,
+            'entries': len(self._entries)
+        }
+
+def create_monitor():
+    """The monitor configured by the TEMP_MONITOR_* environment variables, not started yet"""
+    if os.environ.get('TEMP_MONITOR_SHARED_DIR'):
+        # HTTP worker of a multi-process server: serve what a separate
+        # `app.py --sampler` process publishes instead of sampling here
+        return SharedMonitorClient(os.environ['TEMP_MONITOR_SHARED_DIR'])
+    data_dir = os.environ.get('TEMP_MONITOR_DATA_DIR')
+    rules_path = os.environ.get('TEMP_MONITOR_ALERT_RULES')
+    inventory_cache = os.environ.get('TEMP_MONITOR_INVENTORY_CACHE')
+    if inventory_cache is None and data_dir is not None:
+        inventory_cache = os.path.join(data_dir, INVENTORY_CACHE_NAME)
+    return ThermalMonitor(
+        data_dir=data_dir,
+        interval=float(os.environ.get('TEMP_MONITOR_INTERVAL', SAMPLE_INTERVAL)),
+        read_workers=int(os.environ.get('TEMP_MONITOR_READ_WORKERS', READ_WORKERS)),
+        rescan_interval=float(os.environ.get('TEMP_MONITOR_RESCAN_INTERVAL', RESCAN_INTERVAL)),
+        sysfs_root=os.environ.get('TEMP_MONITOR_SYSFS_ROOT', SYSFS_ROOT),
+        inventory_cache=inventory_cache or None,
+        alert_rules=load_rules(rules_path) if rules_path else ()
+    )
+
+# The process's monitor; importing this module does not create it, the
+# first request (or create_app()) does
+thermal_monitor = None
+_monitor_lock = threading.Lock()
+
+def get_monitor():
+    """The process's monitor, created and started on first use"""
+    global thermal_monitor
+    monitor = thermal_monitor
+    if monitor is None:
+        with _monitor_lock:
+            if thermal_monitor is None:
+                monitor = create_monitor()
+                monitor.start()
+                thermal_monitor = monitor
+            monitor = thermal_monitor
+    return monitor
+
+def create_app(monitor=None):
+    """Return the Flask app with its monitor started and the dashboard compiled
+
+    monitor defaults to the one configured by the environment. Use it to
+    start sampling before the first request, e.g. gunicorn 'app:create_app()'.
+    """
+    global thermal_monitor
+    with _monitor_lock:
+        if monitor is not None:
+            thermal_monitor = monitor
+        elif thermal_monitor is None:
+            thermal_monitor = create_monitor()
+        thermal_monitor.start()
+    get_dashboard()
+    return app
+
+# Directory the dashboard is compiled into; file names carry a content
+# hash, so processes and versions can share it
+ASSET_DIR = os.environ.get('TEMP_MONITOR_ASSET_DIR', os.path.join(tempfile.gettempdir(), 'temp-monitor-assets'))
+
+dashboard = None
+_dashboard_lock = threading.Lock()
+
+def get_dashboard():
+    """The dashboard compiled from HTML_TEMPLATE, built on first use"""
+    global dashboard
+    with _dashboard_lock:
+        if dashboard is None:
+            dashboard = Dashboard(HTML_TEMPLATE, ASSET_DIR)
+    return dashboard
+
+response_cache = ResponseCache()
+# Handling time of each HTTP route, and the age of the sample it was served from
+request_timings = Timings(FINE_BUCKETS)
+sample_ages = Timings()
+
+# Seconds between keep-alive comments on an idle event stream
+STREAM_HEARTBEAT_INTERVAL = 15
+# Reconnect delay suggested to EventSource clients, in milliseconds
+STREAM_RETRY_MS = 2000
+# Smallest change of a temperature (degrees Celsius) or fan speed (RPM)
+# sent by /api/live; smaller ones wait until they add up
+LIVE_TEMP_EPSILON = float(os.environ.get('TEMP_MONITOR_LIVE_EPSILON', 0.1))
+LIVE_FAN_EPSILON = float(os.environ.get('TEMP_MONITOR_LIVE_FAN_EPSILON', 10))
+
+live_encoder = LiveEncoder(LIVE_TEMP_EPSILON, LIVE_FAN_EPSILON)
+
+def encoded_body(key, snapshot, build):
+    """Get the cached (body, gzipped_body) for an endpoint at this snapshot"""
+    return response_cache.get(key, snapshot.sequence, lambda: build(snapshot))
+
+def cached_json(key, build, snapshot=None, content_type='application/json'):
+    """Serve an endpoint's JSON from the response cache
+
+    build(snapshot) returns the payload; it only runs once per tick.
+    """
+    if snapshot is None:
+        snapshot = get_monitor().snapshot
+    body, gzipped = encoded_body(key, snapshot, build)
+    if request.accept_encodings['gzip']:
+        response = app.response_class(gzipped, content_type=content_type)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = app.response_class(body, content_type=content_type)
+    response.vary.add('Accept-Encoding')
+    return response
+
+def record_request(route, seconds, snapshot):
+    """Account one request's handling time and the age of the sample it was served from"""
+    request_timings.observe(route, seconds)
+    if snapshot.monotonic is not None:
+        sample_ages.observe(route, time.monotonic() - snapshot.monotonic)
+
+@app.before_request
+def start_request_timer():
+    request.environ['temp_monitor.started'] = time.perf_counter()
+
+@app.after_request
+def record_request_timing(response):
+    started = request.environ.get('temp_monitor.started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        record_request(route, time.perf_counter() - started, get_monitor().snapshot)
+    return response
+
+def send_asset(asset, cache_control):
+    """Send a compiled asset in the best encoding the client accepts
+
+    The precompressed file goes out as is (with sendfile where the server
+    supports it), and a matching If-None-Match gets a 304.
+    """
+    encoding, path, _, etag = asset.variant(request.headers.get('Accept-Encoding', ''))
+    response = send_file(path, mimetype=asset.content_type, etag=etag)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = cache_control
+    return response
 
 @app.route('/')
 def index():
-    """Serve the main HTML page"""
-    return render_template_string(HTML_TEMPLATE)
+    """Serve the main HTML page, revalidated on every load by ETag"""
+    return send_asset(get_dashboard().index, 'no-cache')
+
+@app.route('/assets/<name>')
+def get_asset(name):
+    """Serve the dashboard's stylesheet and scripts under content-hashed names"""
+    asset = get_dashboard().assets.get(name)
+    if asset is None:
+        return error_response('Not found', 404)
+    return send_asset(asset, IMMUTABLE)
+
+def temperature_payload(snapshot):
+    return {
+        'temperature': snapshot.temperature,
+        'timestamp': snapshot.timestamp,
+        'status': 'success'
+    }
+
+def all_temperatures_payload(snapshot):
+    return {
+        'zones': snapshot.zones,
+        'timestamp': snapshot.timestamp,
+        'status': 'success'
+    }
+
+def stats_payload(snapshot):
+    return {
+        'stats': snapshot.stats,
+        'history_count': snapshot.history_count,
+        'sampler': get_monitor().sampler_info(),
+        'timestamp': snapshot.timestamp,
+        'status': 'success'
+    }
+
+def snapshot_payload(snapshot):
+    return dict(snapshot.to_dict(), status='success')
+
+def zones_payload(snapshot):
+    monitor = get_monitor()
+    return {
+        'zones': [
+            dict(zone.to_dict(), health=monitor.health_info(zone.path))
+            for zone in monitor.thermal_zones
+        ],
+        'count': len(monitor.thermal_zones),
+        'timestamp': snapshot.timestamp,
+        'status': 'success'
+    }
+
+def fans_payload(snapshot):
+    return {
+        'fans': snapshot.fans,
+        'timestamp': snapshot.timestamp,
+        'status': 'success'
+    }
+
+def fan_sensors_payload(snapshot):
+    monitor = get_monitor()
+    return {
+        'sensors': [
+            dict(fan.to_dict(), health=monitor.health_info(fan.path))
+            for fan in monitor.fan_sensors
+        ],
+        'count': len(monitor.fan_sensors),
+        'timestamp': snapshot.timestamp,
+        'status': 'success'
+    }
+
+def metrics_payload(snapshot):
+    return render_metrics(snapshot, get_monitor())
+
+def sensors_payload(snapshot, criteria):
+    monitor = get_monitor()
+    registry = monitor.registry
+    return {
+        'sensors': [
+            dict(sensor.to_dict(), health=monitor.health_info(sensor.path))
+            for sensor in registry.find(**criteria)
+        ],
+        'devices': registry.values('device'),
+        'count': len(registry),
+        'timestamp': snapshot.timestamp,
+        'status': 'success'
+    }
+
+def sensors_query(args):
+    """Parse /api/sensors parameters into (cache key, payload builder)"""
+    criteria = {field: args.get(field) for field in SensorRegistry.INDEXED}
+    if criteria['kind'] not in (None, 'zone', 'temp', 'fan'):
+        raise QueryError("kind must be one of zone, temp, fan")
+    key = 'sensors:' + ':'.join(str(criteria[field]) for field in SensorRegistry.INDEXED)
+    return key, lambda snapshot: sensors_payload(snapshot, criteria)
+
+def alerts_payload(snapshot, since):
+    monitor = get_monitor()
+    alerts = snapshot.derived.get('alerts') or {'active': [], 'last_event_id': 0}
+    return {
+        'active': alerts['active'],
+        'events': monitor.alert_events(since or 0),
+        'last_event_id': alerts['last_event_id'],
+        'rules': monitor.alert_rules(),
+        'timestamp': snapshot.timestamp,
+        'status': 'success'
+    }
+
+def alerts_query(args):
+    """Parse /api/alerts parameters into (cache key, payload builder)
+
+    since is the id of the last event the client has seen; only newer
+    events are returned (by default every event still in the log).
+    """
+    since = int_arg(args, 'since')
+    return f"alerts:{since}", lambda snapshot: alerts_payload(snapshot, since)
+
+def cache_stats_payload():
+    return {
+        'cache': response_cache.info(),
+        'timestamp': datetime.now().isoformat(),
+        'status': 'success'
+    }
+
+def instrumentation_payload():
+    """Timings of the sampler, every sensor read, every route and the response cache"""
+    monitor = get_monitor()
+    snapshot = monitor.snapshot
+    return {
+        'sampler': monitor.sampler_info(),
+        'reads': monitor.read_latency_info(),
+        'requests': request_timings.info(),
+        'sample_age': dict(
+            current_ms=None if snapshot.monotonic is None else (time.monotonic() - snapshot.monotonic) * 1000,
+            routes=sample_ages.info()
+        ),
+        'serialization': {
+            'build': response_cache.build_timings.info(),
+            'encode': response_cache.encode_timings.info()
+        },
+        'timestamp': datetime.now().isoformat(),
+        'status': 'success'
+    }
+
+# Parameterless JSON endpoints served from the response cache:
+# path -> (cache key, payload builder)
+CACHED_ROUTES = {
+    '/api/temperature': ('temperature', temperature_payload),
+    '/api/all-temperatures': ('all-temperatures', all_temperatures_payload),
+    '/api/stats': ('stats', stats_payload),
+    '/api/zones': ('zones', zones_payload),
+    '/api/fans': ('fans', fans_payload),
+    '/api/fan-sensors': ('fan-sensors', fan_sensors_payload)
+}
+
+def snapshot_event(snapshot, body=None):
+    """Encode a snapshot as a Server-Sent Event, sharing /api/snapshot's body"""
+    if body is None:
+        body, _ = encoded_body('snapshot', snapshot, snapshot_payload)
+    return b"id: %d\nevent: snapshot\ndata: %s\n\n" % (snapshot.sequence, body)
+
+def live_frame(monitor, snapshot):
+    """Delta-encode a snapshot for /api/live (see LiveEncoder)"""
+    # Read the version before the sensor lists: they are replaced first
+    version = monitor.inventory_version
+    return live_encoder.encode(snapshot, version, monitor.thermal_zones, monitor.fan_sensors)
+
+def alert_events_since(monitor, last_id):
+    """Encode the alert events logged after last_id; returns (bytes, id of the newest)"""
+    events = monitor.alert_events(last_id)
+    if not events:
+        return b'', last_id
+    return b''.join(encode_event('alert', event, event['id']) for event in events), events[-1]['id']
+
+def resume_sequence(snapshot, last_id):
+    """Sequence a reconnecting /api/stream client resumes after
+
+    An id ahead of the current sequence was issued before a restart, which
+    starts counting again; like no id at all, it gets the latest snapshot.
+    """
+    return last_id if last_id is not None and last_id <= snapshot.sequence else -1
+
+def resume_alert_event(snapshot, last_id):
+    """Alert event id a reconnecting /api/alerts/stream client resumes after
+
+    A new client starts at the newest event. An id ahead of the log was
+    issued before a restart: everything logged since is new to the client.
+    """
+    newest = (snapshot.derived.get('alerts') or {}).get('last_event_id', 0)
+    if last_id is None:
+        return newest
+    return last_id if last_id <= newest else 0
+
+def active_alerts_event(snapshot):
+    """Encode the alerts firing as of snapshot, sent first on /api/alerts/stream"""
+    alerts = snapshot.derived.get('alerts') or {'active': [], 'last_event_id': 0}
+    return encode_event('active', alerts)
+
+class QueryError(ValueError):
+    """Invalid query parameters; carries the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def int_arg(args, name):
+    value = args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise QueryError(f"Invalid query: {name} must be an integer")
+
+def time_arg(args, name):
+    """Read a time query parameter given as epoch milliseconds or ISO-8601"""
+    value = args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+    except ValueError as e:
+        raise QueryError(f"Invalid query: {name}: {e}")
+
+def history_query(args):
+    """Parse /api/history parameters into (cache key, payload builder)
+
+    Query parameters (all optional):
+      sensor      history column, e.g. cpu, zone:0 or fan:nct6775.656:nct6775_1 (default cpu)
+      resolution  raw, 1m or 1h; rollups carry each bucket's min/max too
+      start, end  time range, as epoch milliseconds or ISO-8601
+      since       cursor from a previous response; only newer points are returned
+      max_points  downsample to at most this many points with LTTB
+    Without start, end or since the newest 100 points are returned. The
+    response's cursor can be passed back as since to fetch only the delta.
+    """
+    monitor = get_monitor()
+    sensor = args.get('sensor', 'cpu')
+    resolution = args.get('resolution', 'raw')
+    start = time_arg(args, 'start')
+    end = time_arg(args, 'end')
+    since = int_arg(args, 'since')
+    max_points = int_arg(args, 'max_points')
+    if max_points is not None and max_points < 2:
+        raise QueryError("Invalid history query: max_points must be at least 2")
+
+    if resolution == 'raw':
+        store = monitor.history
+    elif resolution in monitor.rollups:
+        store = monitor.rollups[resolution].store
+    else:
+        raise QueryError(f"Unknown resolution {resolution!r}")
+    if sensor not in monitor.history.keys():
+        raise QueryError(f"Unknown sensor {sensor!r}", 404)
+
+    last = HISTORY_RESPONSE_LIMIT if start is None and end is None and since is None else None
+    field = 'speed' if sensor.startswith('fan:') else 'temperature'
+
+    def build(snapshot):
+        cursor = store.written
+        if resolution == 'raw':
+            points = monitor.history.series(sensor, start, end, since, last)
+        else:
+            points = monitor.rollups[resolution].series(sensor, start, end, since, last)
+        downsampled = max_points is not None and len(points) > max_points
+        if downsampled:
+            points = lttb(points, max_points, value_index=1 if resolution == 'raw' else 2)
+
+        if resolution == 'raw':
+            history = [
+                {'timestamp': format_timestamp(timestamp), field: round(value, 3)}
+                for timestamp, value in points
+            ]
+        else:
+            history = [
+                {
+                    'timestamp': format_timestamp(timestamp),
+                    field: round(average, 3),
+                    'min': round(low, 3),
+                    'max': round(high, 3)
+                }
+                for timestamp, low, average, high in points
+            ]
+        return {
+            'history': history,
+            'sensor': sensor,
+            'resolution': resolution,
+            'cursor': cursor,
+            'truncated': since is not None and since < store.oldest_cursor,
+            'downsampled': downsampled,
+            'timestamp': snapshot.timestamp,
+            'status': 'success'
+        }
+
+    return f"history:{resolution}:{sensor}:{start}:{end}:{since}:{max_points}", build
+
+def heatmap_query(args):
+    """Parse /api/heatmap parameters into (cache key, payload builder)
+
+    Query parameters (all optional):
+      group       core, ccd or package (default core)
+      stat        max or avg: how samples are combined into a tile (default max)
+      resolution  raw, 1m or auto (default); auto reads windows of more than
+                  HEATMAP_RAW_SAMPLES samples from the per-minute rollup
+      start, end  time range, as epoch milliseconds or ISO-8601
+      max_points  time tiles to return (default HEATMAP_TILES)
+    Percentiles are per column over the window at the resolution used.
+    Tile and percentile values are integers in 1/scale degrees Celsius.
+    """
+    monitor = get_monitor()
+    group = args.get('group', 'core')
+    stat = args.get('stat', 'max')
+    resolution = args.get('resolution', 'auto')
+    start = time_arg(args, 'start')
+    end = time_arg(args, 'end')
+    tiles = int_arg(args, 'max_points')
+    if tiles is None:
+        tiles = HEATMAP_TILES
+    if not 1 <= tiles <= HEATMAP_MAX_TILES:
+        raise QueryError(f"Invalid query: max_points must be between 1 and {HEATMAP_MAX_TILES}")
+    if group not in ('core', 'ccd', 'package'):
+        raise QueryError("group must be one of core, ccd, package")
+    if stat not in ('max', 'avg'):
+        raise QueryError("stat must be max or avg")
+    if resolution not in ('auto', 'raw', '1m'):
+        raise QueryError(f"Unknown resolution {resolution!r}")
+    if not hasattr(monitor, 'core_history'):
+        raise QueryError("Per-core history is only kept by the sampling process", 404)
+
+    def build(snapshot):
+        sensors = [zone for zone in monitor.thermal_zones if zone.group == group]
+        used = resolution
+        if used == 'auto':
+            raw_samples = monitor.core_history.count(start, end)
+            used = 'raw' if raw_samples <= HEATMAP_RAW_SAMPLES else '1m'
+        if used == 'raw':
+            store = monitor.core_history
+        else:
+            store = getattr(monitor.core_rollup, stat)
+        keys = [sensor.id for sensor in sensors if sensor.id in store.keys()]
+        timestamps, matrix = store.window(start, end, keys)
+        edges, rows = downsample(matrix, len(keys), tiles, stat)
+        return {
+            'columns': [
+                {'id': sensor.id, 'label': sensor.label, 'device': sensor.device}
+                for sensor in sensors if sensor.id in keys
+            ],
+            'timestamps': [format_timestamp(timestamps[edge]) for edge in edges],
+            'tiles': rows,
+            'percentiles': column_percentiles(matrix, len(keys)),
+            'scale': HEATMAP_SCALE,
+            'group': group,
+            'stat': stat,
+            'resolution': used,
+            'samples': len(timestamps),
+            'timestamp': snapshot.timestamp,
+            'status': 'success'
+        }
+
+    return f"heatmap:{group}:{stat}:{resolution}:{start}:{end}:{tiles}", build
+
+def error_response(message, status=400):
+    return jsonify({
+        'status': 'error',
+        'message': message
+    }), status
 
 @app.route('/api/temperature')
 def get_temperature():
     """Get current CPU temperature"""
-    return jsonify({
-        'temperature': thermal_monitor.stats['cpu_temp'],
-        'timestamp': datetime.now().isoformat(),
-        'status': 'success'
-    })
+    return cached_json('temperature', temperature_payload)
 
 @app.route('/api/all-temperatures')
 def get_all_temperatures():
     """Get temperatures from all thermal zones"""
-    return jsonify({
-        'zones': thermal_monitor.current_temps,
-        'timestamp': datetime.now().isoformat(),
-        'status': 'success'
-    })
+    return cached_json('all-temperatures', all_temperatures_payload)
 
 @app.route('/api/stats')
 def get_stats():
     """Get temperature statistics"""
-    return jsonify({
-        'stats': thermal_monitor.stats,
-        'history_count': len(thermal_monitor.temperature_history),
-        'timestamp': datetime.now().isoformat(),
-        'status': 'success'
-    })
+    return cached_json('stats', stats_payload)
+
+@app.route('/api/snapshot')
+def get_snapshot():
+    """Get temperature, stats, zones and fans from a single sampling tick
+
+    The response carries the tick's sequence number as its ETag. Clients
+    that send it back in If-None-Match (or pass ?since=<sequence>) get a
+    304 until the next tick has been sampled. Any other value, such as one
+    from before a restart, gets the current snapshot.
+    """
+    snapshot = get_monitor().snapshot
+    since = request.args.get('since', type=int)
+    if since is not None and since == snapshot.sequence:
+        response = app.response_class(status=304)
+    else:
+        response = cached_json('snapshot', snapshot_payload, snapshot)
+    response.set_etag(str(snapshot.sequence))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/api/stream')
+def stream():
+    """Push every new snapshot to the client as a Server-Sent Event
+
+    Each event carries the snapshot's sequence number as its id, so a
+    reconnecting client resumes via Last-Event-ID: it receives the latest
+    snapshot straight away if it missed any ticks, or waits for the next one
+    otherwise. Comments are sent as heartbeats while no samples arrive.
+    """
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('lastEventId', type=int)
+
+    monitor = get_monitor()
+
+    def generate():
+        last_sequence = resume_sequence(monitor.snapshot, last_id)
+        yield f"retry: {STREAM_RETRY_MS}\n\n".encode()
+        while True:
+            snapshot = monitor.wait_for_snapshot(last_sequence, STREAM_HEARTBEAT_INTERVAL)
+            if snapshot is None:
+                yield b": heartbeat\n\n"
+                continue
+            last_sequence = snapshot.sequence
+            yield snapshot_event(snapshot)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/live')
+def live():
+    """Push live updates as Server-Sent Events, sending only what changed
+
+    A 'meta' event lists the sensors once, a 'full' event sets every value,
+    and each tick after that is a 'delta' event with the sensors that moved
+    by more than TEMP_MONITOR_LIVE_EPSILON (TEMP_MONITOR_LIVE_FAN_EPSILON for
+    fans), by their index in the meta list. A client that missed a tick, or
+    reconnects, gets a full event again; see LiveEncoder for the format.
+    """
+    monitor = get_monitor()
+
+    def generate():
+        layout, last_sequence = None, -1
+        yield f"retry: {STREAM_RETRY_MS}\n\n".encode()
+        while True:
+            snapshot = monitor.wait_for_snapshot(last_sequence, STREAM_HEARTBEAT_INTERVAL)
+            if snapshot is None:
+                yield b": heartbeat\n\n"
+                continue
+            frame = live_frame(monitor, snapshot)
+            yield frame.events_for(layout, last_sequence)
+            layout, last_sequence = frame.layout, frame.sequence
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/alerts')
+def get_alerts():
+    """Get the alerts firing now, the event log and the rules in force"""
+    try:
+        key, build = alerts_query(request.args)
+    except QueryError as e:
+        return error_response(str(e), e.status)
+    return cached_json(key, build)
+
+@app.route('/api/alerts/stream')
+def alert_stream():
+    """Push alert events as Server-Sent Events as they are logged
+
+    An 'active' event with the alerts currently firing comes first, then an
+    'alert' event each time one fires or resolves, with the event's id from
+    the log. A client reconnecting with Last-Event-ID (or ?lastEventId=)
+    gets the events it missed that are still in the log first. Rules are
+    evaluated once per tick in the sampler, whatever the number of clients.
+    """
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('lastEventId', type=int)
+
+    monitor = get_monitor()
+
+    def generate():
+        snapshot = monitor.snapshot
+        last_event = resume_alert_event(snapshot, last_id)
+        yield f"retry: {STREAM_RETRY_MS}\n\n".encode() + active_alerts_event(snapshot)
+        last_sequence = snapshot.sequence
+        while True:
+            body, last_event = alert_events_since(monitor, last_event)
+            if body:
+                yield body
+            snapshot = monitor.wait_for_snapshot(last_sequence, STREAM_HEARTBEAT_INTERVAL)
+            if snapshot is None:
+                yield b": heartbeat\n\n"
+                continue
+            last_sequence = snapshot.sequence
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/api/history')
 def get_history():
-    """Get temperature history"""
-    return jsonify({
-        'history': list(thermal_monitor.temperature_history),
-        'timestamp': datetime.now().isoformat(),
-        'status': 'success'
-    })
+    """Get the history of one sensor (see history_query for parameters)"""
+    try:
+        key, build = history_query(request.args)
+    except QueryError as e:
+        return error_response(str(e), e.status)
+    return cached_json(key, build)
+
+@app.route('/api/heatmap')
+def get_heatmap():
+    """Get a time x core heatmap with per-core percentiles (see heatmap_query)"""
+    try:
+        key, build = heatmap_query(request.args)
+    except QueryError as e:
+        return error_response(str(e), e.status)
+    return cached_json(key, build)
 
 @app.route('/api/zones')
 def get_zones():
     """Get information about available thermal zones"""
-    return jsonify({
-        'zones': thermal_monitor.thermal_zones,
-        'count': len(thermal_monitor.thermal_zones),
-        'timestamp': datetime.now().isoformat(),
-        'status': 'success'
-    })
+    return cached_json('zones', zones_payload)
 
 @app.route('/api/fans')
 def get_fans():
     """Get current fan speeds"""
-    return jsonify({
-        'fans': thermal_monitor.current_fans,
-        'timestamp': datetime.now().isoformat(),
-        'status': 'success'
-    })
+    return cached_json('fans', fans_payload)
 
 @app.route('/api/fan-sensors')
 def get_fan_sensors():
     """Get information about available fan sensors"""
-    return jsonify({
-        'sensors': thermal_monitor.fan_sensors,
-        'count': len(thermal_monitor.fan_sensors),
-        'timestamp': datetime.now().isoformat(),
-        'status': 'success'
-    })
+    return cached_json('fan-sensors', fan_sensors_payload)
+
+@app.route('/api/sensors')
+def get_sensors():
+    """List known sensors, optionally filtered by kind, device, type and label
+
+    kind is 'zone' (thermal zone), 'temp' (hwmon temperature) or 'fan'.
+    """
+    try:
+        key, build = sensors_query(request.args)
+    except QueryError as e:
+        return error_response(str(e), e.status)
+    return cached_json(key, build)
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus text exposition of every sensor and the sampling loop
+
+    Rendered once per tick, like the JSON endpoints, so any number of
+    scrapers share the same bytes.
+    """
+    return cached_json('metrics', metrics_payload, content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/api/cache-stats')
+def get_cache_stats():
+    """Get hit/miss counters of the response cache"""
+    return jsonify(cache_stats_payload())
+
+@app.route('/api/instrumentation')
+def get_instrumentation():
+    """Get timings of the sampling loop, sensor reads and request handling"""
+    return jsonify(instrumentation_payload())
 
 # Claude.ai-inspired HTML Template with modern design
 HTML_TEMPLATE = '''
@@ -490,6 +1743,12 @@ HTML_TEMPLATE = '''
             color: var(--claude-text-secondary);
         }
 
+        .zone-detail {
+            margin-left: 6px;
+            font-size: 11px;
+            opacity: 0.7;
+        }
+
         .zone-temp {
             font-weight: 600;
             color: var(--claude-text-primary);
@@ -642,9 +1901,11 @@ HTML_TEMPLATE = '''
             <div class="card">
                 <div class="header">
                     <h2 class="title">Temperature History</h2>
+                    <p class="subtitle" id="renderTimings" hidden></p>
                 </div>
                 <div class="chart-container">
                     <canvas class="chart-canvas" id="temperatureChart"></canvas>
+                    <p class="subtitle" id="chartUnavailable" hidden>Chart.js could not be loaded; readings still update</p>
                     <div id="chartTooltip" class="tooltip">
                         <div class="tooltip-value" id="tooltipValue">--°C</div>
                         <div class="tooltip-time" id="tooltipTime">--</div>
@@ -654,74 +1915,98 @@ HTML_TEMPLATE = '''
         </div>
     </div>
 
-    <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
+    <script src="https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.js"></script>
     <script>
+        class RingBuffer {
+            // Fixed-size buffer of the newest values; pushing never allocates
+            constructor(capacity) {
+                this.values = new Float64Array(capacity).fill(NaN);
+                this.head = 0;   // slot the next value goes to
+                this.length = 0;
+            }
+
+            push(value) {
+                this.values[this.head] = value === null ? NaN : value;
+                this.head = (this.head + 1) % this.values.length;
+                this.length = Math.min(this.length + 1, this.values.length);
+            }
+
+            at(index) {
+                // index 0 is the oldest of the last capacity values
+                const value = this.values[(this.head + index) % this.values.length];
+                return Number.isNaN(value) ? null : value;
+            }
+        }
+
         class CPUTempMonitor {
             constructor() {
-                this.tempHistory = [];
                 this.maxHistory = 60; // Show last 60 seconds
+                this.tempHistory = new RingBuffer(this.maxHistory);
+                // Chart points, one per ring slot oldest first; x is seconds
+                // from now and never changes, only y is rewritten
+                this.chartPoints = Array.from({length: this.maxHistory},
+                    (_, index) => ({x: index - this.maxHistory + 1, y: null}));
+                // Time spent applying each update, DOM and chart included
+                this.frameTimes = new RingBuffer(600);
+                this.showTimings = new URLSearchParams(window.location.search).has('timings');
                 this.apiBase = '';
+                this.snapshotEtag = null;
+                this.lastSequence = -1;
+                // Sidebar rows by sensor id, kept across sensor list changes;
+                // valueCells holds each row's text node by sensor index
+                this.rows = new Map();
+                this.valueCells = [];
+                this.noFansRow = null;
+                this.shown = {};  // text and classes last written, by element id
+                this.temperatureSensors = 0;
+                this.layout = null;
+                this.pollLayout = null;
+                this.liveTemperature = null;
+                this.liveStats = null;
                 this.chart = null;
                 this.minTemp = 20;
                 this.maxTemp = 90;
                 
                 this.initChart();
-                this.startMonitoring();
+                this.loadHistory().then(() => this.startMonitoring());
             }
 
-            async readTemperature() {
+            async loadHistory() {
+                // Seed the chart with the samples the server already holds
                 try {
-                    const response = await fetch(`${this.apiBase}/api/temperature`);
-                    if (!response.ok) {
-                        throw new Error(`HTTP ${response.status}: ${response.statusText}`);
-                    }
+                    const start = Date.now() - this.maxHistory * 1000;
+                    const response = await fetch(
+                        `${this.apiBase}/api/history?start=${start}&max_points=${this.maxHistory}`);
+                    if (!response.ok) return;
                     const data = await response.json();
-                    return data.temperature;
+                    data.history.forEach(point => this.tempHistory.push(point.temperature));
+                    this.updateChart();
                 } catch (error) {
-                    console.error('Error reading temperature:', error);
-                    this.showError(`Failed to read temperature: ${error.message}`);
-                    return null;
+                    console.error('Error loading history:', error);
                 }
             }
 
-            async readStats() {
+            async readSnapshot() {
                 try {
-                    const response = await fetch(`${this.apiBase}/api/stats`);
-                    if (!response.ok) {
-                        throw new Error(`HTTP ${response.status}`);
+                    const headers = {};
+                    if (this.snapshotEtag) {
+                        headers['If-None-Match'] = this.snapshotEtag;
                     }
-                    const data = await response.json();
-                    return data.stats;
-                } catch (error) {
-                    console.error('Error reading stats:', error);
-                    return null;
-                }
-            }
-
-            async readAllTemperatures() {
-                try {
-                    const response = await fetch(`${this.apiBase}/api/all-temperatures`);
-                    if (!response.ok) {
-                        throw new Error(`HTTP ${response.status}`);
+                    const response = await fetch(`${this.apiBase}/api/snapshot`, {
+                        headers: headers,
+                        cache: 'no-store'
+                    });
+                    if (response.status === 304) {
+                        return null; // No new sample since the last one we saw
                     }
-                    const data = await response.json();
-                    return data.zones;
-                } catch (error) {
-                    console.error('Error reading all temperatures:', error);
-                    return null;
-                }
-            }
-
-            async readFanSpeeds() {
-                try {
-                    const response = await fetch(`${this.apiBase}/api/fans`);
                     if (!response.ok) {
-                        throw new Error(`HTTP ${response.status}`);
+                        throw new Error(`HTTP ${response.status}: ${response.statusText}`);
                     }
-                    const data = await response.json();
-                    return data.fans;
+                    this.snapshotEtag = response.headers.get('ETag');
+                    return await response.json();
                 } catch (error) {
-                    console.error('Error reading fan speeds:', error);
+                    console.error('Error reading snapshot:', error);
+                    this.showError(`Failed to read temperature: ${error.message}`);
                     return null;
                 }
             }
@@ -736,6 +2021,12 @@ HTML_TEMPLATE = '''
             }
 
             initChart() {
+                if (typeof Chart === 'undefined') {
+                    // No vendored copy and no CDN access: show everything but the chart
+                    document.getElementById('temperatureChart').hidden = true;
+                    document.getElementById('chartUnavailable').hidden = false;
+                    return;
+                }
                 const ctx = document.getElementById('temperatureChart').getContext('2d');
                 
                 // Destroy existing chart if it exists
@@ -743,13 +2034,14 @@ HTML_TEMPLATE = '''
                     this.chart.destroy();
                 }
                 
+                // Points are given already parsed and sorted, so Chart.js can
+                // skip parsing and decimate; updates are drawn without animation
                 this.chart = new Chart(ctx, {
                     type: 'line',
                     data: {
-                        labels: Array(this.maxHistory).fill(''),
                         datasets: [{
                             label: 'CPU Temperature',
-                            data: Array(this.maxHistory).fill(null),
+                            data: this.chartPoints,
                             borderColor: '#10a37f',
                             backgroundColor: 'rgba(16, 163, 127, 0.1)',
                             borderWidth: 2,
@@ -763,6 +2055,10 @@ HTML_TEMPLATE = '''
                     options: {
                         responsive: true,
                         maintainAspectRatio: false,
+                        animation: false,
+                        parsing: false,
+                        normalized: true,
+                        spanGaps: true,
                         scales: {
                             y: {
                                 min: this.minTemp,
@@ -777,15 +2073,18 @@ HTML_TEMPLATE = '''
                                 }
                             },
                             x: {
+                                type: 'linear',
+                                min: 1 - this.maxHistory,
+                                max: 0,
                                 grid: {
                                     display: false
                                 },
                                 ticks: {
-                                    callback: function(value, index, values) {
-                                        if (index === 0) return '60s ago';
-                                        if (index === values.length - 1) return 'Now';
-                                        if (index % 15 === 0) return (values.length - index) + 's';
-                                        return '';
+                                    stepSize: 15,
+                                    callback: (value) => {
+                                        if (value === 0) return 'Now';
+                                        if (value === 1 - this.maxHistory) return `${this.maxHistory}s ago`;
+                                        return `${-value}s`;
                                     }
                                 }
                             }
@@ -794,6 +2093,10 @@ HTML_TEMPLATE = '''
                             legend: {
                                 display: false
                             },
+                            decimation: {
+                                enabled: true,
+                                algorithm: 'min-max'
+                            },
                             tooltip: {
                                 enabled: false,
                                 external: (context) => {
@@ -806,11 +2109,10 @@ HTML_TEMPLATE = '''
                                     }
                                     
                                     // Set tooltip content
-                                    const value = context.tooltip.dataPoints[0].raw;
-                                    const index = context.tooltip.dataPoints[0].dataIndex;
-                                    const timeAgo = this.maxHistory - index - 1;
+                                    const point = context.tooltip.dataPoints[0].raw;
+                                    const timeAgo = -point.x;
                                     
-                                    document.getElementById('tooltipValue').textContent = value.toFixed(1) + '°C';
+                                    document.getElementById('tooltipValue').textContent = point.y.toFixed(1) + '°C';
                                     document.getElementById('tooltipTime').textContent = 
                                         timeAgo === 0 ? 'Just now' : `${timeAgo} second${timeAgo !== 1 ? 's' : ''} ago`;
                                     
@@ -843,13 +2145,20 @@ HTML_TEMPLATE = '''
             updateChart() {
                 if (!this.chart || this.tempHistory.length === 0) return;
                 
-                // Update chart data
-                this.chart.data.datasets[0].data = this.tempHistory;
+                // Copy the ring into the existing points, oldest first, and
+                // find the range on the way
+                let currentMin = Infinity;
+                let currentMax = -Infinity;
+                for (let index = 0; index < this.maxHistory; index++) {
+                    const value = this.tempHistory.at(index);
+                    this.chartPoints[index].y = value;
+                    if (value !== null) {
+                        currentMin = Math.min(currentMin, value);
+                        currentMax = Math.max(currentMax, value);
+                    }
+                }
                 
                 // Adjust y-axis scale if needed
-                const currentMin = Math.min(...this.tempHistory);
-                const currentMax = Math.max(...this.tempHistory);
-                
                 if (currentMin < this.minTemp || currentMax > this.maxTemp) {
                     this.minTemp = Math.max(0, Math.floor(currentMin / 10) * 10);
                     this.maxTemp = Math.min(100, Math.ceil(currentMax / 10) * 10);
@@ -857,88 +2166,272 @@ HTML_TEMPLATE = '''
                     this.chart.options.scales.y.max = this.maxTemp;
                 }
                 
-                this.chart.update();
+                this.chart.update('none');
+            }
+
+            setText(id, text) {
+                // Write to the DOM only when the text actually changes
+                if (this.shown[id] !== text) {
+                    this.shown[id] = text;
+                    document.getElementById(id).textContent = text;
+                }
+            }
+
+            setClass(id, className) {
+                const key = `${id}.class`;
+                if (this.shown[key] !== className) {
+                    this.shown[key] = className;
+                    document.getElementById(id).className = className;
+                }
             }
 
-            updateDisplay(temp, stats, allTemps, fanSpeeds) {
+            updateDisplay(temp, stats) {
                 // Update main temperature display
-                const tempValue = document.getElementById('tempValue');
-                const statusBadge = document.getElementById('statusBadge');
-                const statusText = document.getElementById('statusText');
-                
-                tempValue.textContent = Math.round(temp);
+                this.setText('tempValue', String(Math.round(temp)));
 
                 // Update temperature class
-                tempValue.className = 'temp-value';
                 if (temp > 70) {
-                    tempValue.classList.add('temp-hot');
+                    this.setClass('tempValue', 'temp-value temp-hot');
                 } else if (temp > 55) {
-                    tempValue.classList.add('temp-warm');
+                    this.setClass('tempValue', 'temp-value temp-warm');
                 } else {
-                    tempValue.classList.add('temp-normal');
+                    this.setClass('tempValue', 'temp-value temp-normal');
                 }
 
                 // Update status badge
-                statusBadge.className = 'status-badge';
                 if (temp > 75) {
-                    statusBadge.classList.add('status-hot');
-                    statusText.textContent = 'High Temperature';
+                    this.setClass('statusBadge', 'status-badge status-hot');
+                    this.setText('statusText', 'High Temperature');
                 } else if (temp > 60) {
-                    statusBadge.classList.add('status-warm');
-                    statusText.textContent = 'Elevated Temperature';
+                    this.setClass('statusBadge', 'status-badge status-warm');
+                    this.setText('statusText', 'Elevated Temperature');
                 } else {
-                    statusBadge.classList.add('status-normal');
-                    statusText.textContent = 'Normal Operation';
+                    this.setClass('statusBadge', 'status-badge status-normal');
+                    this.setText('statusText', 'Normal Operation');
                 }
 
                 // Update stats
                 if (stats) {
-                    document.getElementById('avgTemp').textContent = Math.round(stats.avg_temp) + '°C';
-                    document.getElementById('maxTemp').textContent = Math.round(stats.max_temp) + '°C';
-                    document.getElementById('minTemp').textContent = Math.round(stats.min_temp) + '°C';
+                    this.setText('avgTemp', Math.round(stats.avg_temp) + '°C');
+                    this.setText('maxTemp', Math.round(stats.max_temp) + '°C');
+                    this.setText('minTemp', Math.round(stats.min_temp) + '°C');
                 }
+            }
 
-                // Update thermal zones
-                if (allTemps) {
-                    const zonesList = document.getElementById('zonesList');
-                    const zoneCount = document.getElementById('zoneCount');
-                    
-                    zonesList.innerHTML = '';
-                    zoneCount.textContent = Object.keys(allTemps).length;
-                    
-                    Object.values(allTemps).forEach(zone => {
-                        const zoneItem = document.createElement('div');
-                        zoneItem.className = 'zone-item';
-                        zoneItem.innerHTML = `
-                            <div class="zone-name">${zone.type || 'Unknown'}</div>
-                            <div class="zone-temp">${Math.round(zone.temperature)}°C</div>
-                        `;
-                        zonesList.appendChild(zoneItem);
-                    });
-                }
+            createRow() {
+                const item = document.createElement('div');
+                item.className = 'zone-item';
+                const name = document.createElement('div');
+                name.className = 'zone-name';
+                const detail = document.createElement('span');
+                detail.className = 'zone-detail';
+                const value = document.createElement('div');
+                value.className = 'zone-temp';
+                item.append(name, value);
+                // Keep the text nodes, so updates only ever touch those
+                const row = {item, name: document.createTextNode(''), detail: document.createTextNode(''),
+                             value: document.createTextNode('--'), text: '--'};
+                name.append(row.name, detail);
+                detail.appendChild(row.detail);
+                value.appendChild(row.value);
+                return row;
+            }
 
-                // Update fan speeds
-                if (fanSpeeds) {
-                    const fansList = document.getElementById('fansList');
-                    fansList.innerHTML = '';
-                    
-                    if (Object.keys(fanSpeeds).length === 0) {
-                        fansList.innerHTML = '<div class="zone-item"><div class="zone-name">No fans detected</div></div>';
-                    } else {
-                        Object.values(fanSpeeds).forEach(fan => {
-                            const fanItem = document.createElement('div');
-                            fanItem.className = 'zone-item';
-                            fanItem.innerHTML = `
-                                <div class="zone-name">${fan.label || fan.device}</div>
-                                <div class="zone-temp">${fan.speed} RPM</div>
-                            `;
-                            fansList.appendChild(fanItem);
-                        });
+            renderSensorLists(sensors, temperatureSensors) {
+                // One row per sensor, temperatures first; values are filled in
+                // by setSensorValue as updates arrive. Rows are keyed by sensor
+                // id, so sensors still present keep their elements.
+                const zonesList = document.getElementById('zonesList');
+                const fansList = document.getElementById('fansList');
+                const rows = new Map();
+                this.temperatureSensors = temperatureSensors;
+                this.valueCells = sensors.map((sensor, index) => {
+                    const isTemperature = index < temperatureSensors;
+                    const key = `${isTemperature ? 'temp' : 'fan'}:${sensor.id}`;
+                    const row = this.rows.get(key) || this.createRow();
+                    // Labels tell inputs of one chip apart (Core 0, Core 1); the
+                    // chip's type or device follows in smaller print
+                    const name = sensor.label || sensor.name || sensor.device || 'Unknown';
+                    let detail = (isTemperature ? sensor.type : sensor.device) || '';
+                    if (detail === name) detail = '';
+                    if (row.name.data !== name) {
+                        row.name.data = name;
+                    }
+                    if (row.detail.data !== detail) {
+                        row.detail.data = detail;
                     }
+                    // Appending moves an existing row into its new place
+                    (isTemperature ? zonesList : fansList).appendChild(row.item);
+                    rows.set(key, row);
+                    return row;
+                });
+                for (const [key, row] of this.rows) {
+                    if (!rows.has(key)) row.item.remove();
+                }
+                this.rows = rows;
+                this.setText('zoneCount', String(temperatureSensors));
+
+                if (!this.noFansRow) {
+                    this.noFansRow = this.createRow();
+                    this.noFansRow.name.data = 'No fans detected';
+                    this.noFansRow.value.data = '';
+                }
+                if (sensors.length === temperatureSensors) {
+                    fansList.appendChild(this.noFansRow.item);
+                } else {
+                    this.noFansRow.item.remove();
+                }
+            }
+
+            setSensorValue(index, value) {
+                const row = this.valueCells[index];
+                if (!row) return;
+                let text = '--';
+                if (value !== null) {
+                    text = index < this.temperatureSensors ? `${Math.round(value)}°C` : `${value} RPM`;
+                }
+                if (row.text !== text) {
+                    row.text = text;
+                    row.value.data = text;
+                }
+            }
+
+            applyTick(sequence, temp, stats) {
+                // Ignore anything older than what is already on screen
+                if (sequence <= this.lastSequence) return;
+                this.lastSequence = sequence;
+
+                this.tempHistory.push(temp);
+                this.updateDisplay(temp, stats);
+                this.updateChart();
+            }
+
+            timed(update) {
+                // Run one update and record how long it took, rendering included
+                const started = performance.now();
+                const result = update();
+                this.frameTimes.push(performance.now() - started);
+                if (this.showTimings && this.frameTimes.length % 10 === 0) {
+                    const timings = this.frameStats();
+                    const element = document.getElementById('renderTimings');
+                    element.hidden = false;
+                    element.textContent = `Updates take ${timings.p50_ms.toFixed(2)} ms ` +
+                        `(p99 ${timings.p99_ms.toFixed(2)} ms) over the last ${timings.frames}`;
+                }
+                return result;
+            }
+
+            frameStats() {
+                // Percentiles of recent update times; add ?timings to the URL to show them
+                const times = [];
+                for (let index = 0; index < this.frameTimes.values.length; index++) {
+                    const value = this.frameTimes.at(index);
+                    if (value !== null) times.push(value);
+                }
+                times.sort((a, b) => a - b);
+                const at = (point) => times.length ? times[Math.min(times.length - 1, Math.floor(point * times.length))] : null;
+                return {frames: times.length, p50_ms: at(0.5), p99_ms: at(0.99), max_ms: at(1)};
+            }
+
+            applySnapshot(snapshot) {
+                // A complete snapshot from /api/snapshot; the rows are only
+                // rearranged when the set of sensors differs from the last one.
+                // Polls never overlap, so an older sequence means the server
+                // restarted and counts from 1 again
+                if (snapshot.sequence === this.lastSequence) return;
+                if (snapshot.sequence < this.lastSequence) this.lastSequence = -1;
+                const zones = Object.entries(snapshot.zones);
+                const fans = Object.entries(snapshot.fans);
+                const layout = JSON.stringify(zones.concat(fans).map(([id]) => id));
+                if (layout !== this.pollLayout) {
+                    this.pollLayout = layout;
+                    this.renderSensorLists(
+                        zones.concat(fans).map(([id, sensor]) => Object.assign({id}, sensor)), zones.length);
+                }
+                zones.forEach(([, zone], index) => this.setSensorValue(index, zone.temperature));
+                fans.forEach(([, fan], index) => this.setSensorValue(zones.length + index, fan.speed));
+                this.applyTick(snapshot.sequence, snapshot.temperature, snapshot.stats);
+            }
+
+            applyMeta(meta) {
+                // Starts every connection, maybe to a restarted server whose
+                // sequences begin at 1 again: take the next full as it comes
+                this.lastSequence = -1;
+                this.layout = meta.layout;
+                this.renderSensorLists(meta.sensors, meta.temperature_sensors);
+            }
+
+            applyFull(full) {
+                // Sets every value; returns false if it does not match our sensor list
+                if (full.layout !== this.layout) return false;
+                full.values.forEach((value, index) => this.setSensorValue(index, value));
+                this.liveTemperature = full.temperature;
+                this.liveStats = full.stats;
+                this.lastSequence = -1;  // a full is never stale within its stream
+                this.applyTick(full.sequence, full.temperature, full.stats);
+                return true;
+            }
+
+            applyDelta(delta) {
+                // Changes since delta.base; returns false if we missed that update
+                if (delta.base !== this.lastSequence) return false;
+                delta.changes.forEach(([index, value]) => this.setSensorValue(index, value));
+                if ('temperature' in delta) this.liveTemperature = delta.temperature;
+                if ('stats' in delta) this.liveStats = delta.stats;
+                this.applyTick(delta.sequence, this.liveTemperature, this.liveStats);
+                return true;
+            }
+
+            startMonitoring() {
+                if (!window.EventSource) {
+                    this.startPolling();
+                    return;
                 }
+
+                // Changes are pushed as they are sampled: the sensor list once,
+                // then only the values that moved. Any gap (a missed update,
+                // or a sensor list we do not have) is repaired by reconnecting,
+                // which starts over with a full update; so does the browser's
+                // own reconnect. If the stream never manages to open, fall
+                // back to polling /api/snapshot.
+                let failures = 0;
+                let source = null;
+                const handle = (apply) => (event) => {
+                    try {
+                        if (!this.timed(() => apply(JSON.parse(event.data)))) {
+                            console.warn('Live update out of sequence, resynchronizing');
+                            source.close();
+                            open();
+                        }
+                    } catch (error) {
+                        console.error('Error applying live update:', error);
+                    }
+                };
+                const open = () => {
+                    source = new EventSource(`${this.apiBase}/api/live`);
+                    source.addEventListener('open', () => {
+                        failures = 0;
+                    });
+                    source.addEventListener('meta', handle((meta) => {
+                        this.applyMeta(meta);
+                        return true;
+                    }));
+                    source.addEventListener('full', handle((full) => this.applyFull(full)));
+                    source.addEventListener('delta', handle((delta) => this.applyDelta(delta)));
+                    source.addEventListener('error', onError);
+                };
+                const onError = () => {
+                    failures++;
+                    if (failures >= 3 || source.readyState === EventSource.CLOSED) {
+                        console.warn('Live stream unavailable, falling back to polling');
+                        source.close();
+                        this.startPolling();
+                    }
+                };
+                open();
             }
 
-            async startMonitoring() {
+            async startPolling() {
                 let updateInProgress = false;
                 
                 const update = async () => {
@@ -950,21 +2443,10 @@ HTML_TEMPLATE = '''
                     updateInProgress = true;
                     
                     try {
-                        const [temp, stats, allTemps, fanSpeeds] = await Promise.all([
-                            this.readTemperature(),
-                            this.readStats(),
-                            this.readAllTemperatures(),
-                            this.readFanSpeeds()
-                        ]);
+                        const snapshot = await this.readSnapshot();
                         
-                        if (temp !== null) {
-                            this.tempHistory.push(temp);
-                            if (this.tempHistory.length > this.maxHistory) {
-                                this.tempHistory.shift();
-                            }
-                            
-                            this.updateDisplay(temp, stats, allTemps, fanSpeeds);
-                            this.updateChart();
+                        if (snapshot !== null) {
+                            this.timed(() => this.applySnapshot(snapshot));
                         }
                         
                     } catch (error) {
@@ -983,27 +2465,67 @@ HTML_TEMPLATE = '''
 
         // Initialize the monitor when page loads
         document.addEventListener('DOMContentLoaded', () => {
-            new CPUTempMonitor();
+            // Kept on window for inspection, e.g. temperatureMonitor.frameStats()
+            window.temperatureMonitor = new CPUTempMonitor();
         });
     </script>
 </body>
 </html>
 '''
 
+def run_sampler():
+    """Sample and publish to TEMP_MONITOR_DATA_DIR for HTTP worker processes"""
+    monitor = create_monitor()
+    if not isinstance(monitor, ThermalMonitor) or monitor.data_dir is None:
+        raise SystemExit("--sampler needs TEMP_MONITOR_DATA_DIR (e.g. /dev/shm/temp_monitor) "
+                         "and no TEMP_MONITOR_SHARED_DIR")
+    SnapshotPublisher(monitor, monitor.data_dir)
+    create_app(monitor)
+    print(f"Publishing samples to {monitor.data_dir}")
+    print("Serve them with any number of workers, e.g.:")
+    print(f"  TEMP_MONITOR_SHARED_DIR={monitor.data_dir} gunicorn -w 4 -b 0.0.0.0:5000 app:app")
+    print("\nPress Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="CPU temperature monitor")
+    parser.add_argument('--sampler', action='store_true',
+                        help="only sample and publish to shared memory for multi-worker serving")
+    args = parser.parse_args()
+    if args.sampler:
+        run_sampler()
+        raise SystemExit
+
+    create_app()
+    monitor = get_monitor()
     print("Enhanced CPU Temperature Monitor Backend")
     print("=" * 40)
-    print(f"Thermal zones discovered: {len(thermal_monitor.thermal_zones)}")
-    print(f"Fan sensors discovered: {len(thermal_monitor.fan_sensors)}")
+    print(f"Thermal zones discovered: {len(monitor.thermal_zones)}")
+    print(f"Fan sensors discovered: {len(monitor.fan_sensors)}")
     print("\nStarting Flask server...")
     print("Access the monitor at: http://localhost:5000")
     print("API endpoints:")
+    print("  - /api/snapshot - Temperature, stats, zones and fans from one tick")
+    print("  - /api/stream - Live snapshots as Server-Sent Events")
+    print("  - /api/live - Live changes only, as Server-Sent Events")
     print("  - /api/temperature - Current CPU temperature")
     print("  - /api/stats - Temperature statistics")
     print("  - /api/all-temperatures - All thermal zones")
     print("  - /api/zones - Thermal zone information")
     print("  - /api/fans - Current fan speeds")
     print("  - /api/fan-sensors - Fan sensor information")
+    print("  - /api/sensors - All sensors, filterable by kind/device/type/label")
+    print("  - /api/heatmap - Per-core temperature heatmap")
+    print("  - /metrics - Prometheus metrics")
+    print("  - /api/instrumentation - Sampler, sensor read and request timings")
+    print("  - /api/alerts - Firing alerts, alert event log and rules")
+    print("  - /api/alerts/stream - Alert events as Server-Sent Events")
     print("\nPress Ctrl+C to stop")
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # The monitor is already sampling in this process: a reloader would run
+    # the script again in a child and sample twice
+    app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
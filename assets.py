@@ -0,0 +1,212 @@
+import argparse
+import gzip
+import hashlib
+import os
+import re
+import urllib.request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; assets are then served gzipped only
+    brotli = None
+
+# Chart.js release the dashboard is written against
+CHARTJS_VERSION = '4.4.1'
+CHARTJS_URL = f"https://cdn.jsdelivr.net/npm/chart.js@{CHARTJS_VERSION}/dist/chart.umd.js"
+# Vendored copy of Chart.js, served with the dashboard (see fetch_chartjs)
+CHARTJS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vendor', 'chart.umd.js')
+# SHA-256 (hex) of the vendored file, committed next to it; a copy that does
+# not match is not served
+CHARTJS_HASH_PATH = f"{CHARTJS_PATH}.sha256"
+# URL prefix of the compiled assets
+ASSET_PREFIX = '/assets/'
+# Cache-Control of content-hashed assets: a new version gets a new URL
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+CONTENT_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'text/javascript; charset=utf-8'
+}
+
+# The Chart.js script tag of the page template, and its inline stylesheet and script
+CHARTJS_TAG = re.compile(r'<script src="[^"]*chart\.js[^"]*"></script>')
+INLINE_STYLE = re.compile(r'<style>\n(.*?)</style>', re.DOTALL)
+INLINE_SCRIPT = re.compile(r'<script>\n(.*?)</script>', re.DOTALL)
+
+class Asset:
+    """A compiled file plus its precompressed variants, written to disk once
+
+    variants maps each Content-Encoding ('identity', 'gzip' and, with the
+    brotli module, 'br') to the file holding it and its bytes; the
+    compressed ones are only kept when they are smaller. etag is the
+    content hash, which also goes into the file (and URL) name.
+    """
+
+    __slots__ = ('name', 'content_type', 'etag', 'variants')
+
+    def __init__(self, name, body, directory):
+        stem, extension = os.path.splitext(name)
+        self.etag = hashlib.sha256(body).hexdigest()[:16]
+        self.name = f"{stem}.{self.etag}{extension}"
+        self.content_type = CONTENT_TYPES[extension]
+        self.variants = {'identity': (write_once(os.path.join(directory, self.name), body), body)}
+        compressed = {'gzip': ('.gz', gzip.compress(body, 9, mtime=0))}
+        if brotli is not None:
+            compressed['br'] = ('.br', brotli.compress(body, quality=11))
+        for encoding, (suffix, data) in compressed.items():
+            if len(data) < len(body):
+                self.variants[encoding] = (write_once(os.path.join(directory, self.name + suffix), data), data)
+
+    @property
+    def url(self):
+        return ASSET_PREFIX + self.name
+
+    def variant(self, accept_encoding):
+        """(encoding, path, body, etag) to send for an Accept-Encoding header"""
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in self.variants:
+                path, body = self.variants[encoding]
+                return encoding, path, body, f"{self.etag}-{encoding}"
+        path, body = self.variants['identity']
+        return 'identity', path, body, self.etag
+
+def accepted_encodings(header):
+    """Content codings an Accept-Encoding header allows (q=0 excluded)"""
+    codings = set()
+    for part in header.split(','):
+        coding, _, parameters = part.partition(';')
+        parameters = parameters.replace(' ', '')
+        if parameters.startswith('q='):
+            try:
+                if float(parameters[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        codings.add(coding.strip().lower())
+    return codings
+
+def write_once(path, data):
+    """Write data to path unless it is already there; returns path
+
+    Names carry a content hash, so an existing file already holds data.
+    The file is written under a temporary name and renamed, so processes
+    sharing the directory never see a partial one.
+    """
+    if not os.path.exists(path):
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+    return path
+
+class Dashboard:
+    """The dashboard page compiled into static, content-hashed assets
+
+    The page template's inline stylesheet and script become files of their
+    own, and the page links to them and to the vendored Chart.js by hashed
+    URL, so browsers can keep them forever (IMMUTABLE) and a reload only
+    revalidates the small page itself. Once Chart.js is pinned, a vendored
+    copy that is missing or does not match fails the build; only a tree
+    that has never vendored it falls back to loading CHARTJS_URL from the
+    CDN.
+    """
+
+    def __init__(self, template, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.assets = {}
+        page = template
+
+        match = INLINE_STYLE.search(page)
+        if match:
+            stylesheet = self.add('dashboard.css', match.group(1).encode('utf-8'), directory)
+            page = page[:match.start()] + f'<link rel="stylesheet" href="{stylesheet.url}">' + page[match.end():]
+        match = INLINE_SCRIPT.search(page)
+        if match:
+            script = self.add('dashboard.js', match.group(1).encode('utf-8'), directory)
+            page = page[:match.start()] + f'<script src="{script.url}"></script>' + page[match.end():]
+
+        body = vendored_chartjs()
+        if body is not None:
+            chartjs_url = self.add('chart.umd.js', body, directory).url
+        else:
+            print(f"Chart.js is not vendored at {CHARTJS_PATH}; the dashboard loads it from "
+                  f"{CHARTJS_URL} (run `python3 assets.py fetch-chartjs` to vendor it)")
+            chartjs_url = CHARTJS_URL
+        page = CHARTJS_TAG.sub(lambda _: f'<script src="{chartjs_url}"></script>', page)
+
+        self.index = Asset('index.html', page.encode('utf-8'), directory)
+
+    def add(self, name, body, directory):
+        asset = Asset(name, body, directory)
+        self.assets[asset.name] = asset
+        return asset
+
+    def get(self, path):
+        """The asset served at a URL path, or None"""
+        if path == '/':
+            return self.index
+        if path.startswith(ASSET_PREFIX):
+            return self.assets.get(path[len(ASSET_PREFIX):])
+        return None
+
+def read_pinned_hash():
+    """The pinned SHA-256 of Chart.js from CHARTJS_HASH_PATH, or None"""
+    try:
+        with open(CHARTJS_HASH_PATH) as f:
+            return f.read().split()[0].lower()
+    except (FileNotFoundError, IndexError):
+        return None
+
+def vendored_chartjs():
+    """The vendored Chart.js, or None if it has never been vendored
+
+    Raises RuntimeError when the pinned copy is missing or does not match
+    its hash, or when a copy has no pin.
+    """
+    pinned = read_pinned_hash()
+    try:
+        with open(CHARTJS_PATH, 'rb') as f:
+            body = f.read()
+    except FileNotFoundError:
+        if pinned is None:
+            return None
+        raise RuntimeError(f"Chart.js is pinned in {CHARTJS_HASH_PATH} but missing from {CHARTJS_PATH}")
+    if pinned is None:
+        raise RuntimeError(f"Chart.js at {CHARTJS_PATH} has no pinned hash in {CHARTJS_HASH_PATH} "
+                           f"(run `python3 assets.py fetch-chartjs` to record it)")
+    digest = hashlib.sha256(body).hexdigest()
+    if digest != pinned:
+        raise RuntimeError(f"Chart.js at {CHARTJS_PATH} has SHA-256 {digest}, not the {pinned} "
+                           f"pinned in {CHARTJS_HASH_PATH}")
+    return body
+
+def fetch_chartjs():
+    """Download the pinned Chart.js release into the vendor directory
+
+    The download must match CHARTJS_HASH_PATH. Without one, the hash of
+    this download is recorded there: commit both files together.
+    """
+    os.makedirs(os.path.dirname(CHARTJS_PATH), exist_ok=True)
+    with urllib.request.urlopen(CHARTJS_URL, timeout=30) as response:
+        body = response.read()
+    digest = hashlib.sha256(body).hexdigest()
+    pinned = read_pinned_hash()
+    if pinned is not None and digest != pinned:
+        raise SystemExit(f"Chart.js from {CHARTJS_URL} has SHA-256 {digest}, "
+                         f"not the {pinned} pinned in {CHARTJS_HASH_PATH}; not saved")
+    with open(CHARTJS_PATH, 'wb') as f:
+        f.write(body)
+    if pinned is None:
+        with open(CHARTJS_HASH_PATH, 'w') as f:
+            f.write(f"{digest}  chart.umd.js\n")
+        print(f"Pinned Chart.js {CHARTJS_VERSION} at SHA-256 {digest} in {CHARTJS_HASH_PATH}")
+    print(f"Saved Chart.js {CHARTJS_VERSION} ({len(body)} bytes) to {CHARTJS_PATH}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Dashboard asset tools")
+    parser.add_argument('command', choices=['fetch-chartjs'],
+                        help="fetch-chartjs: vendor the pinned Chart.js release")
+    args = parser.parse_args()
+    fetch_chartjs()
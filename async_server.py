@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+from app import (CACHED_ROUTES, METRICS_CONTENT_TYPE, STREAM_HEARTBEAT_INTERVAL, STREAM_RETRY_MS,
+                 QueryError, active_alerts_event, alert_events_since, alerts_query, cache_stats_payload,
+                 encoded_body, get_dashboard, get_monitor, heatmap_query, history_query,
+                 instrumentation_payload, live_encoder, live_frame, metrics_payload, record_request,
+                 response_cache, resume_alert_event, resume_sequence, sensors_query, snapshot_event,
+                 snapshot_payload)
+from assets import ASSET_PREFIX, IMMUTABLE
+from shm import POLL_INTERVAL
+
+# Largest request line plus headers accepted, in bytes
+MAX_REQUEST_HEAD = 8192
+# Largest request body read (and discarded), in bytes
+MAX_REQUEST_BODY = 65536
+# Idle keep-alive connections are closed after this many seconds
+KEEPALIVE_TIMEOUT = 75
+# Transport buffer per connection above which writes wait for the client
+WRITE_BUFFER_LIMIT = 64 * 1024
+
+STATUS_TEXT = {
+    200: 'OK',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    431: 'Request Header Fields Too Large'
+}
+
+class Request:
+    __slots__ = ('method', 'path', 'query', 'headers', 'keep_alive')
+
+    def __init__(self, method, path, query, headers, keep_alive):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.keep_alive = keep_alive
+
+def parse_request(head):
+    """Parse a request head into a Request, or return None if malformed"""
+    try:
+        lines = head.decode('latin-1').split('\r\n')
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        return None
+    if not version.startswith('HTTP/1.'):
+        return None
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(':')
+        if not sep:
+            return None
+        headers[name.strip().lower()] = value.strip()
+    url = urlsplit(target)
+    query = {}
+    for name, value in parse_qsl(url.query):
+        query.setdefault(name, value)
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.0':
+        keep_alive = connection == 'keep-alive'
+    else:
+        keep_alive = connection != 'close'
+    return Request(method, url.path, query, headers, keep_alive)
+
+class SampleBroadcaster:
+    """Wakes every stream connection once per published snapshot
+
+    All waiting streams share a single future that is resolved (and
+    replaced) when the sampler publishes, so the cost of a tick does not
+    depend on how many clients are connected beyond writing to them.
+    """
+
+    def __init__(self, loop, monitor):
+        self.loop = loop
+        self.monitor = monitor
+        self._next = loop.create_future()
+        if hasattr(monitor, 'listeners'):
+            # In-process ThermalMonitor: it calls us from the sampling thread
+            monitor.listeners.append(self._on_publish)
+        else:
+            # SharedMonitorClient: watch the shared segment instead
+            self._poller = loop.create_task(self._poll())
+
+    def _on_publish(self, snapshot):
+        self.loop.call_soon_threadsafe(self._wake, snapshot)
+
+    def _wake(self, snapshot):
+        future, self._next = self._next, self.loop.create_future()
+        future.set_result(snapshot)
+
+    async def _poll(self):
+        sequence = self.monitor.snapshot.sequence
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            snapshot = self.monitor.snapshot
+            if snapshot.sequence != sequence:
+                sequence = snapshot.sequence
+                self._wake(snapshot)
+
+    async def wait(self, after_sequence, timeout):
+        """Return a snapshot newer than after_sequence, or None on timeout"""
+        snapshot = self.monitor.snapshot
+        if snapshot.sequence > after_sequence:
+            return snapshot
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._next), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+class AsyncServer:
+    """Serves the monitor API from one event loop thread
+
+    Responses come from the same per-tick response cache as the Flask app,
+    so a request costs a cache lookup and a socket write. Cache misses are
+    built on the default executor, never on the loop, so a slow build only
+    delays the requests waiting for that response. Connections hold
+    no per-request state beyond a bounded read buffer and a bounded write
+    buffer, which lets one process keep thousands of idle dashboards and
+    event streams open.
+    """
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self.broadcaster = None
+        self.connections = 0
+        self.streams = 0
+        self.dashboard = get_dashboard()
+
+    async def start(self, host, port):
+        self.broadcaster = SampleBroadcaster(asyncio.get_running_loop(), self.monitor)
+        return await asyncio.start_server(self.handle, host, port, limit=MAX_REQUEST_HEAD,
+                                          backlog=4096)
+
+    async def handle(self, reader, writer):
+        writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_LIMIT)
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except asyncio.LimitOverrunError:
+                    await self.respond(writer, None, 431, self.error_body('Request head too large'))
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+
+                request = parse_request(head)
+                if request is None:
+                    await self.respond(writer, None, 400, self.error_body('Malformed request'))
+                    break
+                length = request.headers.get('content-length', '0')
+                if not length.isdigit() or int(length) > MAX_REQUEST_BODY:
+                    await self.respond(writer, None, 413, self.error_body('Request body not accepted'))
+                    break
+                if int(length):
+                    await reader.readexactly(int(length))
+
+                if not await self.dispatch(request, writer) or not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    @staticmethod
+    def error_body(message):
+        return json.dumps({'status': 'error', 'message': message}).encode('utf-8')
+
+    async def respond(self, writer, request, status, body=b'', gzipped=None,
+                      content_type='application/json', headers=()):
+        if (gzipped is not None and request is not None and
+                'gzip' in request.headers.get('accept-encoding', '')):
+            body = gzipped
+            headers = list(headers) + [('Content-Encoding', 'gzip')]
+        lines = [
+            f"HTTP/1.1 {status} {STATUS_TEXT[status]}",
+            f"Content-Length: {len(body)}",
+            "Access-Control-Allow-Origin: *"
+        ]
+        if status != 304:
+            lines.append(f"Content-Type: {content_type}")
+        if gzipped is not None:
+            lines.append("Vary: Accept-Encoding")
+        lines.extend(f"{name}: {value}" for name, value in headers)
+        if request is None or not request.keep_alive:
+            lines.append("Connection: close")
+        head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        if request is not None and request.method == 'HEAD':
+            body = b''
+        writer.write(head + body)
+        await writer.drain()
+
+    async def dispatch(self, request, writer):
+        """Answer one request; returns False if the connection was taken over"""
+        if request.method not in ('GET', 'HEAD'):
+            await self.respond(writer, request, 405, self.error_body('Method not allowed'),
+                               headers=[('Allow', 'GET, HEAD')])
+            return True
+
+        started = time.perf_counter()
+        path = route = request.path
+        if path == '/' or path.startswith(ASSET_PREFIX):
+            if path != '/':
+                route = ASSET_PREFIX + '<name>'
+            await self.send_asset(request, writer, path)
+        elif path in CACHED_ROUTES:
+            key, build = CACHED_ROUTES[path]
+            body, gzipped = await self.cached(key, self.monitor.snapshot, build)
+            await self.respond(writer, request, 200, body, gzipped)
+        elif path == '/api/snapshot':
+            await self.send_snapshot(request, writer)
+        elif path == '/api/history':
+            await self.send_history(request, writer, history_query)
+        elif path == '/api/heatmap':
+            await self.send_history(request, writer, heatmap_query)
+        elif path in ('/api/sensors', '/api/alerts'):
+            try:
+                key, build = (sensors_query if path == '/api/sensors' else alerts_query)(request.query)
+            except QueryError as e:
+                await self.respond(writer, request, e.status, self.error_body(str(e)))
+            else:
+                body, gzipped = await self.cached(key, self.monitor.snapshot, build)
+                await self.respond(writer, request, 200, body, gzipped)
+        elif path == '/metrics':
+            body, gzipped = await self.cached('metrics', self.monitor.snapshot, metrics_payload)
+            await self.respond(writer, request, 200, body, gzipped, METRICS_CONTENT_TYPE)
+        elif path == '/api/cache-stats':
+            await self.respond(writer, request, 200, json.dumps(cache_stats_payload()).encode('utf-8'))
+        elif path == '/api/instrumentation':
+            payload = await asyncio.get_running_loop().run_in_executor(None, instrumentation_payload)
+            await self.respond(writer, request, 200, json.dumps(payload).encode('utf-8'))
+        elif path in ('/api/stream', '/api/live'):
+            record_request(path, time.perf_counter() - started, self.monitor.snapshot)
+            await self.stream(request, writer, live=path == '/api/live')
+            return False
+        elif path == '/api/alerts/stream':
+            record_request(path, time.perf_counter() - started, self.monitor.snapshot)
+            await self.alert_stream(request, writer)
+            return False
+        else:
+            route = 'unmatched'
+            await self.respond(writer, request, 404, self.error_body('Not found'))
+        record_request(route, time.perf_counter() - started, self.monitor.snapshot)
+        return True
+
+    async def send_snapshot(self, request, writer):
+        snapshot = self.monitor.snapshot
+        etag = f'"{snapshot.sequence}"'
+        headers = [('ETag', etag), ('Cache-Control', 'no-cache')]
+        since = request.query.get('since', '')
+        not_modified = etag in request.headers.get('if-none-match', '')
+        if since.isdigit() and int(since) == snapshot.sequence:
+            not_modified = True
+        if not_modified:
+            await self.respond(writer, request, 304, headers=headers)
+            return
+        body, gzipped = await self.cached('snapshot', snapshot, snapshot_payload)
+        await self.respond(writer, request, 200, body, gzipped, headers=headers)
+
+    async def send_asset(self, request, writer, path):
+        """The dashboard page or one of its assets, as the Flask app serves them"""
+        asset = self.dashboard.get(path)
+        if asset is None:
+            await self.respond(writer, request, 404, self.error_body('Not found'))
+            return
+        encoding, _, body, etag = asset.variant(request.headers.get('accept-encoding', ''))
+        etag = f'"{etag}"'
+        headers = [('ETag', etag), ('Cache-Control', 'no-cache' if path == '/' else IMMUTABLE),
+                   ('Vary', 'Accept-Encoding')]
+        if encoding != 'identity':
+            headers.append(('Content-Encoding', encoding))
+        if etag in request.headers.get('if-none-match', ''):
+            await self.respond(writer, request, 304, headers=headers)
+            return
+        await self.respond(writer, request, 200, body, content_type=asset.content_type, headers=headers)
+
+    async def cached(self, key, snapshot, build):
+        """encoded_body(), with a cache miss built on the executor"""
+        cached = response_cache.peek(key, snapshot.sequence)
+        if cached is not None:
+            return cached
+        return await asyncio.get_running_loop().run_in_executor(None, encoded_body, key, snapshot, build)
+
+    async def send_history(self, request, writer, parse):
+        """Answer /api/history or /api/heatmap"""
+        try:
+            key, build = parse(request.query)
+        except QueryError as e:
+            await self.respond(writer, request, e.status, self.error_body(str(e)))
+            return
+        body, gzipped = await self.cached(key, self.monitor.snapshot, build)
+        await self.respond(writer, request, 200, body, gzipped)
+
+    async def stream(self, request, writer, live=False):
+        """Server-Sent Events, as in the Flask app's /api/stream, or /api/live if live"""
+        last_id = request.headers.get('last-event-id') or request.query.get('lastEventId', '')
+        last_sequence = resume_sequence(self.monitor.snapshot, int(last_id) if last_id.isdigit() else None)
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Access-Control-Allow-Origin: *\r\n"
+            b"Connection: close\r\n\r\n" +
+            f"retry: {STREAM_RETRY_MS}\n\n".encode()
+        )
+        if live:
+            last_sequence = -1  # live clients always start with a full update
+        layout = None
+        loop = asyncio.get_running_loop()
+        self.streams += 1
+        try:
+            while True:
+                snapshot = await self.broadcaster.wait(last_sequence, STREAM_HEARTBEAT_INTERVAL)
+                if snapshot is None:
+                    writer.write(b": heartbeat\n\n")
+                elif live:
+                    frame = live_encoder.frame
+                    if frame is None or frame.sequence < snapshot.sequence:
+                        # First stream to see this tick: encode it off the loop
+                        frame = await loop.run_in_executor(None, live_frame, self.monitor, snapshot)
+                    writer.write(frame.events_for(layout, last_sequence))
+                    layout, last_sequence = frame.layout, frame.sequence
+                else:
+                    last_sequence = snapshot.sequence
+                    body, _ = await self.cached('snapshot', snapshot, snapshot_payload)
+                    writer.write(snapshot_event(snapshot, body))
+                await writer.drain()
+        finally:
+            self.streams -= 1
+
+    async def alert_stream(self, request, writer):
+        """Alert events as Server-Sent Events, as in the Flask app's /api/alerts/stream"""
+        snapshot = self.monitor.snapshot
+        last_id = request.headers.get('last-event-id') or request.query.get('lastEventId', '')
+        last_event = resume_alert_event(snapshot, int(last_id) if last_id.isdigit() else None)
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Access-Control-Allow-Origin: *\r\n"
+            b"Connection: close\r\n\r\n" +
+            f"retry: {STREAM_RETRY_MS}\n\n".encode() +
+            active_alerts_event(snapshot)
+        )
+        last_sequence = snapshot.sequence
+        self.streams += 1
+        try:
+            while True:
+                body, last_event = alert_events_since(self.monitor, last_event)
+                if body:
+                    writer.write(body)
+                await writer.drain()
+                snapshot = await self.broadcaster.wait(last_sequence, STREAM_HEARTBEAT_INTERVAL)
+                if snapshot is None:
+                    writer.write(b": heartbeat\n\n")
+                else:
+                    last_sequence = snapshot.sequence
+        finally:
+            self.streams -= 1
+
+async def serve(host, port):
+    server = AsyncServer(get_monitor())
+    listener = await server.start(host, port)
+    async with listener:
+        await listener.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the temperature monitor API with asyncio")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+    print(f"Serving on http://{args.host}:{args.port} (asyncio)")
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
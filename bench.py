@@ -0,0 +1,737 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import http.client
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime
+
+from history import HistoryStore
+
+def measure_allocation(build):
+    """Return the bytes still allocated by build() once it has returned"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return after - before
+
+def bench_history_memory(points=10000, zones=8, fans=4):
+    """Compare a deque of dicts per series with the columnar HistoryStore"""
+    sensors = 1 + zones + fans  # CPU series plus every zone and fan
+    base = time.time()
+
+    def build_dicts():
+        # The original representation: a dict with an ISO-8601 string per point
+        history = []
+        for sensor in range(sensors):
+            series = deque(maxlen=points)
+            for i in range(points):
+                series.append({
+                    'timestamp': datetime.fromtimestamp(base + i).isoformat(),
+                    'temperature': 40.0 + (i % 100) / 10
+                })
+            history.append(series)
+        return history
+
+    def build_columns():
+        store = HistoryStore(points)
+        keys = [f"sensor:{sensor}" for sensor in range(sensors)]
+        for i in range(points):
+            store.append(int((base + i) * 1000), {key: 40.0 + (i % 100) / 10 for key in keys})
+        return store
+
+    dict_bytes = measure_allocation(build_dicts)
+    column_bytes = measure_allocation(build_columns)
+    return {
+        'points': points,
+        'sensors': sensors,
+        'dict_bytes_per_point': dict_bytes / (points * sensors),
+        'columnar_bytes_per_point': column_bytes / (points * sensors),
+        'dict_mb_per_day': dict_bytes / points * 86400 / 2**20,
+        'columnar_mb_per_day': column_bytes / points * 86400 / 2**20,
+        'columnar_kb_per_sensor_hour': column_bytes / (points * sensors) * 3600 / 1024,
+        'ratio': dict_bytes / column_bytes
+    }
+
+def fake_tree(**layout):
+    """Build a FakeSysfs tree in a new temporary directory; remove it with shutil.rmtree(tree.root)"""
+    from fakesysfs import FakeSysfs
+    return FakeSysfs(tempfile.mkdtemp(prefix='temp-monitor-bench-'), **layout).build()
+
+def latency_summary(seconds, prefix=''):
+    """p50/p99/max of a list of durations, in milliseconds"""
+    ordered = sorted(seconds)
+    return {
+        f"{prefix}p50_ms": ordered[len(ordered) // 2] * 1000,
+        f"{prefix}p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+        f"{prefix}max_ms": ordered[-1] * 1000
+    }
+
+def bench_batch_reads(sensors=512, devices=32, slow_devices=8, slow_read_ms=1.0, ticks=20,
+                      workers=(0, 1, 2, 4, 8)):
+    """Per-tick read latency of BatchReader against worker count
+
+    A few devices are made slow by sleeping before each of their reads, the
+    way IPMI- or ACPI-backed drivers block. Zero workers reads everything
+    serially on the sampling thread.
+    """
+    from app import BatchReader
+    from fakesysfs import FakeSysfsReader
+
+    tree = fake_tree(zones=0, chips=devices, temps_per_chip=sensors // devices, fans_per_chip=0,
+                     slow_chips=slow_devices, slow_read_ms=slow_read_ms)
+    try:
+        reader = FakeSysfsReader(tree.root)
+        jobs = [(path, reader.read_int) for paths in tree.chip_paths for path in paths]
+        results = {'sensors': len(jobs), 'devices': devices, 'slow_devices': slow_devices}
+        for count in workers:
+            batch = BatchReader(count)
+            for _ in range(3):
+                batch.read(jobs, timeout=10)  # let it classify slow devices
+            latencies = []
+            for _ in range(ticks):
+                started = time.perf_counter()
+                readings = batch.read(jobs, timeout=10)
+                latencies.append(time.perf_counter() - started)
+            assert len(readings) == len(jobs)
+            latencies.sort()
+            results[f"workers_{count}_p50_ms"] = latencies[len(latencies) // 2] * 1000
+            results[f"workers_{count}_max_ms"] = latencies[-1] * 1000
+        reader.close()
+        return results
+    finally:
+        shutil.rmtree(tree.root)
+
+def _load_client(host, port, path, deadline, results):
+    count = errors = 0
+    latencies = []
+    while time.time() < deadline:
+        started = time.perf_counter()
+        try:
+            connection = http.client.HTTPConnection(host, port, timeout=10)
+            connection.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+            connection.getresponse().read()
+            connection.close()
+            count += 1
+            latencies.append(time.perf_counter() - started)
+        except OSError:
+            errors += 1
+    results.put((count, errors, latencies))
+
+def http_load(host, port, path, duration=5.0, clients=4):
+    """Hammer one URL from several client processes; returns throughput and latency"""
+    results = multiprocessing.Queue()
+    deadline = time.time() + duration
+    processes = [multiprocessing.Process(target=_load_client, args=(host, port, path, deadline, results))
+                 for _ in range(clients)]
+    for process in processes:
+        process.start()
+    count = errors = 0
+    latencies = []
+    for _ in processes:
+        done, failed, times = results.get()
+        count += done
+        errors += failed
+        latencies.extend(times)
+    for process in processes:
+        process.join()
+    latencies.sort()
+    return {
+        'requests_per_second': count / duration,
+        'errors': errors,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else None
+    }
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_http(port, path='/api/snapshot', timeout=15.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', path)
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} did not come up")
+
+def bench_shared_workers(workers=(1, 2, 4), duration=5.0, clients=4):
+    """Throughput of gunicorn workers serving from one shared-memory sampler"""
+    if importlib.util.find_spec('gunicorn') is None:
+        print("shared-workers needs gunicorn: pip install -r requirements.txt", file=sys.stderr)
+        return {'skipped': 'gunicorn is not installed (pip install -r requirements.txt)'}
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    shared_dir = tempfile.mkdtemp(prefix='temp-monitor-shm-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+    sampler = subprocess.Popen([sys.executable, os.path.join(here, 'app.py'), '--sampler'], cwd=here,
+                               env=dict(os.environ, TEMP_MONITOR_DATA_DIR=shared_dir),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    results = {'cpus': os.cpu_count(), 'clients': clients}
+    try:
+        for count in workers:
+            port = free_port()
+            server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-w', str(count),
+                                       '-b', f"127.0.0.1:{port}", 'app:app'],
+                                      cwd=here, env=dict(os.environ, TEMP_MONITOR_SHARED_DIR=shared_dir),
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for_http(port)
+                load = http_load('127.0.0.1', port, '/api/snapshot', duration, clients)
+            finally:
+                server.terminate()
+                server.wait()
+            results[f"workers_{count}_requests_per_second"] = load['requests_per_second']
+            results[f"workers_{count}_p99_ms"] = load['p99_ms']
+    finally:
+        sampler.terminate()
+        sampler.wait()
+        shutil.rmtree(shared_dir)
+    return results
+
+def process_rss(pid):
+    """Resident set size of a process in bytes"""
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return None
+
+def open_idle_streams(port, count):
+    """Open count event-stream connections that never read; returns the sockets"""
+    request = b"GET /api/stream HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n"
+    sockets = []
+    for _ in range(count):
+        try:
+            sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+            sock.sendall(request)
+        except OSError:
+            break
+        sockets.append(sock)
+    return sockets
+
+def bench_idle_connections(connections=5000, duration=5.0, clients=4):
+    """Memory per idle stream client and request throughput, Flask vs asyncio
+
+    Each server is loaded with idle /api/stream subscribers that never read,
+    then /api/snapshot is hammered while they stay connected.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    servers = {
+        'flask': lambda port: [sys.executable, '-c',
+                               f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"],
+        'asyncio': lambda port: [sys.executable, os.path.join(here, 'async_server.py'),
+                                 '--host', '127.0.0.1', '--port', str(port)]
+    }
+    results = {'connections': connections, 'cpus': os.cpu_count()}
+    for name, command in servers.items():
+        port = free_port()
+        server = subprocess.Popen(command(port), cwd=here,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        sockets = []
+        try:
+            wait_for_http(port)
+            rss_before = process_rss(server.pid)
+            sockets = open_idle_streams(port, connections)
+            time.sleep(2)
+            rss_after = process_rss(server.pid)
+            load = http_load('127.0.0.1', port, '/api/snapshot', duration, clients)
+            results[f"{name}_open_streams"] = len(sockets)
+            results[f"{name}_bytes_per_stream"] = (rss_after - rss_before) / max(1, len(sockets))
+            results[f"{name}_requests_per_second"] = load['requests_per_second']
+            results[f"{name}_p99_ms"] = load['p99_ms']
+            results[f"{name}_errors"] = load['errors']
+        finally:
+            for sock in sockets:
+                sock.close()
+            server.terminate()
+            server.wait()
+    return results
+
+def bench_metrics(zones=1000, fans=200, renders=50):
+    """Cost of rendering /metrics for a large sensor inventory
+
+    A render happens once per tick; every further scrape in the same tick
+    is a response cache hit.
+    """
+    from types import SimpleNamespace
+    from metrics import Histogram, render_metrics
+    from pipeline import Reading, Snapshot
+    from sensors import Sensor
+
+    thermal_zones = [Sensor(str(i), 'zone', f"/zone{i}", f"type{i % 8}", 'thermal', f"type{i % 8}",
+                            channel=i) for i in range(zones)]
+    fan_sensors = [Sensor(f"chip_{i}", 'fan', f"/fan{i}", 'fan', 'chip', f"Fan {i}", channel=i)
+                   for i in range(fans)]
+    histogram = Histogram()
+    for i in range(1000):
+        histogram.observe(i / 10000)
+    health = {'state': 'closed', 'total_failures': 0}
+    monitor = SimpleNamespace(
+        thermal_zones=thermal_zones,
+        fan_sensors=fan_sensors,
+        health_info=lambda path: health,
+        sampler_info=lambda: {
+            'interval': 1.0, 'ticks': 1000, 'missed_ticks': 0, 'syscalls_per_tick': zones + fans,
+            'open_handles': zones + fans, 'reads': {'timeouts': 0},
+            'histograms': {'latency': histogram.info(), 'jitter': histogram.info()}
+        }
+    )
+    window = {'avg_temp': 45.0, 'min_temp': 40.0, 'max_temp': 50.0, 'count': 60}
+    snapshot = Snapshot(
+        1, '', 45.0, {'windows': {'20_samples': window, '1m': window}},
+        tuple(Reading(zone, 40.0 + zone.channel % 30) for zone in thermal_zones),
+        tuple(Reading(fan, 1200) for fan in fan_sensors),
+        {}, 1000
+    )
+    timings = []
+    for _ in range(renders):
+        started = time.perf_counter()
+        body = render_metrics(snapshot, monitor)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        'series': body.count(b'\n') - body.count(b'\n#'),
+        'bytes': len(body),
+        'render_p50_ms': timings[len(timings) // 2] * 1000,
+        'render_max_ms': timings[-1] * 1000
+    }
+
+def bench_live_updates(zones=500, fans=50, ticks=300, temp_epsilon=0.1, fan_epsilon=10):
+    """Bytes per tick sent to a dashboard: /api/stream against /api/live
+
+    Sensor values random-walk the way hwmon's do: every tick a fifth of the
+    temperatures move by a whole degree and a third of the fans by 30 RPM.
+    """
+    import random
+    from live import LiveEncoder, event
+    from pipeline import Reading, Snapshot
+    from sensors import Sensor
+
+    thermal_zones = [Sensor(f"coretemp{i // 32}_temp{i % 32}", 'temp', f"/temp{i}", 'coretemp',
+                            f"coretemp.{i // 32}", f"Core {i % 32}", group='core', channel=i)
+                     for i in range(zones)]
+    fan_sensors = [Sensor(f"chip_fan{i}", 'fan', f"/fan{i}", 'fan', 'chip', f"Fan {i}", channel=i)
+                   for i in range(fans)]
+    rng = random.Random(0)
+    temps = [45.0 + rng.randrange(20) for _ in thermal_zones]
+    speeds = [1200 + 30 * rng.randrange(20) for _ in fan_sensors]
+    window = {'avg_temp': 45.0, 'min_temp': 40.0, 'max_temp': 50.0, 'count': 60}
+    encoder = LiveEncoder(temp_epsilon, fan_epsilon)
+    stream_bytes = live_bytes = 0
+    timings = []
+    for sequence in range(1, ticks + 1):
+        for i in range(zones):
+            if rng.random() < 0.2:
+                temps[i] += rng.choice((-1.0, 1.0))
+        for i in range(fans):
+            if rng.random() < 0.33:
+                speeds[i] += rng.choice((-30, 30))
+        snapshot = Snapshot(
+            sequence, f"2024-01-01T00:00:{sequence % 60:02d}", temps[0],
+            {'windows': {'20_samples': window, '1m': window}},
+            tuple(Reading(zone, temp) for zone, temp in zip(thermal_zones, temps)),
+            tuple(Reading(fan, speed) for fan, speed in zip(fan_sensors, speeds)),
+            {}, sequence
+        )
+        stream_bytes += len(event('snapshot', dict(snapshot.to_dict(), status='success'), sequence))
+        started = time.perf_counter()
+        frame = encoder.encode(snapshot, 1, thermal_zones, fan_sensors)
+        timings.append(time.perf_counter() - started)
+        live_bytes += len(frame.delta)
+    timings.sort()
+    return {
+        'sensors': zones + fans,
+        'stream_bytes_per_tick': stream_bytes / ticks,
+        'live_bytes_per_tick': live_bytes / ticks,
+        'live_meta_bytes': len(frame.meta),
+        'live_full_bytes': len(frame.full),
+        'encode_p50_ms': timings[len(timings) // 2] * 1000
+    }
+
+def bench_alerts(zones=500, fans=50, ticks=300):
+    """Time the alert engine adds to a sampling tick
+
+    Every zone has a passive and a critical trip point, plus a threshold
+    and a rate-of-rise rule on every core and a fan-stall rule on every
+    fan. Temperatures random-walk around the trip points so alerts keep
+    firing and clearing. The cost is paid once per tick by the sampler,
+    however many clients are watching.
+    """
+    import random
+    from alerts import AlertEngine, FanStallRule, RateOfRiseRule, ThresholdRule
+    from pipeline import Reading, Sample
+    from sensors import Sensor
+
+    thermal_zones = [Sensor(str(i), 'zone', f"/zone{i}", 'x86_pkg_temp', 'thermal', 'x86_pkg_temp',
+                            group='core', channel=i, trips=(('passive', 85.0, 3.0), ('critical', 100.0, None)))
+                     for i in range(zones)]
+    fan_sensors = [Sensor(f"chip_fan{i}", 'fan', f"/fan{i}", 'fan', 'chip', f"Fan {i}", channel=i)
+                   for i in range(fans)]
+    engine = AlertEngine([
+        ThresholdRule('core-hot', 80.0, {'group': 'core'}),
+        RateOfRiseRule('core-rising', 2.0, {'group': 'core'}),
+        FanStallRule('fan-stall', 85.0)
+    ])
+    engine.configure(thermal_zones, fan_sensors)
+    rng = random.Random(0)
+    temps = [75.0 + rng.randrange(15) for _ in thermal_zones]
+    speeds = [rng.choice((0, 1200)) for _ in fan_sensors]
+    timings = []
+    for tick in range(ticks):
+        for i in range(zones):
+            temps[i] = min(max(temps[i] + rng.choice((-1.0, 0.0, 1.0)), 60.0), 105.0)
+        sample = Sample(tick * 1000, float(tick),
+                        tuple(Reading(zone, temp) for zone, temp in zip(thermal_zones, temps)),
+                        tuple(Reading(fan, speed) for fan, speed in zip(fan_sensors, speeds)))
+        results = {'cpu': max(temps)}
+        started = time.perf_counter()
+        alerts = engine.run(sample, results)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        'rules': len(engine.active_rules),
+        'bindings': len(engine._bindings),
+        'events': alerts['last_event_id'],
+        'active': len(alerts['active']),
+        'tick_p50_ms': timings[len(timings) // 2] * 1000,
+        'tick_max_ms': timings[-1] * 1000
+    }
+
+def bench_heatmap(cores=256, tiles=240, runs=5):
+    """Time to build a 24 hour x cores heatmap with per-core percentiles
+
+    Covers what /api/heatmap does on a cache miss: read the window from the
+    per-minute rollup, downsample it into tiles, work out the percentiles
+    and encode the JSON. A one hour window of raw samples is timed too.
+    """
+    import json
+    import random
+    import matrix
+    from matrix import MatrixStore, column_percentiles, downsample
+
+    keys = [f"coretemp_temp{core + 2}" for core in range(cores)]
+    now = int(time.time() * 1000)
+
+    def filled(rows, step_ms):
+        store = MatrixStore(rows, keys)
+        for row in range(rows):
+            store.append(now - (rows - row) * step_ms,
+                         {key: 40.0 + random.random() * 40 for key in keys})
+        return store
+
+    def build(store):
+        timestamps, values = store.window(keys=keys)
+        edges, rows = downsample(values, len(keys), tiles, 'max')
+        payload = {'tiles': rows, 'percentiles': column_percentiles(values, len(keys)),
+                   'timestamps': [timestamps[edge] for edge in edges]}
+        return json.dumps(payload, separators=(',', ':'))
+
+    def timed(store):
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            build(store)
+            timings.append(time.perf_counter() - started)
+        return sorted(timings)[len(timings) // 2] * 1000
+
+    day = filled(24 * 60, 60 * 1000)
+    hour = filled(60 * 60, 1000)
+    results = {'cores': cores, 'tiles': tiles, 'numpy': matrix.numpy is not None}
+    results['day_1m_ms'] = timed(day)
+    results['hour_raw_ms'] = timed(hour)
+    if matrix.numpy is not None:
+        numpy, matrix.numpy = matrix.numpy, None
+        try:
+            results['day_1m_pure_python_ms'] = timed(day)
+        finally:
+            matrix.numpy = numpy
+    return results
+
+def bench_tick_allocation(devices=16, sensors_per_device=16, fans_per_device=2, ticks=200):
+    """Memory allocated by one sampling tick, and its duration
+
+    Runs ThermalMonitor.sample() by hand against a fake hwmon tree, with
+    the background sampler and rescanner stopped. peak is the high-water
+    mark above the starting point during a tick; retained is what the
+    previous tick's structures still hold once it is replaced.
+    """
+    from app import ThermalMonitor
+
+    tree = fake_tree(zones=0, chips=devices, temps_per_chip=sensors_per_device,
+                     fans_per_chip=fans_per_device)
+    try:
+        monitor = ThermalMonitor(read_workers=0, rescan_interval=0, sysfs_root=tree.root).discover()
+        for _ in range(20):
+            monitor.sample()  # warm up windows, histograms and caches
+
+        peaks, retained, durations = [], [], []
+        tracemalloc.start()
+        try:
+            for _ in range(ticks):
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                started = time.perf_counter()
+                monitor.sample()
+                durations.append(time.perf_counter() - started)
+                current, peak = tracemalloc.get_traced_memory()
+                peaks.append(peak - before)
+                retained.append(current - before)
+        finally:
+            tracemalloc.stop()
+        peaks.sort()
+        durations.sort()
+        return {
+            'temperature_sensors': len(monitor.thermal_zones),
+            'fans': len(monitor.fan_sensors),
+            'tick_peak_bytes': peaks[len(peaks) // 2],
+            'tick_retained_bytes': sum(retained) / len(retained),
+            'tick_p50_ms': durations[len(durations) // 2] * 1000
+        }
+    finally:
+        shutil.rmtree(tree.root)
+
+def bench_discovery(zones=32, chips=16, temps_per_chip=16, fans_per_chip=2, runs=5):
+    """Time to find every sensor in a fake sysfs tree
+
+    full_scan is a first scan by a new SysfsScanner, cached_scan the same
+    with an up-to-date inventory cache (a restart), rescan an unchanged tree
+    seen before (what the rescan thread does every few seconds) and
+    monitor_init everything ThermalMonitor() and discover() do before the
+    first tick.
+    """
+    from app import ThermalMonitor
+    from sensors import SysfsScanner
+
+    tree = fake_tree(zones=zones, chips=chips, temps_per_chip=temps_per_chip, fans_per_chip=fans_per_chip)
+    cache_path = os.path.join(tree.root, 'inventory.json')
+    try:
+        scans, cached_scans, rescans, inits = [], [], [], []
+        for _ in range(runs):
+            scanner = SysfsScanner(tree.root)
+            started = time.perf_counter()
+            added, _ = scanner.scan()
+            scans.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            scanner.scan()
+            rescans.append(time.perf_counter() - started)
+
+            SysfsScanner(tree.root, cache_path).scan()
+            scanner = SysfsScanner(tree.root, cache_path)
+            started = time.perf_counter()
+            restored, _ = scanner.scan()
+            cached_scans.append(time.perf_counter() - started)
+            assert scanner.cache_hits == len(restored) == len(added)
+            os.unlink(cache_path)
+
+            started = time.perf_counter()
+            monitor = ThermalMonitor(read_workers=0, rescan_interval=0, sysfs_root=tree.root).discover()
+            inits.append(time.perf_counter() - started)
+            monitor.reader.close()
+        assert len(added) == tree.sensor_count
+        return dict(
+            {'sensors': len(added)},
+            **latency_summary(scans, 'full_scan_'),
+            **latency_summary(cached_scans, 'cached_scan_'),
+            **latency_summary(rescans, 'rescan_'),
+            **latency_summary(inits, 'monitor_init_')
+        )
+    finally:
+        shutil.rmtree(tree.root)
+
+def bench_sampling(zones=16, chips=8, temps_per_chip=16, fans_per_chip=2, slow_chips=2,
+                   slow_read_ms=5.0, failing=4, ticks=200):
+    """Per-tick sampling latency with slow and failing sensors
+
+    Runs ThermalMonitor.sample() back to back against a fake tree in which
+    a few chips are slow and a few inputs always fail, so the breakers and
+    the slow-device workers are exercised as well as the plain reads.
+    """
+    from app import READ_WORKERS, ThermalMonitor
+    from fakesysfs import FakeSysfsReader
+
+    tree = fake_tree(zones=zones, chips=chips, temps_per_chip=temps_per_chip, fans_per_chip=fans_per_chip,
+                     slow_chips=slow_chips, slow_read_ms=slow_read_ms, failing=failing)
+    try:
+        monitor = ThermalMonitor(read_workers=READ_WORKERS, rescan_interval=0, sysfs_root=tree.root,
+                                 reader=FakeSysfsReader(tree.root)).discover()
+        durations = []
+        for _ in range(ticks):
+            started = time.perf_counter()
+            monitor.sample()
+            durations.append(time.perf_counter() - started)
+        healthy = sum(1 for health in monitor.sensor_health.values() if health.state == 'closed')
+        stages = monitor.pipeline.info()
+        return dict(
+            {'sensors': tree.sensor_count, 'slow_sensors': slow_chips * (temps_per_chip + fans_per_chip),
+             'failing_sensors': failing, 'healthy_sensors': healthy},
+            **latency_summary(durations, 'tick_'),
+            **{f"stage_{name}_p50_ms": timing['ms']['p50'] for name, timing in stages.items()}
+        )
+    finally:
+        shutil.rmtree(tree.root)
+
+# Run in a fresh interpreter by bench_startup: prints the seconds taken to
+# import app, and to import it and publish the first sample
+STARTUP_PROBE = """
+import time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+app.get_monitor().wait_for_snapshot(0, 30)
+print(imported - started, time.perf_counter() - started)
+"""
+
+def bench_startup(zones=32, chips=32, temps_per_chip=16, fans_per_chip=2, runs=5):
+    """Import time and time to first sample of a new process
+
+    cold starts without an inventory cache, warm with the one the previous
+    run left behind, as after a restart.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    tree = fake_tree(zones=zones, chips=chips, temps_per_chip=temps_per_chip, fans_per_chip=fans_per_chip)
+    cache_path = os.path.join(tree.root, 'inventory.json')
+    env = dict(os.environ, TEMP_MONITOR_SYSFS_ROOT=tree.root, TEMP_MONITOR_INVENTORY_CACHE=cache_path,
+               TEMP_MONITOR_RESCAN_INTERVAL='0')
+    env.pop('TEMP_MONITOR_SHARED_DIR', None)
+    timings = {'import': [], 'cold_first_sample': [], 'warm_first_sample': []}
+    try:
+        for _ in range(runs):
+            for name in ('cold_first_sample', 'warm_first_sample'):
+                if name == 'cold_first_sample' and os.path.exists(cache_path):
+                    os.unlink(cache_path)
+                output = subprocess.run([sys.executable, '-c', STARTUP_PROBE], cwd=here, env=env,
+                                        capture_output=True, text=True, check=True).stdout
+                imported, first_sample = map(float, output.splitlines()[-1].split())
+                timings['import'].append(imported)
+                timings[name].append(first_sample)
+        results = {'sensors': tree.sensor_count}
+        for name, seconds in timings.items():
+            seconds.sort()
+            results[f"{name}_p50_ms"] = seconds[len(seconds) // 2] * 1000
+        return results
+    finally:
+        shutil.rmtree(tree.root)
+
+# Endpoints loaded by bench_endpoints
+ENDPOINTS = ['/', '/api/temperature', '/api/snapshot', '/api/stats', '/api/zones', '/api/sensors',
+             '/api/history?max_points=300', '/api/heatmap', '/metrics']
+
+def bench_endpoints(zones=16, chips=4, temps_per_chip=16, fans_per_chip=2, duration=2.0, clients=4,
+                    endpoints=ENDPOINTS):
+    """Requests per second and p99 latency of every endpoint
+
+    The Flask server runs in its own process, sampling a fake tree at a
+    10 Hz tick so responses are rebuilt several times a second.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    tree = fake_tree(zones=zones, chips=chips, temps_per_chip=temps_per_chip, fans_per_chip=fans_per_chip)
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-c', f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"],
+        cwd=here, env=dict(os.environ, TEMP_MONITOR_SYSFS_ROOT=tree.root, TEMP_MONITOR_INTERVAL='0.1'),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    results = {'sensors': tree.sensor_count, 'clients': clients}
+    try:
+        wait_for_http(port)
+        time.sleep(1)  # a few ticks of history for /api/history and /api/heatmap
+        for path in endpoints:
+            load = http_load('127.0.0.1', port, path, duration, clients)
+            name = path.split('?')[0].strip('/').replace('api/', '')
+            results[f"{name}_requests_per_second"] = load['requests_per_second']
+            results[f"{name}_p99_ms"] = load['p99_ms']
+            results[f"{name}_errors"] = load['errors']
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(tree.root)
+    return results
+
+BENCHMARKS = {
+    'history-memory': bench_history_memory,
+    'batch-reads': bench_batch_reads,
+    'shared-workers': bench_shared_workers,
+    'idle-connections': bench_idle_connections,
+    'metrics': bench_metrics,
+    'live-updates': bench_live_updates,
+    'alerts': bench_alerts,
+    'heatmap': bench_heatmap,
+    'tick-allocation': bench_tick_allocation,
+    'discovery': bench_discovery,
+    'startup': bench_startup,
+    'sampling': bench_sampling,
+    'endpoints': bench_endpoints
+}
+
+def revision():
+    """Git revision of the benchmarked tree, if it is a checkout"""
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Temperature monitor benchmarks")
+    parser.add_argument('benchmarks', nargs='*',
+                        help=f"Benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--json', metavar='FILE',
+                        help="also write the results as JSON to FILE ('-' for stdout only), "
+                             "for comparing runs between releases")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name!r}")
+
+    report = {
+        'revision': revision(),
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'results': {}
+    }
+    # With --json -, stdout carries the report alone: what the monitor
+    # prints while the benchmarks run (discovery, alerts, errors) goes to stderr
+    quiet = contextlib.redirect_stdout(sys.stderr) if args.json == '-' else contextlib.nullcontext()
+    with quiet:
+        for name in args.benchmarks or BENCHMARKS:
+            results = report['results'][name] = BENCHMARKS[name]()
+            if args.json == '-':
+                continue
+            print(f"{name}:")
+            for key, value in results.items():
+                if isinstance(value, float):
+                    value = f"{value:.2f}"
+                print(f"  {key}: {value}")
+
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
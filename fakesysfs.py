@@ -0,0 +1,127 @@
+import errno
+import json
+import os
+import time
+
+from sensors import SysfsReader
+
+# File at the root of a fake tree listing its slow and failing sensors
+MANIFEST_NAME = 'fake-sysfs.json'
+
+class FakeSysfs:
+    """Builds a synthetic sysfs tree of thermal zones and hwmon chips
+
+    The layout follows the real one: class/thermal/thermal_zoneN and
+    class/hwmon/hwmonN are symlinks into devices/, and every hwmon entry
+    has a 'device' link to its chip. Every zone has a passive (with
+    hysteresis) and a critical trip point. Chips are coretemp-style, with a
+    'Package id N' input followed by 'Core N' inputs, plus fan inputs.
+    Point ThermalMonitor(sysfs_root=...) or TEMP_MONITOR_SYSFS_ROOT at
+    root to sample it.
+
+    Plain files cannot be slow or fail, so those are described in a
+    manifest next to the tree and simulated by FakeSysfsReader: every
+    input of the first slow_chips chips takes slow_read_ms to read, like
+    an IPMI- or ACPI-backed driver, and the last `failing` temperature
+    inputs fail with EIO on every read after discovery.
+    """
+
+    def __init__(self, root, zones=4, chips=2, temps_per_chip=8, fans_per_chip=2,
+                 slow_chips=0, slow_read_ms=5.0, failing=0):
+        self.root = root
+        self.zones = zones
+        self.chips = chips
+        self.temps_per_chip = temps_per_chip
+        self.fans_per_chip = fans_per_chip
+        self.slow_chips = slow_chips
+        self.slow_read_ms = slow_read_ms
+        self.failing = failing
+        self.zone_paths = []
+        self.chip_paths = []  # [[temperature and fan input paths] per chip]
+
+    def build(self):
+        """Write the tree and its manifest under root; returns self"""
+        for zone in range(self.zones):
+            directory = self._device(os.path.join('virtual', 'thermal', f"thermal_zone{zone}"),
+                                     'thermal', f"thermal_zone{zone}")
+            write(os.path.join(directory, 'type'), 'acpitz' if zone == 0 else f"fake{zone}")
+            path = os.path.join(directory, 'temp')
+            write(path, 40000 + zone * 500)
+            self.zone_paths.append(path)
+            for trip, (trip_type, temperature) in enumerate([('passive', 90000), ('critical', 105000)]):
+                write(os.path.join(directory, f"trip_point_{trip}_type"), trip_type)
+                write(os.path.join(directory, f"trip_point_{trip}_temp"), temperature)
+            write(os.path.join(directory, 'trip_point_0_hyst'), 3000)
+
+        for chip in range(self.chips):
+            chip_dir = os.path.join(self.root, 'devices', 'platform', f"coretemp.{chip}")
+            directory = self._device(os.path.join('platform', f"coretemp.{chip}", 'hwmon', f"hwmon{chip}"),
+                                     'hwmon', f"hwmon{chip}")
+            os.symlink(chip_dir, os.path.join(directory, 'device'))
+            write(os.path.join(directory, 'name'), 'coretemp')
+            paths = []
+            for channel in range(1, self.temps_per_chip + 1):
+                label = f"Package id {chip}" if channel == 1 else f"Core {channel - 2}"
+                write(os.path.join(directory, f"temp{channel}_label"), label)
+                path = os.path.join(directory, f"temp{channel}_input")
+                write(path, 45000 + channel * 250)
+                paths.append(path)
+            for channel in range(1, self.fans_per_chip + 1):
+                path = os.path.join(directory, f"fan{channel}_input")
+                write(path, 1000 + channel * 150)
+                paths.append(path)
+            self.chip_paths.append(paths)
+
+        temp_paths = self.zone_paths + [path for paths in self.chip_paths
+                                        for path in paths if not os.path.basename(path).startswith('fan')]
+        manifest = {
+            'slow': {path: self.slow_read_ms / 1000
+                     for paths in self.chip_paths[:self.slow_chips] for path in paths},
+            'failing': temp_paths[len(temp_paths) - self.failing:] if self.failing else []
+        }
+        with open(os.path.join(self.root, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f)
+        return self
+
+    def _device(self, device_path, sysfs_class, name):
+        """Create devices/<device_path> and return its class/<sysfs_class>/<name> link
+
+        Sensor paths go through the class link, as the scanner finds them.
+        """
+        directory = os.path.join(self.root, 'devices', device_path)
+        os.makedirs(directory)
+        class_dir = os.path.join(self.root, 'class', sysfs_class)
+        os.makedirs(class_dir, exist_ok=True)
+        os.symlink(directory, os.path.join(class_dir, name))
+        return os.path.join(class_dir, name)
+
+    @property
+    def sensor_count(self):
+        return self.zones + self.chips * (self.temps_per_chip + self.fans_per_chip)
+
+def write(path, value):
+    with open(path, 'w') as f:
+        f.write(f"{value}\n")
+
+class FakeSysfsReader(SysfsReader):
+    """SysfsReader that adds the slow and failing sensors of a FakeSysfs tree
+
+    Reads the manifest written by FakeSysfs.build(), so it works in any
+    process given only the tree's root.
+    """
+
+    def __init__(self, root):
+        super().__init__()
+        with open(os.path.join(root, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        self.delays = manifest['slow']
+        self.failing = frozenset(manifest['failing'])
+
+    def read(self, path):
+        delay = self.delays.get(path)
+        if delay:
+            time.sleep(delay)
+        if path in self.failing:
+            self.syscalls += 1
+            raise OSError(errno.EIO, os.strerror(errno.EIO), path)
+        return super().read(path)
@@ -0,0 +1,565 @@
+import json
+import mmap
+import os
+import struct
+import time
+from array import array
+from datetime import datetime
+
+NAN = float('nan')
+# Slots a store allocates at first; it doubles from there up to its capacity
+INITIAL_SLOTS = 1024
+
+class HistoryStore:
+    """Fixed-capacity ring buffer of samples stored column by column
+
+    Timestamps are integer milliseconds since the epoch in one array('q')
+    column, and every sensor gets its own array('f') column of float32
+    values, NaN where the sensor had no reading. That is 8 bytes per sample
+    plus 4 bytes per sensor, and timestamps are only formatted as ISO-8601
+    when a series is read out.
+
+    Columns start with INITIAL_SLOTS slots and double whenever the ring
+    reaches their end, so memory follows the samples actually held rather
+    than the capacity; once the ring is full it stays put.
+    """
+
+    def __init__(self, capacity):
+        if capacity <= 0:
+            raise ValueError("History capacity must be positive")
+        self.capacity = capacity
+        self._allocated = 0  # slots allocated in every column so far
+        self._timestamps = array('q')
+        self._columns = {}
+        self._head = 0     # slot the next sample is written to
+        self._count = 0    # samples currently held
+        self.written = 0   # samples appended since creation
+
+    def __len__(self):
+        return self._count
+
+    def keys(self):
+        return list(self._columns)
+
+    def add_column(self, key):
+        """Add a sensor column; samples before it was added read as missing"""
+        column = self._columns.get(key)
+        if column is None:
+            column = self._allocate_column(key)
+            if column is not None:
+                self._columns[key] = column
+        return column
+
+    def _allocate_column(self, key):
+        return array('f', [NAN]) * self._allocated
+
+    def _grow(self):
+        """Extend every column, doubling the slots up to the capacity"""
+        allocated = min(self.capacity, max(INITIAL_SLOTS, self._allocated * 2))
+        extra = allocated - self._allocated
+        self._timestamps.extend(array('q', [0]) * extra)
+        for column in self._columns.values():
+            column.extend(array('f', [NAN]) * extra)
+        self._allocated = allocated
+
+    def append(self, timestamp_ms, values):
+        """Append one sample; values maps column keys to readings"""
+        for key in values:
+            if key not in self._columns:
+                self.add_column(key)  # may be refused by a full mapped store
+
+        slot = self._next_slot(timestamp_ms)
+        for key, column in self._columns.items():
+            value = values.get(key)
+            column[slot] = NAN if value is None else value
+        self._advance()
+
+    def _next_slot(self, timestamp_ms):
+        """Store the timestamp of a new sample and return the slot it goes in"""
+        slot = self._head
+        if slot >= self._allocated:
+            self._grow()
+        if self._count:
+            # Timestamps never go backwards, even if the wall clock does
+            timestamp_ms = max(timestamp_ms, self._timestamps[slot - 1])
+        self._timestamps[slot] = timestamp_ms
+        return slot
+
+    def _advance(self):
+        """Make the sample written to the head slot visible"""
+        self._head = (self._head + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+        self.written += 1
+
+    @property
+    def oldest_cursor(self):
+        """Cursor value of the oldest sample still held"""
+        return self.written - self._count
+
+    def _slot(self, index):
+        """Slot of the index-th held sample, oldest first"""
+        return (self._head - self._count + index) % self.capacity
+
+    def _bisect(self, timestamp_ms):
+        """Index of the first held sample taken at or after timestamp_ms"""
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamps[self._slot(middle)] < timestamp_ms:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _range(self, start=None, end=None, since=None, last=None):
+        """Indexes [first, stop) of the held samples selected by the arguments of rows()"""
+        first, stop = 0, self._count
+        if since is not None:
+            first = max(first, since - self.oldest_cursor)
+        if start is not None:
+            first = max(first, self._bisect(start))
+        if end is not None:
+            stop = min(stop, self._bisect(end + 1))
+        if last is not None:
+            first = max(first, stop - last)
+        return first, stop
+
+    def rows(self, keys, start=None, end=None, since=None, last=None):
+        """Return [(timestamp_ms, value, ...)] for the given columns
+
+        Samples can be narrowed to a time range (inclusive, in ms), to those
+        appended after a cursor (since, a previous value of written) and to
+        the newest last ones. Rows where the first column has no reading are
+        skipped; other missing values come back as None.
+        """
+        if keys[0] not in self._columns:
+            return []
+        columns = [self._columns.get(key) for key in keys]
+
+        first, stop = self._range(start, end, since, last)
+        timestamps = self._timestamps
+        base = self._head - self._count
+        capacity = self.capacity
+        rows = []
+        for index in range(first, stop):
+            slot = (base + index) % capacity
+            if len(columns) == 1:
+                value = columns[0][slot]
+                if value == value:  # not NaN
+                    rows.append((timestamps[slot], value))
+                continue
+            row = [timestamps[slot]]
+            for column in columns:
+                value = NAN if column is None else column[slot]
+                row.append(value if value == value else None)
+            if row[1] is not None:
+                rows.append(tuple(row))
+        return rows
+
+    def series(self, key, start=None, end=None, since=None, last=None):
+        """Return [(timestamp_ms, value)] for one column, skipping gaps"""
+        return self.rows([key], start, end, since, last)
+
+    def latest_timestamp(self):
+        if not self._count:
+            return None
+        return self._timestamps[self._head - 1]
+
+    @property
+    def nbytes(self):
+        """Bytes held by the column buffers"""
+        total = self._timestamps.itemsize * len(self._timestamps)
+        for column in self._columns.values():
+            total += column.itemsize * len(column)
+        return total
+
+def lttb(points, threshold, value_index=1):
+    """Downsample a series with Largest-Triangle-Three-Buckets
+
+    points are tuples whose first element is the x coordinate (timestamp)
+    and whose value_index-th element is plotted. The first and last points
+    are always kept; from every bucket in between the point forming the
+    largest triangle with its neighbours' choices is picked, which keeps
+    the visual shape of the series with only threshold points.
+    """
+    count = len(points)
+    if threshold >= count or threshold <= 0:
+        return list(points)
+    if threshold < 3:
+        return [points[0], points[-1]][:threshold]
+
+    sampled = [points[0]]
+    bucket_size = (count - 2) / (threshold - 2)
+    previous = points[0]
+    for bucket in range(threshold - 2):
+        bucket_start = int(bucket * bucket_size) + 1
+        bucket_end = int((bucket + 1) * bucket_size) + 1
+
+        # Average of the next bucket serves as the third triangle vertex
+        next_start = bucket_end
+        next_end = min(int((bucket + 2) * bucket_size) + 1, count)
+        next_points = points[next_start:next_end]
+        average_x = sum(point[0] for point in next_points) / len(next_points)
+        average_y = sum(point[value_index] for point in next_points) / len(next_points)
+
+        previous_x = previous[0]
+        previous_y = previous[value_index]
+        best_area = -1
+        best = None
+        for point in points[bucket_start:bucket_end]:
+            area = abs((previous_x - average_x) * (point[value_index] - previous_y) -
+                       (previous_x - point[0]) * (average_y - previous_y))
+            if area > best_area:
+                best_area = area
+                best = point
+        sampled.append(best)
+        previous = best
+
+    sampled.append(points[-1])
+    return sampled
+
+def format_timestamp(timestamp_ms):
+    """Format a stored timestamp as local ISO-8601"""
+    return datetime.fromtimestamp(timestamp_ms / 1000).isoformat()
+
+class MappedHistoryStore(HistoryStore):
+    """HistoryStore whose columns live in a memory-mapped ring file
+
+    The file holds a header page (ring position and layout), the timestamp
+    column and max_columns float32 columns at fixed offsets, and then the
+    JSON list of column keys. Samples are written straight into the shared
+    mapping, so the page cache persists them without any extra copy, and
+    reopening the file after a restart restores the whole history without
+    replaying anything.
+
+    A column is never refused: once max_columns are in use the file is
+    extended to twice as many. Existing columns keep their offsets, so
+    only the key list moves, and the header only points at the new layout
+    once the file has grown and the key list has been copied; a file left
+    longer than its header says by a crash in between is still valid.
+    Other processes can map the same file with open_readonly() and call
+    refresh() to follow the writer.
+
+    Like SnapshotSegment, the file carries a seqlock: the writer makes the
+    sequence odd before touching samples, columns or the header and even
+    again afterwards, and read-only stores retry any read during which it
+    changed, so they never see a half-written row or ring position.
+    """
+
+    MAGIC = b'TMHIST02'
+    # magic, capacity, max_columns, head, count, written, length of the key list
+    HEADER = struct.Struct('<8sIIIIQI')
+    # Seqlock sequence, right after the header
+    SEQUENCE = struct.Struct('<Q')
+    SEQUENCE_OFFSET = 40
+    DATA_OFFSET = 4096  # the header page
+    KEY_BYTES = 64      # room reserved in the key list per column
+
+    def __init__(self, path, capacity, max_columns=128):
+        if capacity <= 0:
+            raise ValueError("History capacity must be positive")
+        self.path = path
+        self.capacity = capacity
+        self.readonly = False
+        self._allocated = capacity  # the file is sparse; unwritten pages cost nothing
+        self._columns = {}
+        self._keys_length = 0
+        self._head = 0
+        self._count = 0
+        self.written = 0
+        self._sequence = 0
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+        try:
+            # Keep the layout of an existing file, which may have grown
+            existing = self._layout(fd)
+            if existing is None or existing[0] != capacity:
+                existing = None
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self.file_size(capacity, max_columns))
+            else:
+                max_columns = existing[1]
+            self._map(fd, max_columns)
+        finally:
+            os.close(fd)
+
+        if existing is not None and not self._restore():
+            self._view[:self.DATA_OFFSET] = bytes(self.DATA_OFFSET)
+        # Round up: a writer that died mid-write leaves the sequence odd
+        sequence = self.SEQUENCE.unpack_from(self._mmap, self.SEQUENCE_OFFSET)[0]
+        self._sequence = sequence + (sequence & 1)
+        self.SEQUENCE.pack_into(self._mmap, self.SEQUENCE_OFFSET, self._sequence)
+        if not self._count:
+            self._write_header()
+
+    @classmethod
+    def file_size(cls, capacity, max_columns):
+        return cls.DATA_OFFSET + capacity * 8 + max_columns * (capacity * 4 + cls.KEY_BYTES)
+
+    @classmethod
+    def _layout(cls, fd):
+        """(capacity, max_columns) of the store file open as fd, or None if it is not one"""
+        header = os.pread(fd, cls.HEADER.size, 0)
+        if len(header) < cls.HEADER.size:
+            return None
+        magic, capacity, max_columns = cls.HEADER.unpack(header)[:3]
+        if magic != cls.MAGIC or os.fstat(fd).st_size < cls.file_size(capacity, max_columns):
+            return None
+        return capacity, max_columns
+
+    @classmethod
+    def open_readonly(cls, path):
+        """Map an existing store file for reading, taking its layout from the header"""
+        store = cls.__new__(cls)
+        fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+        try:
+            layout = cls._layout(fd)
+            if layout is None:
+                raise ValueError(f"{path} is not a history store")
+            store.path = path
+            store.capacity = layout[0]
+            store.readonly = True
+            store._allocated = store.capacity
+            store._columns = {}
+            store._keys_length = 0
+            store._map(fd, layout[1])
+        finally:
+            os.close(fd)
+        store.refresh()
+        return store
+
+    def _map(self, fd, max_columns):
+        """Map the file at a layout of max_columns, with views of the columns known so far
+
+        A mapping being replaced is left to the garbage collector rather
+        than closed, as other threads may still be reading through it.
+        """
+        protection = mmap.PROT_READ if self.readonly else mmap.PROT_READ | mmap.PROT_WRITE
+        self._mmap = mmap.mmap(fd, self.file_size(self.capacity, max_columns), mmap.MAP_SHARED, protection)
+        self._view = memoryview(self._mmap)
+        self.max_columns = max_columns
+        self._timestamps = self._view[self.DATA_OFFSET:self.DATA_OFFSET + self.capacity * 8].cast('q')
+        self._columns = {key: self._column_view(index) for index, key in enumerate(self._columns)}
+
+    def _remap(self, max_columns):
+        """Map the file again at a new layout, extending it first when writing"""
+        fd = os.open(self.path, (os.O_RDONLY if self.readonly else os.O_RDWR) | os.O_CLOEXEC)
+        try:
+            if not self.readonly:
+                os.ftruncate(fd, self.file_size(self.capacity, max_columns))
+            self._map(fd, max_columns)
+        finally:
+            os.close(fd)
+
+    def refresh(self):
+        """Pick up samples and columns appended by the writing process"""
+        if self.readonly:
+            self._consistent(self._restore)
+        else:
+            self._restore()
+
+    def rows(self, keys, start=None, end=None, since=None, last=None):
+        if not self.readonly:
+            return super().rows(keys, start, end, since, last)
+
+        def read():
+            # Take the ring position again on every attempt: a retry means it moved
+            self._restore()
+            return HistoryStore.rows(self, keys, start, end, since, last)
+        return self._consistent(read)
+
+    def _consistent(self, read, attempts=1000):
+        """Run read() until the writer has left the file alone for all of it"""
+        for _ in range(attempts):
+            sequence = self.SEQUENCE.unpack_from(self._mmap, self.SEQUENCE_OFFSET)[0]
+            if sequence & 1:
+                time.sleep(0)
+                continue
+            result = read()
+            if self.SEQUENCE.unpack_from(self._mmap, self.SEQUENCE_OFFSET)[0] == sequence:
+                return result
+        raise RuntimeError(f"Could not get a consistent read of {self.path}")
+
+    def _begin_write(self):
+        self._sequence += 1
+        self.SEQUENCE.pack_into(self._mmap, self.SEQUENCE_OFFSET, self._sequence)
+
+    def _end_write(self):
+        self._sequence += 1
+        self.SEQUENCE.pack_into(self._mmap, self.SEQUENCE_OFFSET, self._sequence)
+
+    def _column_view(self, index):
+        start = self.DATA_OFFSET + self.capacity * 8 + index * self.capacity * 4
+        return self._view[start:start + self.capacity * 4].cast('f')
+
+    @property
+    def _keys_offset(self):
+        return self.DATA_OFFSET + self.capacity * 8 + self.max_columns * self.capacity * 4
+
+    def _restore(self):
+        """Load ring position and columns from the file"""
+        magic, capacity, max_columns, head, count, written, keys_length = \
+            self.HEADER.unpack_from(self._mmap, 0)
+        if magic != self.MAGIC or capacity != self.capacity:
+            return False
+        if max_columns != self.max_columns:
+            if not self.readonly:
+                return False
+            self._remap(max_columns)  # the writer grew the file
+        if keys_length != self._keys_length:
+            # Keys are only ever appended, so a new length means new columns
+            offset = self._keys_offset
+            try:
+                keys = json.loads(bytes(self._view[offset:offset + keys_length])) if keys_length else []
+            except ValueError:
+                return False
+            for index, key in enumerate(keys):
+                if key not in self._columns:
+                    self._columns[key] = self._column_view(index)
+            self._keys_length = keys_length
+        self._head, self._count, self.written = head, count, written
+        return True
+
+    def _write_header(self):
+        self.HEADER.pack_into(self._mmap, 0, self.MAGIC, self.capacity, self.max_columns,
+                              self._head, self._count, self.written, self._keys_length)
+
+    def _allocate_column(self, key):
+        self._begin_write()
+        try:
+            return self._add_column(key)
+        finally:
+            self._end_write()
+
+    def _extend(self, max_columns):
+        """Move to a layout of max_columns, leaving a valid file at every step"""
+        keys = bytes(self._view[self._keys_offset:self._keys_offset + self._keys_length])
+        self._remap(max_columns)
+        offset = self._keys_offset
+        self._view[offset:offset + len(keys)] = keys
+        self._mmap.flush()
+        # Only now may the new column overwrite the old key list
+        self._write_header()
+        self._mmap.flush()
+
+    def _add_column(self, key):
+        index = len(self._columns)
+        keys = json.dumps(list(self._columns) + [key]).encode('utf-8')
+        if index >= self.max_columns or len(keys) > self.max_columns * self.KEY_BYTES:
+            max_columns = self.max_columns * 2
+            while index >= max_columns or len(keys) > max_columns * self.KEY_BYTES:
+                max_columns *= 2
+            print(f"History store {self.path} has no room for column {key!r}; "
+                  f"growing it from {self.max_columns} to {max_columns} columns")
+            self._extend(max_columns)
+        column = self._column_view(index)
+        # Slots past the ring position are written before they are ever read
+        held = self._count if self._count < self.capacity else self.capacity
+        column[:held] = array('f', [NAN]) * held
+        offset = self._keys_offset
+        self._view[offset:offset + len(keys)] = keys
+        self._keys_length = len(keys)
+        self._write_header()
+        return column
+
+    def append(self, timestamp_ms, values):
+        for key in values:
+            if key not in self._columns:
+                self.add_column(key)
+        self._begin_write()
+        try:
+            super().append(timestamp_ms, values)
+            self._write_header()
+        finally:
+            self._end_write()
+
+    def flush(self):
+        self._mmap.flush()
+
+    def close(self):
+        """Flush and unmap the file; the store is unusable afterwards"""
+        columns = list(self._columns.values())
+        self._columns = {}
+        for column in columns + [self._timestamps]:
+            column.release()
+        self._view.release()
+        self._mmap.flush()
+        self._mmap.close()
+
+class RollupStore:
+    """Aggregates raw samples into fixed time buckets incrementally
+
+    Each sensor's min/avg/max over a bucket is accumulated as samples arrive
+    and written to the underlying store as keys '<sensor>:min', ':avg' and
+    ':max' once the first sample of the next bucket shows up, so the cost
+    per sample is constant and nothing is recomputed from raw history.
+    The bucket being accumulated only lives in memory; after a restart,
+    replay() rebuilds it from the raw history.
+    """
+
+    def __init__(self, store, bucket_ms):
+        self.store = store
+        self.bucket_ms = bucket_ms
+        self._bucket = None
+        self._accumulators = {}  # key -> [min, max, sum, count]
+
+    def __len__(self):
+        return len(self.store)
+
+    def add(self, timestamp_ms, values):
+        bucket = timestamp_ms - timestamp_ms % self.bucket_ms
+        if self._bucket is not None and bucket > self._bucket:
+            self.flush()
+        if self._bucket is None or bucket > self._bucket:
+            self._bucket = bucket
+
+        accumulators = self._accumulators
+        for key, value in values.items():
+            if value is None:
+                continue
+            accumulator = accumulators.get(key)
+            if accumulator is None:
+                accumulators[key] = [value, value, value, 1]
+            else:
+                if value < accumulator[0]:
+                    accumulator[0] = value
+                if value > accumulator[1]:
+                    accumulator[1] = value
+                accumulator[2] += value
+                accumulator[3] += 1
+
+    def replay(self, history):
+        """Add the raw samples taken since the last bucket written; returns how many
+
+        Meant for a freshly opened rollup over a restored raw history, which
+        still holds the samples of the bucket that was open when the
+        previous process stopped (as far back as its capacity reaches).
+        Samples with no reading in the first column of history are skipped,
+        as rows() does.
+        """
+        keys = history.keys()
+        if not keys:
+            return 0
+        written = self.store.latest_timestamp()
+        start = None if written is None else written + self.bucket_ms
+        rows = history.rows(keys, start=start)
+        for row in rows:
+            self.add(row[0], dict(zip(keys, row[1:])))
+        return len(rows)
+
+    def flush(self):
+        """Write the bucket being accumulated, if it holds any samples"""
+        if self._bucket is None or not self._accumulators:
+            return
+        row = {}
+        for key, (low, high, total, count) in self._accumulators.items():
+            row[f"{key}:min"] = low
+            row[f"{key}:avg"] = total / count
+            row[f"{key}:max"] = high
+        self.store.append(self._bucket, row)
+        self._accumulators = {}
+
+    def series(self, key, start=None, end=None, since=None, last=None):
+        """Return [(bucket_start_ms, min, avg, max)] for one sensor"""
+        rows = self.store.rows([f"{key}:avg", f"{key}:min", f"{key}:max"], start, end, since, last)
+        return [(timestamp, low, average, high) for timestamp, average, low, high in rows]
@@ -0,0 +1,144 @@
+import json
+import threading
+
+def event(name, data, event_id=None):
+    """Encode a Server-Sent Event with a JSON payload"""
+    body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    if event_id is None:
+        return b"event: %s\ndata: %s\n\n" % (name.encode(), body)
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (event_id, name.encode(), body)
+
+class LiveFrame:
+    """One tick of the live-update stream, encoded once for every client
+
+    delta carries the changes since the frame with sequence base (None if
+    there was none, or the sensor layout changed in between). full sets
+    every value and is only encoded if a client asks for it; meta is the
+    sensor list of the frame's layout.
+    """
+
+    __slots__ = ('sequence', 'base', 'layout', 'meta', 'delta', '_full_payload', '_full')
+
+    def __init__(self, sequence, base, layout, meta, delta, full_payload):
+        self.sequence = sequence
+        self.base = base
+        self.layout = layout
+        self.meta = meta
+        self.delta = delta
+        self._full_payload = full_payload
+        self._full = None
+
+    @property
+    def full(self):
+        if self._full is None:
+            self._full = event('full', self._full_payload, self.sequence)
+        return self._full
+
+    def events_for(self, layout, sequence):
+        """What to send a client that has the given layout and last saw sequence"""
+        if layout != self.layout:
+            return self.meta + self.full
+        if sequence != self.base:
+            return self.full
+        return self.delta
+
+class LiveEncoder:
+    """Delta-encodes snapshots for the live-update stream
+
+    A client first gets a 'meta' event listing the sensors, whose positions
+    in that list serve as compact indices from then on, then a 'full' event
+    with every value. After that each tick is a 'delta' event holding
+    [index, value] pairs for the sensors whose value moved by more than
+    epsilon (degrees Celsius, or RPM for fans) since it was last sent, null
+    for sensors that stopped reading, plus the CPU temperature and the
+    stats when they changed. Every delta names the sequence it applies on
+    top of; a client that did not see that one gets a 'full' event instead.
+
+    Values are compared with what was last sent rather than with the
+    previous tick, so slow drifts still go out once they add up to more
+    than epsilon. The encoder is shared by all connections: each tick is
+    encoded once, whichever connection asks for it first.
+    """
+
+    def __init__(self, temp_epsilon, fan_epsilon):
+        self.temp_epsilon = temp_epsilon
+        self.fan_epsilon = fan_epsilon
+        self._lock = threading.Lock()
+        self.inventory_version = None
+        self.layout = 0       # bumped whenever the sensor list changes
+        self.meta = None      # encoded 'meta' event of the current layout
+        self._index = {}      # sensor id -> index
+        self._epsilons = []
+        self._values = []     # value last sent, by index
+        self._temperature = None
+        self._stats = None
+        self.frame = None
+
+    def _set_layout(self, inventory_version, temps, fans):
+        sensors = list(temps) + list(fans)
+        self.inventory_version = inventory_version
+        self.layout += 1
+        self._index = {sensor.id: index for index, sensor in enumerate(sensors)}
+        self._epsilons = [self.temp_epsilon] * len(temps) + [self.fan_epsilon] * len(fans)
+        self._values = [None] * len(sensors)
+        self.meta = event('meta', {
+            'layout': self.layout,
+            'temperature_sensors': len(temps),
+            'sensors': [sensor.to_dict() for sensor in sensors]
+        })
+
+    def encode(self, snapshot, inventory_version, temps, fans):
+        """The frame of snapshot, or of a newer snapshot already encoded
+
+        temps and fans are the monitor's sensors at inventory_version.
+        """
+        with self._lock:
+            frame = self.frame
+            if frame is not None and snapshot.sequence <= frame.sequence:
+                return frame
+            base = None if frame is None else frame.sequence
+            if inventory_version != self.inventory_version:
+                self._set_layout(inventory_version, temps, fans)
+                base = None
+
+            current = [None] * len(self._values)
+            index = self._index
+            for readings in (snapshot.temp_readings, snapshot.fan_readings):
+                for reading in readings:
+                    position = index.get(reading.sensor.id)
+                    if position is not None:
+                        current[position] = reading.value
+
+            changes = []
+            values, epsilons = self._values, self._epsilons
+            for position, value in enumerate(current):
+                last = values[position]
+                if value is None or last is None:
+                    if value is last:
+                        continue
+                elif abs(value - last) <= epsilons[position]:
+                    continue
+                values[position] = value
+                changes.append([position, value])
+
+            delta = {
+                'sequence': snapshot.sequence,
+                'base': base,
+                'timestamp': snapshot.timestamp,
+                'changes': changes
+            }
+            if snapshot.temperature != self._temperature:
+                self._temperature = delta['temperature'] = snapshot.temperature
+            if snapshot.stats != self._stats:
+                self._stats = delta['stats'] = snapshot.stats
+            full = {
+                'sequence': snapshot.sequence,
+                'layout': self.layout,
+                'timestamp': snapshot.timestamp,
+                'temperature': self._temperature,
+                'stats': self._stats,
+                'values': list(values)
+            }
+            self.frame = LiveFrame(snapshot.sequence, base, self.layout, self.meta,
+                                   event('delta', delta, snapshot.sequence), full)
+            return self.frame
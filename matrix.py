@@ -0,0 +1,285 @@
+from array import array
+
+from history import NAN, HistoryStore
+
+try:
+    import numpy
+except ImportError:  # a requirement; plain Python gives the same results, several times slower
+    numpy = None
+
+# Heatmap values are integers in 1/SCALE degrees Celsius
+SCALE = 10
+
+class MatrixStore(HistoryStore):
+    """Ring buffer of samples stored row by row in one float32 array
+
+    Where HistoryStore keeps a separate column per sensor, this keeps a
+    time x column matrix in a single contiguous buffer (one row per sample,
+    NaN where a sensor had no reading), so a whole time range of every
+    core can be handed to NumPy as one 2-D view without copying. Adding
+    columns after the fact reallocates the matrix, which is fine for the
+    rare hotplugged CPU. Like HistoryStore's columns, the matrix only holds
+    the rows allocated so far and grows as the ring fills up.
+    """
+
+    def __init__(self, capacity, keys=()):
+        super().__init__(capacity)
+        self._keys = []
+        self._index = {}
+        self.width = 0
+        self._data = array('f')
+        self.add_columns(keys)
+
+    def keys(self):
+        return list(self._keys)
+
+    def add_column(self, key):
+        self.add_columns([key])
+        return self._index[key]
+
+    def add_columns(self, keys):
+        """Add columns; samples before they were added read as missing"""
+        new_keys = [key for key in dict.fromkeys(keys) if key not in self._index]
+        if not new_keys:
+            return
+        old_width, width = self.width, self.width + len(new_keys)
+        data = array('f', [NAN]) * (self._allocated * width)
+        if old_width:
+            for slot in range(self._allocated):
+                data[slot * width:slot * width + old_width] = \
+                    self._data[slot * old_width:(slot + 1) * old_width]
+        for key in new_keys:
+            self._index[key] = len(self._keys)
+            self._keys.append(key)
+        self._data, self.width = data, width
+
+    def _grow(self):
+        rows = self._allocated
+        super()._grow()
+        # A new buffer rather than extend(): window() may hold a NumPy view of the old one
+        self._data = self._data + array('f', [NAN]) * ((self._allocated - rows) * self.width)
+
+    def append(self, timestamp_ms, values):
+        """Append one sample; values maps column keys to readings, others are ignored"""
+        row = [NAN] * self.width
+        index = self._index
+        for key, value in values.items():
+            column = index.get(key)
+            if column is not None and value is not None:
+                row[column] = value
+        slot = self._next_slot(timestamp_ms)
+        self._data[slot * self.width:(slot + 1) * self.width] = array('f', row)
+        self._advance()
+
+    def _segments(self, first, stop):
+        """Slot ranges covering held samples [first, stop), at most two as the ring wraps"""
+        if first >= stop:
+            return []
+        start_slot = self._slot(first)
+        end_slot = start_slot + (stop - first)
+        if end_slot <= self.capacity:
+            return [(start_slot, end_slot)]
+        return [(start_slot, self.capacity), (0, end_slot - self.capacity)]
+
+    def count(self, start=None, end=None):
+        """Number of samples held in a time range"""
+        first, stop = self._range(start, end)
+        return max(0, stop - first)
+
+    def window(self, start=None, end=None, keys=None, last=None):
+        """Samples in a time range as (timestamps, matrix)
+
+        keys narrows the matrix to those columns, in that order. With NumPy
+        the matrix is a (samples, columns) float32 ndarray; without it, a
+        flat array('f') of the rows in order.
+        """
+        first, stop = self._range(start, end, last=last)
+        segments = self._segments(first, stop)
+        timestamps = []
+        for low, high in segments:
+            timestamps.extend(self._timestamps[low:high])
+        data, width = self._data, self.width
+        columns = None if keys is None else [self._index[key] for key in keys]
+
+        if numpy is not None:
+            view = numpy.frombuffer(data, dtype=numpy.float32).reshape(len(data) // max(width, 1), width)
+            if columns is not None:
+                parts = [view[low:high, columns] for low, high in segments]
+                width = len(columns)
+            else:
+                parts = [view[low:high] for low, high in segments]
+            matrix = numpy.concatenate(parts) if parts else numpy.empty((0, width), numpy.float32)
+            return timestamps, matrix
+
+        matrix = array('f')
+        for low, high in segments:
+            if columns is None:
+                matrix.extend(data[low * width:high * width])
+                continue
+            for slot in range(low, high):
+                base = slot * width
+                matrix.extend([data[base + column] for column in columns])
+        return timestamps, matrix
+
+    def rows(self, keys, start=None, end=None, since=None, last=None):
+        first, stop = self._range(start, end, since, last)
+        columns = [self._index.get(key) for key in keys]
+        if columns[0] is None:
+            return []
+        rows = []
+        for index in range(first, stop):
+            slot = self._slot(index)
+            base = slot * self.width
+            row = [self._timestamps[slot]]
+            for column in columns:
+                value = NAN if column is None else self._data[base + column]
+                row.append(value if value == value else None)
+            if row[1] is not None:
+                rows.append(tuple(row))
+        return rows
+
+    @property
+    def nbytes(self):
+        return self._timestamps.itemsize * len(self._timestamps) + self._data.itemsize * len(self._data)
+
+class MatrixRollup:
+    """Per-bucket maximum and average of every column of a matrix
+
+    Like RollupStore, buckets are accumulated as samples arrive and written
+    out when the next bucket starts; the maxima and averages go to two
+    MatrixStores of the same shape.
+    """
+
+    def __init__(self, bucket_ms, capacity, keys=()):
+        self.bucket_ms = bucket_ms
+        self.max = MatrixStore(capacity, keys)
+        self.avg = MatrixStore(capacity, keys)
+        self._bucket = None
+        self._accumulators = {}  # key -> [max, sum, count]
+
+    def __len__(self):
+        return len(self.max)
+
+    def add_columns(self, keys):
+        self.max.add_columns(keys)
+        self.avg.add_columns(keys)
+
+    def add(self, timestamp_ms, values):
+        bucket = timestamp_ms - timestamp_ms % self.bucket_ms
+        if self._bucket is not None and bucket > self._bucket:
+            self.flush()
+        if self._bucket is None or bucket > self._bucket:
+            self._bucket = bucket
+
+        accumulators = self._accumulators
+        for key, value in values.items():
+            if value is None:
+                continue
+            accumulator = accumulators.get(key)
+            if accumulator is None:
+                accumulators[key] = [value, value, 1]
+            else:
+                if value > accumulator[0]:
+                    accumulator[0] = value
+                accumulator[1] += value
+                accumulator[2] += 1
+
+    def flush(self):
+        if self._bucket is None or not self._accumulators:
+            return
+        accumulators = self._accumulators.items()
+        self.max.append(self._bucket, {key: high for key, (high, _, _) in accumulators})
+        self.avg.append(self._bucket, {key: total / count for key, (_, total, count) in accumulators})
+        self._accumulators = {}
+
+def bucket_edges(samples, buckets):
+    """Start index of each of at most `buckets` near-equal slices of samples"""
+    buckets = max(1, min(buckets, samples))
+    return [samples * i // buckets for i in range(buckets)]
+
+def scaled(value):
+    """A temperature as an integer number of 1/SCALE degrees, or None"""
+    return None if value is None or value != value else int(round(value * SCALE))
+
+def downsample(matrix, width, buckets, stat='max'):
+    """Reduce a window's matrix to at most `buckets` rows of per-column max or mean
+
+    Returns (edges, tiles): the first sample index of every tile, and a list
+    of rows of width values in 1/SCALE degrees, None where a column had no
+    readings in the tile. NaNs (missing readings) are ignored.
+    """
+    samples = len(matrix) if numpy is not None else len(matrix) // max(width, 1)
+    if not samples or not width:
+        return [], []
+    edges = bucket_edges(samples, buckets)
+
+    if numpy is not None:
+        if stat == 'max':
+            tiles = numpy.fmax.reduceat(matrix, edges, axis=0)
+        else:
+            missing = numpy.isnan(matrix)
+            totals = numpy.add.reduceat(numpy.where(missing, 0, matrix), edges, axis=0)
+            counts = numpy.add.reduceat(~missing, edges, axis=0)
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                tiles = totals / counts
+        return edges, to_rows(tiles)
+
+    tiles = []
+    bounds = edges + [samples]
+    for low, high in zip(bounds, bounds[1:]):
+        row = []
+        for column in range(width):
+            values = [value for value in matrix[low * width + column:high * width:width] if value == value]
+            if not values:
+                row.append(None)
+            elif stat == 'max':
+                row.append(scaled(max(values)))
+            else:
+                row.append(scaled(sum(values) / len(values)))
+        tiles.append(row)
+    return edges, tiles
+
+def column_percentiles(matrix, width, points=(50, 90, 99)):
+    """Percentiles (lower rank) and maximum of every column, ignoring NaNs
+
+    Returns {'p50': [per column], ..., 'max': [per column]} in 1/SCALE degrees.
+    """
+    names = [f"p{point}" for point in points]
+    if numpy is not None:
+        if not len(matrix):
+            return {name: [None] * width for name in names + ['max']}
+        # Sorting each column (contiguous after the transpose) and indexing
+        # is several times faster than numpy.nanpercentile; NaNs sort last
+        columns = numpy.sort(numpy.ascontiguousarray(matrix.T), axis=1)
+        present = (~numpy.isnan(columns)).sum(axis=1)
+        last = numpy.maximum(present - 1, 0)
+        result = {}
+        for name, point in zip(names + ['max'], list(points) + [100]):
+            ranks = (last * point // 100)[:, None]
+            values = numpy.take_along_axis(columns, ranks, axis=1)[:, 0]
+            result[name] = to_rows(numpy.where(present > 0, values, numpy.nan))
+        return result
+
+    samples = len(matrix) // max(width, 1)
+    result = {name: [] for name in names + ['max']}
+    for column in range(width):
+        values = sorted(value for value in matrix[column:samples * width:width] if value == value)
+        for name, point in zip(names, points):
+            result[name].append(scaled(values[(len(values) - 1) * point // 100]) if values else None)
+        result['max'].append(scaled(values[-1]) if values else None)
+    return result
+
+def to_rows(values):
+    """ndarray of temperatures to (nested) lists of 1/SCALE degrees, NaN as None
+
+    Small integers encode to JSON several times faster than floats, which
+    dominates the cost of a large heatmap otherwise.
+    """
+    missing = numpy.isnan(values)
+    rows = numpy.rint(numpy.where(missing, 0, values) * SCALE).astype(numpy.int32).tolist()
+    if not missing.any():
+        return rows
+    if values.ndim == 1:
+        return [None if gap else value for value, gap in zip(rows, missing.tolist())]
+    return [[None if gap else value for value, gap in zip(row, gaps)]
+            for row, gaps in zip(rows, missing.tolist())]
@@ -0,0 +1,300 @@
+import math
+from bisect import bisect_left
+from functools import lru_cache
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds of the sampling-loop histograms, in seconds
+TICK_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Upper bounds of histograms of single sensor reads, response encoding and
+# request handling, in seconds
+FINE_BUCKETS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                0.005, 0.01, 0.025, 0.1, 0.25, 1.0)
+
+class Histogram:
+    """Cumulative Prometheus-style histogram with fixed bucket bounds
+
+    observe() is O(log buckets) and only touches a per-bucket counter;
+    the cumulative counts are worked out when the histogram is exported.
+    """
+
+    def __init__(self, bounds=TICK_BUCKETS):
+        self.bounds = tuple(bounds)
+        self._counts = [0] * (len(self.bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self._counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def info(self):
+        """Cumulative bucket counts as [[upper bound, count], ...] plus sum and count"""
+        buckets = []
+        running = 0
+        for bound, count in zip(self.bounds, self._counts):
+            running += count
+            buckets.append([bound, running])
+        return {'buckets': buckets, 'sum': self.sum, 'count': self.count}
+
+    def state(self):
+        """Compact copy of the counts, [sum, count per bucket...], for from_state()"""
+        return [self.sum] + self._counts
+
+    @classmethod
+    def from_state(cls, state, bounds=TICK_BUCKETS):
+        histogram = cls(bounds)
+        histogram.sum = state[0]
+        histogram._counts = list(state[1:])
+        histogram.count = sum(histogram._counts)
+        return histogram
+
+    def quantiles(self, points=(50, 90, 99)):
+        """Estimated percentiles: the upper bound of the bucket holding each one
+
+        Percentiles beyond the last bound report that bound. None while
+        nothing has been observed.
+        """
+        if not self.count:
+            return {f"p{point}": None for point in points}
+        result = {}
+        running = 0
+        targets = iter(points)
+        point = next(targets)
+        for bound, count in zip(self.bounds + (self.bounds[-1],), self._counts):
+            running += count
+            while point is not None and running * 100 >= point * self.count:
+                result[f"p{point}"] = bound
+                point = next(targets, None)
+        return result
+
+    def summary(self):
+        """Count, mean and estimated percentiles, in milliseconds"""
+        return dict(
+            {'count': self.count, 'mean_ms': self.sum * 1000 / self.count if self.count else None},
+            **{f"{name}_ms": None if value is None else value * 1000
+               for name, value in self.quantiles().items()}
+        )
+
+class Timings:
+    """Histograms by name (an HTTP route, a cache key), created on first use
+
+    Like Histogram.observe(), observe() takes no lock so that it stays well
+    under a microsecond. Two threads observing the same name at the same
+    instant may very rarely lose a count, which is fine for monitoring.
+    """
+
+    def __init__(self, bounds=TICK_BUCKETS):
+        self.bounds = bounds
+        self._histograms = {}
+
+    def observe(self, name, seconds):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._histograms.setdefault(name, Histogram(self.bounds))
+        histogram.observe(seconds)
+
+    def info(self):
+        """{name: summary plus histogram} of everything observed so far"""
+        return {name: dict(histogram.summary(), histogram=histogram.info())
+                for name, histogram in sorted(self._histograms.items())}
+
+def percentiles(values, points=(50, 90, 99)):
+    """Nearest-rank percentiles of a sequence, as {'p50': ..., ...}"""
+    ordered = sorted(values)
+    if not ordered:
+        return {f"p{point}": None for point in points}
+    last = len(ordered) - 1
+    return {f"p{point}": ordered[min(last, int(len(ordered) * point / 100))] for point in points}
+
+def format_value(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, float):
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+@lru_cache(maxsize=8192)
+def format_labels(labels):
+    """Render a tuple of (name, value) pairs as {name="value",...}
+
+    Sensor labels are the same every tick, so the escaped strings are cached.
+    """
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+class Exposition:
+    """Collects metric families and renders the text exposition format"""
+
+    def __init__(self):
+        self._lines = []
+
+    def family(self, name, kind, help_text):
+        self._lines.append(f"# HELP {name} {help_text}")
+        self._lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name, value, labels=()):
+        self._lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+
+    def gauge(self, name, help_text, samples):
+        """Add a gauge family from an iterable of (labels, value)"""
+        self.family(name, 'gauge', help_text)
+        for labels, value in samples:
+            self.sample(name, value, labels)
+
+    def counter(self, name, help_text, samples):
+        self.family(name, 'counter', help_text)
+        for labels, value in samples:
+            self.sample(name, value, labels)
+
+    def histogram(self, name, help_text, histogram, labels=()):
+        """Add a histogram family from a Histogram.info() dict"""
+        self.histograms(name, help_text, [(labels, histogram)])
+
+    def histograms(self, name, help_text, samples):
+        """Add a histogram family from an iterable of (labels, Histogram.info())"""
+        self.family(name, 'histogram', help_text)
+        for labels, histogram in samples:
+            for bound, count in histogram['buckets']:
+                self.sample(f"{name}_bucket", count, labels + (('le', format_value(float(bound))),))
+            self.sample(f"{name}_bucket", histogram['count'], labels + (('le', '+Inf'),))
+            self.sample(f"{name}_sum", histogram['sum'], labels)
+            self.sample(f"{name}_count", histogram['count'], labels)
+
+    def render(self):
+        self._lines.append('')
+        return '\n'.join(self._lines).encode('utf-8')
+
+def read_latency_info(zones, fans, histograms, ticks):
+    """Read latency of every sensor, and the time spent reading each kind of sensor
+
+    histograms maps sensor paths to read latency Histograms; ticks is the
+    number of ticks they cover, for the average time per tick.
+    """
+    sensors = {}
+    kinds = {}
+    for kind, group in (('temperature', zones), ('fan', fans)):
+        total = reads = 0
+        for sensor in group:
+            histogram = histograms.get(sensor.path)
+            if histogram is None:
+                continue
+            sensors[sensor.id] = dict(histogram.summary(), kind=sensor.kind, path=sensor.path)
+            total += histogram.sum
+            reads += histogram.count
+        kinds[kind] = {
+            'reads': reads,
+            'seconds_total': total,
+            'ms_per_tick': total * 1000 / ticks if ticks else None
+        }
+    return {'kinds': kinds, 'sensors': sensors}
+
+def health_samples(sensors, labels_of, health_info):
+    """(labels, healthy) and (labels, failures) pairs for a list of sensors"""
+    healthy, failures = [], []
+    for sensor in sensors:
+        health = health_info(sensor.path)
+        if health is None:
+            continue
+        labels = labels_of(sensor)
+        healthy.append((labels, 1 if health['state'] == 'closed' else 0))
+        failures.append((labels, health['total_failures']))
+    return healthy, failures
+
+def render_metrics(snapshot, monitor):
+    """Render every metric for one snapshot as exposition text (bytes)
+
+    monitor is a ThermalMonitor or SharedMonitorClient; only its sensor
+    inventory, health and sampler_info() are used, so this works in
+    multi-worker mode as well.
+    """
+    out = Exposition()
+
+    def zone_labels(zone):
+        return (('zone', zone.id), ('type', zone.type), ('device', zone.device), ('label', zone.label))
+
+    def fan_labels(fan):
+        return (('fan', fan.id), ('device', fan.device), ('label', fan.label))
+
+    zones = monitor.thermal_zones
+    fans = monitor.fan_sensors
+
+    out.gauge('temp_monitor_cpu_temperature_celsius', "Primary CPU temperature.",
+              [((), snapshot.temperature)])
+    out.gauge('temp_monitor_zone_temperature_celsius', "Temperature of a thermal zone or hwmon input.",
+              [(zone_labels(reading.sensor), reading.value) for reading in snapshot.temp_readings])
+    out.gauge('temp_monitor_fan_speed_rpm', "Fan speed.",
+              [(fan_labels(reading.sensor), reading.value) for reading in snapshot.fan_readings])
+
+    derived = snapshot.derived
+    out.gauge('temp_monitor_package_max_celsius', "Hottest core, CCD or package sensor of a CPU package.",
+              [((('package', package),), value)
+               for package, value in (derived.get('package_max') or {}).items()])
+    out.gauge('temp_monitor_type_average_celsius', "Average temperature of the sensors of one type.",
+              [((('type', sensor_type),), value)
+               for sensor_type, value in (derived.get('type_averages') or {}).items()])
+    out.gauge('temp_monitor_fan_duty_percent', "Fan speed relative to the fastest seen since start-up.",
+              [((('fan', fan),), value) for fan, value in (derived.get('fan_duty') or {}).items()])
+
+    windows = snapshot.stats.get('windows', {})
+    stat_samples = []
+    for window, summary in windows.items():
+        for stat in ('avg', 'min', 'max'):
+            stat_samples.append(((('window', window), ('stat', stat)), summary[f"{stat}_temp"]))
+    out.gauge('temp_monitor_cpu_temperature_window_celsius',
+              "Average, minimum and maximum CPU temperature over a rolling window.", stat_samples)
+    out.gauge('temp_monitor_cpu_temperature_window_samples',
+              "Samples in a rolling window.",
+              [((('window', window),), summary['count']) for window, summary in windows.items()])
+
+    zone_healthy, zone_failures = health_samples(zones, zone_labels, monitor.health_info)
+    fan_healthy, fan_failures = health_samples(fans, fan_labels, monitor.health_info)
+    out.gauge('temp_monitor_zone_healthy', "1 while the zone's circuit breaker is closed.", zone_healthy)
+    out.counter('temp_monitor_zone_read_failures_total', "Failed reads of a temperature sensor.", zone_failures)
+    out.gauge('temp_monitor_fan_healthy', "1 while the fan's circuit breaker is closed.", fan_healthy)
+    out.counter('temp_monitor_fan_read_failures_total', "Failed reads of a fan sensor.", fan_failures)
+
+    sampler = monitor.sampler_info()
+    if sampler:
+        out.gauge('temp_monitor_sample_interval_seconds', "Configured sampling period.",
+                  [((), sampler['interval'])])
+        out.counter('temp_monitor_sample_ticks_total', "Sampling ticks run.",
+                    [((), sampler['ticks'])])
+        out.counter('temp_monitor_sample_missed_ticks_total',
+                    "Sampling ticks skipped because the previous tick overran.",
+                    [((), sampler['missed_ticks'])])
+        histograms = sampler.get('histograms', {})
+        if 'latency' in histograms:
+            out.histogram('temp_monitor_sample_duration_seconds', "Time taken by one sampling tick.",
+                          histograms['latency'])
+        if 'jitter' in histograms:
+            out.histogram('temp_monitor_sample_jitter_seconds',
+                          "Delay between a tick's deadline and its start.", histograms['jitter'])
+        out.histograms('temp_monitor_stage_duration_seconds',
+                       "Time taken by each step of a sampling tick: the read pass, "
+                       "every derived-metric stage and the history update.",
+                       [((('stage', stage),), timing['histogram'])
+                        for stage, timing in sampler.get('stages', {}).items()])
+        out.gauge('temp_monitor_sample_syscalls', "Syscalls made by the last sampling tick.",
+                  [((), sampler['syscalls_per_tick'])])
+        out.gauge('temp_monitor_open_sensor_handles', "Sensor files kept open.",
+                  [((), sampler['open_handles'])])
+        out.counter('temp_monitor_read_timeouts_total',
+                    "Sensor reads still pending when a tick's read budget ran out.",
+                    [((), sampler['reads']['timeouts'])])
+
+    out.gauge('temp_monitor_history_samples', "Samples held in the raw history.",
+              [((), snapshot.history_count)])
+    out.gauge('temp_monitor_snapshot_sequence', "Sequence number of the latest snapshot.",
+              [((), snapshot.sequence)])
+    return out.render()
@@ -0,0 +1,340 @@
+import os
+import time
+from collections import deque
+from datetime import datetime
+from types import MappingProxyType
+
+from metrics import Histogram, percentiles
+
+# Sensor types that carry the CPU temperature, most specific first
+CPU_TYPES = ['x86_pkg_temp', 'cpu_thermal', 'coretemp', 'k10temp', 'acpi-0']
+
+class Reading:
+    """One sensor's value in one tick: degrees Celsius or RPM"""
+
+    __slots__ = ('sensor', 'value')
+
+    def __init__(self, sensor, value):
+        object.__setattr__(self, 'sensor', sensor)
+        object.__setattr__(self, 'value', value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Readings are read-only ({name})")
+
+class Sample:
+    """Raw readings of one sampling tick, read-only once taken
+
+    temp_readings and fan_readings hold a Reading per sensor that returned
+    a value, in inventory order; temps and fans map the same sensor ids to
+    values. Stages derive everything else from these without touching
+    sysfs again.
+    """
+
+    __slots__ = ('timestamp_ms', 'monotonic', 'temp_readings', 'fan_readings', 'temps', 'fans')
+
+    def __init__(self, timestamp_ms, monotonic, temp_readings, fan_readings):
+        temps = MappingProxyType({reading.sensor.id: reading.value for reading in temp_readings})
+        fans = MappingProxyType({reading.sensor.id: reading.value for reading in fan_readings})
+        for field, value in zip(self.__slots__, (timestamp_ms, monotonic, temp_readings, fan_readings,
+                                                 temps, fans)):
+            object.__setattr__(self, field, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Samples are read-only ({name})")
+
+class Snapshot:
+    """Everything published for one sampling tick
+
+    The sampler builds a new Snapshot off to the side at the end of every
+    tick and publishes it by swapping a single reference. It is never
+    modified afterwards (the JSON views below are only memoized), so
+    readers on any thread can use it without locks or copies and always
+    see values from a single tick. monotonic is when the tick's sensors
+    were read (time.monotonic(), comparable across processes), None for a
+    placeholder.
+    """
+
+    __slots__ = ('sequence', 'timestamp', 'temperature', 'stats', 'temp_readings', 'fan_readings',
+                 'derived', 'history_count', 'monotonic', '_zones', '_fans')
+
+    def __init__(self, sequence, timestamp, temperature, stats, temp_readings, fan_readings,
+                 derived, history_count, monotonic=None):
+        for field, value in zip(self.__slots__, (sequence, timestamp, temperature, stats, temp_readings,
+                                                 fan_readings, derived, history_count, monotonic,
+                                                 None, None)):
+            object.__setattr__(self, field, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Snapshots are read-only ({name})")
+
+    @classmethod
+    def empty(cls):
+        return cls(0, datetime.now().isoformat(), 0, {}, (), (), {}, 0)
+
+    @property
+    def zones(self):
+        """Temperatures by sensor id, as served by the JSON API"""
+        if self._zones is None:
+            object.__setattr__(self, '_zones', {
+                reading.sensor.id: {
+                    'temperature': reading.value,
+                    'type': reading.sensor.type,
+                    'name': reading.sensor.name
+                }
+                for reading in self.temp_readings
+            })
+        return self._zones
+
+    @property
+    def fans(self):
+        """Fan speeds by sensor id, as served by the JSON API"""
+        if self._fans is None:
+            object.__setattr__(self, '_fans', {
+                reading.sensor.id: {
+                    'speed': reading.value,
+                    'label': reading.sensor.label,
+                    'device': reading.sensor.device,
+                    'name': reading.sensor.name
+                }
+                for reading in self.fan_readings
+            })
+        return self._fans
+
+    def to_dict(self):
+        return {
+            'sequence': self.sequence,
+            'timestamp': self.timestamp,
+            'temperature': self.temperature,
+            'stats': self.stats,
+            'zones': self.zones,
+            'fans': self.fans,
+            'derived': self.derived,
+            'history_count': self.history_count
+        }
+
+    @classmethod
+    def from_dict(cls, data, sensors, monotonic=None):
+        """Rebuild a published snapshot; sensors maps ids to Sensor descriptors"""
+        temp_readings = tuple(Reading(sensors[sensor_id], reading['temperature'])
+                              for sensor_id, reading in data['zones'].items() if sensor_id in sensors)
+        fan_readings = tuple(Reading(sensors[sensor_id], reading['speed'])
+                             for sensor_id, reading in data['fans'].items() if sensor_id in sensors)
+        return cls(data['sequence'], data['timestamp'], data['temperature'], data['stats'],
+                   temp_readings, fan_readings, data['derived'], data['history_count'], monotonic)
+
+def primary_cpu_candidates(sensors):
+    """Ids of temperature sensors to try for the CPU temperature, best first
+
+    Sensors whose type names a CPU sensor come first, in CPU_TYPES order,
+    followed by every other sensor as a fallback. Worked out once per
+    inventory change rather than every tick.
+    """
+    candidates = []
+    for cpu_type in CPU_TYPES:
+        for sensor in sensors:
+            if cpu_type.lower() in sensor.type.lower() and sensor.id not in candidates:
+                candidates.append(sensor.id)
+    candidates.extend(sensor.id for sensor in sensors if sensor.id not in candidates)
+    return candidates
+
+class Stage:
+    """A derived metric computed from each Sample
+
+    run() gets the sample and the results of the stages before it (by
+    name) and returns this stage's result. configure() is called with the
+    current temperature and fan sensors whenever the inventory changes, so
+    per-sensor lookups can be prepared there instead of in run().
+    """
+
+    name = None
+
+    def configure(self, temps, fans):
+        pass
+
+    def run(self, sample, results):
+        raise NotImplementedError
+
+class PrimaryCpuStage(Stage):
+    """The CPU temperature: the first candidate sensor with a reading"""
+
+    name = 'cpu'
+
+    def __init__(self):
+        self.candidates = []
+
+    def configure(self, temps, fans):
+        self.candidates = primary_cpu_candidates(temps)
+
+    def run(self, sample, results):
+        for sensor_id in self.candidates:
+            temp = sample.temps.get(sensor_id)
+            if temp is not None:
+                return temp
+        return None
+
+class StatsStage(Stage):
+    """Rolling CPU temperature statistics, fed by the 'cpu' stage
+
+    The first window also provides the top-level avg/max/min values. Ticks
+    without a CPU reading leave the statistics as they were.
+    """
+
+    name = 'stats'
+
+    def __init__(self, windows):
+        self.windows = windows
+        self.stats = {
+            'avg_temp': 0,
+            'max_temp': 0,
+            'min_temp': 100,
+            'cpu_temp': 0,
+            'windows': {}
+        }
+
+    def run(self, sample, results):
+        cpu_temp = results.get('cpu')
+        if cpu_temp is None:
+            return self.stats
+        windows = {}
+        for window in self.windows:
+            window.add(cpu_temp, sample.monotonic)
+            windows[window.name] = window.summary()
+        stats = {'cpu_temp': cpu_temp, 'windows': windows}
+        if self.windows:
+            primary = windows[self.windows[0].name]
+            stats['avg_temp'] = primary['avg_temp']
+            stats['max_temp'] = primary['max_temp']
+            stats['min_temp'] = primary['min_temp']
+        self.stats = dict(self.stats, **stats)
+        return self.stats
+
+class PackageMaxStage(Stage):
+    """Hottest core/CCD/package reading of every CPU package
+
+    Packages are the hwmon chips holding per-core sensors, named after
+    their package sensor's label when they have one (e.g. 'Package id 0').
+    """
+
+    name = 'package_max'
+
+    def __init__(self):
+        self.packages = {}  # package name -> [sensor ids]
+
+    def configure(self, temps, fans):
+        chips = {}
+        for sensor in temps:
+            if sensor.group:
+                chips.setdefault(os.path.dirname(sensor.path), []).append(sensor)
+        self.packages = {}
+        for members in chips.values():
+            labels = [sensor.label for sensor in members if sensor.group == 'package']
+            name = labels[0] if labels else members[0].device
+            if name in self.packages:
+                name = f"{name} ({members[0].id})"
+            self.packages[name] = [sensor.id for sensor in members]
+
+    def run(self, sample, results):
+        maxima = {}
+        for name, sensor_ids in self.packages.items():
+            values = [sample.temps[i] for i in sensor_ids if i in sample.temps]
+            if values:
+                maxima[name] = max(values)
+        return maxima
+
+class TypeAverageStage(Stage):
+    """Average temperature of the sensors of each type (acpitz, nvme, ...)"""
+
+    name = 'type_averages'
+
+    def __init__(self):
+        self.types = {}
+
+    def configure(self, temps, fans):
+        self.types = {}
+        for sensor in temps:
+            self.types.setdefault(sensor.type, []).append(sensor.id)
+
+    def run(self, sample, results):
+        averages = {}
+        for sensor_type, sensor_ids in self.types.items():
+            values = [sample.temps[i] for i in sensor_ids if i in sample.temps]
+            if values:
+                averages[sensor_type] = sum(values) / len(values)
+        return averages
+
+class FanDutyStage(Stage):
+    """Estimated duty of every fan: its speed relative to the fastest seen, in percent
+
+    hwmon exposes RPM but rarely the fan's rated maximum, so the highest
+    speed observed since start-up stands in for 100%.
+    """
+
+    name = 'fan_duty'
+
+    def __init__(self):
+        self.top_speed = {}
+
+    def run(self, sample, results):
+        duty = {}
+        for reading in sample.fan_readings:
+            fan_id, speed = reading.sensor.id, reading.value
+            top = max(self.top_speed.get(fan_id, 0), speed)
+            self.top_speed[fan_id] = top
+            duty[fan_id] = 100.0 * speed / top if top else 0.0
+        return duty
+
+class Pipeline:
+    """Runs derived-metric stages over each sample, timing every one
+
+    Stages run in the order they were added; later stages can use the
+    results of earlier ones. Other steps of a tick (the read pass, say)
+    can report their duration through record() to show up alongside.
+    """
+
+    SAMPLE_WINDOW = 1024
+
+    def __init__(self, stages=()):
+        self.stages = []
+        self.timings = {}
+        for stage in stages:
+            self.add(stage)
+
+    def add(self, stage):
+        if any(existing.name == stage.name for existing in self.stages):
+            raise ValueError(f"A stage named {stage.name!r} is already registered")
+        self.stages.append(stage)
+
+    def configure(self, temps, fans):
+        for stage in self.stages:
+            stage.configure(temps, fans)
+
+    def record(self, name, seconds):
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = (deque(maxlen=self.SAMPLE_WINDOW), Histogram())
+        timing[0].append(seconds)
+        timing[1].observe(seconds)
+
+    def run(self, sample):
+        """Run every stage; returns {stage name: result}"""
+        results = {}
+        for stage in self.stages:
+            started = time.perf_counter()
+            try:
+                results[stage.name] = stage.run(sample, results)
+            except Exception as e:
+                print(f"Error in stage {stage.name}: {e}")
+                results[stage.name] = None
+            self.record(stage.name, time.perf_counter() - started)
+        return results
+
+    def info(self):
+        """Per-step timings: millisecond percentiles of recent ticks plus a histogram"""
+        return {
+            name: {
+                'ms': {point: None if value is None else value * 1000
+                       for point, value in percentiles(recent).items()},
+                'histogram': histogram.info()
+            }
+            for name, (recent, histogram) in self.timings.items()
+        }
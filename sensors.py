@@ -0,0 +1,477 @@
+import errno
+import json
+import os
+import re
+import threading
+
+# Where sysfs is mounted; sensors are found under its class directory
+SYSFS_ROOT = '/sys'
+
+HWMON_INPUT = re.compile(r'^(temp|fan)(\d+)_input$')
+THERMAL_ZONE = re.compile(r'^thermal_zone(\d+)$')
+TRIP_POINT = re.compile(r'^trip_point_(\d+)_temp$')
+
+# hwmon temperature labels of per-core, per-CCD and per-package sensors
+# (coretemp on Intel, k10temp on AMD)
+CPU_GROUPS = [
+    ('core', re.compile(r'^Core \d+$')),
+    ('ccd', re.compile(r'^Tccd\d+$')),
+    ('package', re.compile(r'^(Package id \d+|Tctl|Tdie)$'))
+]
+
+def cpu_group(label):
+    """'core', 'ccd' or 'package' for a CPU temperature label, otherwise None"""
+    for group, pattern in CPU_GROUPS:
+        if pattern.match(label):
+            return group
+    return None
+
+def read_attribute(path, default=None):
+    """Read a short sysfs text attribute, or default if it cannot be read"""
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except (OSError, UnicodeDecodeError):
+        return default
+
+def readable(path):
+    """Whether a sensor input currently yields an integer reading
+
+    Any integer counts: inlet and drive sensors can read below 0 °C.
+    """
+    value = read_attribute(path)
+    if value is None:
+        return False
+    try:
+        int(value)
+    except ValueError:
+        return False
+    return True
+
+class Sensor:
+    """Descriptor of one sensor input, fixed once discovered
+
+    kind is 'zone' (thermal zone), 'temp' (hwmon temperature input) or
+    'fan'. group is 'core', 'ccd' or 'package' for per-core CPU sensors.
+    trips holds a thermal zone's trip points as (type, degrees Celsius,
+    hysteresis or None) tuples, coolest first. The display name is derived
+    rather than stored.
+    """
+
+    __slots__ = ('id', 'kind', 'path', 'type', 'device', 'label', 'group', 'channel', 'trips')
+
+    def __init__(self, id, kind, path, type, device, label, group=None, channel=0, trips=()):
+        for field, value in zip(self.__slots__, (id, kind, path, type, device, label, group, channel,
+                                                 tuple(trips))):
+            object.__setattr__(self, field, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Sensor descriptors are read-only ({name})")
+
+    def __repr__(self):
+        return f"Sensor({self.id!r}, {self.kind!r}, {self.path!r})"
+
+    @property
+    def name(self):
+        if self.kind == 'zone':
+            return f"Zone {self.id} ({self.type})"
+        return f"{self.device} - {self.label}"
+
+    def to_dict(self):
+        """JSON form, as served by /api/zones, /api/fan-sensors and /api/sensors"""
+        data = {field: getattr(self, field) for field in self.__slots__}
+        data['trips'] = [{'type': trip_type, 'temperature': temperature, 'hysteresis': hysteresis}
+                         for trip_type, temperature, hysteresis in self.trips]
+        data['name'] = self.name
+        if self.kind == 'fan':
+            data['fan_num'] = str(self.channel)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        trips = [(trip['type'], trip['temperature'], trip['hysteresis']) for trip in data.get('trips', ())]
+        return cls(data['id'], data['kind'], data['path'], data['type'], data['device'],
+                   data['label'], data.get('group'), data.get('channel', 0), trips)
+
+def read_trip_points(directory):
+    """Trip points of a thermal zone as (type, degrees, hysteresis) tuples, coolest first
+
+    Trip points without a positive temperature (disabled on many ACPI
+    tables) are skipped. hysteresis is None where the zone has no
+    trip_point_N_hyst.
+    """
+    trips = []
+    for entry in os.listdir(directory):
+        match = TRIP_POINT.match(entry)
+        if match is None:
+            continue
+        prefix = os.path.join(directory, f"trip_point_{match.group(1)}")
+        try:
+            temperature = int(read_attribute(f"{prefix}_temp", ''))
+        except ValueError:
+            continue
+        if temperature <= 0:
+            continue
+        try:
+            hysteresis = int(read_attribute(f"{prefix}_hyst", '')) / 1000.0
+        except ValueError:
+            hysteresis = None
+        trips.append((read_attribute(f"{prefix}_type", 'unknown'), temperature / 1000.0, hysteresis))
+    return sorted(trips, key=lambda trip: trip[1])
+
+def sensor_sort_key(sensor):
+    """Order sensors by kind, device and then numerically by channel"""
+    kind_order = {'zone': 0, 'temp': 1, 'fan': 2}
+    return (kind_order[sensor.kind], sensor.device, sensor.channel, sensor.id)
+
+class SensorRegistry:
+    """Every known sensor by stable id, indexed by kind, device, type and label
+
+    Sensors are Sensor descriptors as found by SysfsScanner. Lookups through the
+    indexes cost one set intersection per criterion rather than a scan of
+    every sensor, which matters once hundreds of hwmon inputs are present.
+    """
+
+    INDEXED = ('kind', 'device', 'type', 'label')
+
+    def __init__(self):
+        self._sensors = {}
+        self._by_path = {}
+        self._indexes = {field: {} for field in self.INDEXED}
+        self._lock = threading.Lock()
+        self.version = 0
+
+    def __len__(self):
+        return len(self._sensors)
+
+    def __contains__(self, sensor_id):
+        return sensor_id in self._sensors
+
+    def get(self, sensor_id):
+        return self._sensors.get(sensor_id)
+
+    def by_path(self, path):
+        return self._by_path.get(path)
+
+    def update(self, added=(), removed=()):
+        """Add and remove sensors (by id) in one step; returns True if anything changed"""
+        with self._lock:
+            changed = False
+            for sensor_id in removed:
+                sensor = self._sensors.pop(sensor_id, None)
+                if sensor is None:
+                    continue
+                self._by_path.pop(sensor.path, None)
+                for field, index in self._indexes.items():
+                    ids = index.get(getattr(sensor, field))
+                    if ids is not None:
+                        ids.discard(sensor_id)
+                        if not ids:
+                            del index[getattr(sensor, field)]
+                changed = True
+            for sensor in added:
+                if sensor.id in self._sensors:
+                    continue
+                self._sensors[sensor.id] = sensor
+                self._by_path[sensor.path] = sensor
+                for field, index in self._indexes.items():
+                    index.setdefault(getattr(sensor, field), set()).add(sensor.id)
+                changed = True
+            if changed:
+                self.version += 1
+            return changed
+
+    def find(self, **criteria):
+        """Sensors matching every given field (kind, device, type, label), in order"""
+        with self._lock:
+            ids = None
+            for field, value in criteria.items():
+                if value is None:
+                    continue
+                if field not in self._indexes:
+                    raise ValueError(f"Sensors are not indexed by {field!r}")
+                matches = self._indexes[field].get(value, set())
+                ids = set(matches) if ids is None else ids & matches
+            sensors = self._sensors.values() if ids is None else [self._sensors[i] for i in ids]
+            return sorted(sensors, key=sensor_sort_key)
+
+    def values(self, field):
+        """Distinct values of an indexed field"""
+        with self._lock:
+            return sorted(value for value in self._indexes[field] if value is not None)
+
+class SysfsReader:
+    """Keeps sysfs attribute files open and re-reads them in place with pread()
+
+    Each sensor file is opened once; every later read is a single pread() at
+    offset 0, which makes sysfs regenerate the value. Descriptors that went
+    stale (e.g. the driver module was reloaded and the attribute recreated)
+    are closed and reopened transparently.
+    """
+
+    # errnos that mean the descriptor no longer refers to a live attribute
+    STALE_ERRNOS = {errno.ENODEV, errno.ESTALE, errno.EBADF, errno.ENOENT, errno.ENXIO}
+    READ_SIZE = 64
+
+    def __init__(self):
+        self._fds = {}
+        self._lock = threading.Lock()
+        self.syscalls = 0  # open/pread/close calls issued so far
+
+    def _open(self, path):
+        fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+        self.syscalls += 1
+        with self._lock:
+            old = self._fds.get(path)
+            self._fds[path] = fd
+        if old is not None:
+            self._close_fd(old)
+        return fd
+
+    def _close_fd(self, fd):
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+        self.syscalls += 1
+
+    def _pread(self, fd):
+        self.syscalls += 1
+        return os.pread(fd, self.READ_SIZE, 0)
+
+    def read(self, path):
+        """Return the raw contents of a sysfs attribute, reopening it if stale"""
+        fd = self._fds.get(path)
+        if fd is None:
+            fd = self._open(path)
+        try:
+            data = self._pread(fd)
+        except OSError as e:
+            if e.errno not in self.STALE_ERRNOS:
+                raise
+            data = b''
+        if not data:
+            # An empty read or a stale handle: reopen once and retry
+            fd = self._open(path)
+            data = self._pread(fd)
+        return data
+
+    def read_int(self, path):
+        """Read a sysfs attribute holding a single integer"""
+        return int(self.read(path).strip())
+
+    def close(self, path=None):
+        """Close the handle for one path, or all handles when no path is given"""
+        with self._lock:
+            if path is None:
+                fds = list(self._fds.values())
+                self._fds.clear()
+            else:
+                fd = self._fds.pop(path, None)
+                fds = [fd] if fd is not None else []
+        for fd in fds:
+            self._close_fd(fd)
+
+    @property
+    def open_handles(self):
+        return len(self._fds)
+
+class SysfsScanner:
+    """Finds thermal zones and hwmon temperature and fan inputs
+
+    The first scan() reads every thermal_zone* and hwmon* entry. Later
+    calls list the two class directories and diff them against the entries
+    seen before: only new entries (or entries that now point at a different
+    device) are read, and the sensors of vanished entries are reported as
+    removed. An unchanged system costs two directory listings and one
+    readlink per entry.
+
+    With a cache_path, the inventory is also saved to that file whenever it
+    changes, and the first scan of a new scanner (say, after a restart)
+    reuses the saved sensors of every entry whose device is unchanged.
+    Checking an entry takes its link target, its name (or zone type) and a
+    listing of its input (and trip point) files, rather than opening every
+    input and label.
+
+    hwmon sensor ids are the chip's device plus the driver name and input,
+    e.g. coretemp.1:coretemp_temp2 or nvme0:nvme_temp1, so they stay the
+    same whatever other chips come and go, and across restarts.
+    """
+
+    CACHE_FORMAT = 3
+
+    def __init__(self, root=SYSFS_ROOT, cache_path=None):
+        self.root = root
+        self.class_root = os.path.join(root, 'class')
+        self.cache_path = cache_path
+        self._entries = {}  # (class, entry) -> (link target, identity, [sensors])
+        self._scanned = False
+        self.cache_hits = 0
+
+    def _list(self, sysfs_class):
+        try:
+            names = os.listdir(os.path.join(self.class_root, sysfs_class))
+        except OSError:
+            return {}
+        entries = {}
+        for name in names:
+            path = os.path.join(self.class_root, sysfs_class, name)
+            try:
+                target = os.readlink(path)
+            except OSError:
+                target = path  # a real directory rather than the usual symlink
+            entries[(sysfs_class, name)] = target
+        return entries
+
+    def _identity(self, sysfs_class, directory):
+        """What a cached entry must still match: device name or zone type, and its inputs"""
+        if sysfs_class == 'thermal':
+            trips = sorted(entry for entry in os.listdir(directory) if entry.startswith('trip_point_'))
+            return [read_attribute(os.path.join(directory, 'type')), ['temp'] + trips]
+        inputs = sorted(entry for entry in os.listdir(directory) if HWMON_INPUT.match(entry))
+        return [read_attribute(os.path.join(directory, 'name'), 'unknown'), inputs]
+
+    def scan(self):
+        """Return (added sensors, removed sensor ids) since the previous scan"""
+        current = self._list('thermal')
+        current.update(self._list('hwmon'))
+
+        removed = []
+        for key, (target, _, sensors) in list(self._entries.items()):
+            if current.get(key) != target:
+                del self._entries[key]
+                removed.extend(sensor.id for sensor in sensors)
+
+        added = []
+        pending = [key for key in current if key not in self._entries]
+        changed = bool(removed)
+        if not self._scanned:
+            self._scanned = True
+            pending, changed = self._restore(current, pending, added)
+        for key in pending:
+            sysfs_class, name = key
+            directory = os.path.join(self.class_root, sysfs_class, name)
+            try:
+                if sysfs_class == 'thermal':
+                    sensors = self._scan_thermal_zone(name, directory)
+                else:
+                    sensors = self._scan_hwmon(directory)
+                identity = self._identity(sysfs_class, directory) if sensors else None
+            except OSError as e:
+                print(f"Error scanning {directory}: {e}")
+                continue
+            if not sensors:
+                # Either not a sensor device, or its attributes are not
+                # populated yet right after a hotplug: look again next time
+                continue
+            self._entries[key] = (current[key], identity, sensors)
+            added.extend(sensors)
+            changed = True
+
+        if changed:
+            self._save()
+        return added, removed
+
+    def _restore(self, current, pending, added):
+        """Take unchanged entries from the cache into added
+
+        Returns the keys still to scan, and whether the cache is out of date.
+        """
+        cached = self._load()
+        remaining = []
+        for key in pending:
+            entry = cached.get(key)
+            directory = os.path.join(self.class_root, *key)
+            try:
+                valid = entry is not None and entry['target'] == current[key] and \
+                    entry['identity'] == self._identity(key[0], directory)
+            except OSError:
+                valid = False
+            if not valid:
+                remaining.append(key)
+                continue
+            sensors = [Sensor.from_dict(sensor) for sensor in entry['sensors']]
+            self._entries[key] = (current[key], entry['identity'], sensors)
+            added.extend(sensors)
+            self.cache_hits += len(sensors)
+        return remaining, len(self._entries) != len(cached)
+
+    def _load(self):
+        if self.cache_path is None:
+            return {}
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if cache.get('format') != self.CACHE_FORMAT or cache.get('root') != self.root:
+            return {}
+        return {(entry['class'], entry['name']): entry for entry in cache['entries']}
+
+    def _save(self):
+        if self.cache_path is None:
+            return
+        cache = {
+            'format': self.CACHE_FORMAT,
+            'root': self.root,
+            'entries': [
+                {'class': sysfs_class, 'name': name, 'target': target, 'identity': identity,
+                 'sensors': [sensor.to_dict() for sensor in sensors]}
+                for (sysfs_class, name), (target, identity, sensors) in self._entries.items()
+            ]
+        }
+        # Write a new file and rename it over the old one, so a crash never
+        # leaves a truncated cache behind
+        temporary = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            # One dumps() call uses the C encoder; dump() streams through the Python one
+            with open(temporary, 'w') as f:
+                f.write(json.dumps(cache, separators=(',', ':')))
+            os.replace(temporary, self.cache_path)
+        except OSError as e:
+            print(f"Error saving sensor inventory to {self.cache_path}: {e}")
+
+    def _scan_thermal_zone(self, name, directory):
+        match = THERMAL_ZONE.match(name)
+        temp_file = os.path.join(directory, 'temp')
+        if match is None or not os.path.exists(temp_file):
+            return []
+        zone_num = match.group(1)
+        zone_type = read_attribute(os.path.join(directory, 'type'), 'unknown')
+        return [Sensor(zone_num, 'zone', temp_file, zone_type, 'thermal', zone_type,
+                       channel=int(zone_num), trips=read_trip_points(directory))]
+
+    def _scan_hwmon(self, directory):
+        names = os.listdir(directory)
+        device_name = read_attribute(os.path.join(directory, 'name'), 'unknown')
+        # Chips with the same driver name (say, two NVMe drives) are told
+        # apart by the device the hwmon entry belongs to; hwmonN, the
+        # fallback for entries without one, is only stable until a reboot
+        device_link = os.path.join(directory, 'device')
+        qualifier = os.path.basename(os.path.realpath(device_link)) if os.path.exists(device_link) \
+            else os.path.basename(directory)
+
+        sensors = []
+        present = set(names)
+        for entry in names:
+            match = HWMON_INPUT.match(entry)
+            if match is None:
+                continue
+            kind, channel = match.groups()
+            path = os.path.join(directory, entry)
+            if not readable(path):
+                continue
+            label_file = f"{kind}{channel}_label"
+            if kind == 'fan':
+                label = read_attribute(os.path.join(directory, label_file), f'Fan {channel}') \
+                    if label_file in present else f'Fan {channel}'
+                sensor_id = f"{qualifier}:{device_name}_{channel}"
+                sensors.append(Sensor(sensor_id, 'fan', path, 'fan', device_name, label,
+                                      channel=int(channel)))
+            else:
+                label = read_attribute(os.path.join(directory, label_file), f'temp{channel}') \
+                    if label_file in present else f'temp{channel}'
+                sensor_id = f"{qualifier}:{device_name}_temp{channel}"
+                sensors.append(Sensor(sensor_id, 'temp', path, device_name, device_name, label,
+                                      cpu_group(label), int(channel)))
+        return sensors
@@ -0,0 +1,300 @@
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+from history import HistoryStore, MappedHistoryStore, RollupStore
+from metrics import FINE_BUCKETS, Histogram, read_latency_info
+from pipeline import Snapshot
+from sensors import Sensor, SensorRegistry
+
+# File in the shared directory holding the latest published snapshot
+SEGMENT_NAME = 'snapshot.seg'
+SEGMENT_SIZE = 4 * 1024 * 1024
+# Files holding the state that changes less often than every tick; each is
+# rewritten only when its tag in the snapshot segment changes
+SECTION_NAMES = {
+    'inventory': 'inventory.seg',      # sensors, rollups and alert rules
+    'alerts': 'alerts.seg',            # the alert event log
+    'diagnostics': 'diagnostics.seg'   # sampler info, sensor health and read latency
+}
+# Seconds between updates of the diagnostics section
+DIAGNOSTICS_INTERVAL = 5.0
+# How often waiting readers look for a new snapshot, in seconds
+POLL_INTERVAL = 0.05
+
+class SnapshotSegment:
+    """Seqlock-protected snapshot slot in a shared memory-mapped file
+
+    One writer, any number of readers, no locks. The writer makes the
+    version odd, copies the payload in and makes the version even again.
+    Readers copy the payload out and retry if the version was odd or
+    changed while they were copying; a CRC of the payload guards against
+    torn reads on weakly ordered CPUs as well.
+    """
+
+    HEADER = struct.Struct('<QII')  # version, payload length, payload crc32
+    VERSION = struct.Struct('<Q')
+
+    def __init__(self, path, size=SEGMENT_SIZE, create=False):
+        self.path = path
+        if create:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o644)
+            access = mmap.PROT_READ | mmap.PROT_WRITE
+        else:
+            fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+            access = mmap.PROT_READ
+        try:
+            if create:
+                os.ftruncate(fd, size)
+            else:
+                size = os.fstat(fd).st_size
+            self._mmap = mmap.mmap(fd, size, mmap.MAP_SHARED, access)
+        finally:
+            os.close(fd)
+        self.size = size
+        self._version = 0
+
+    @property
+    def version(self):
+        return self.VERSION.unpack_from(self._mmap, 0)[0]
+
+    def write(self, payload):
+        if len(payload) > self.size - self.HEADER.size:
+            raise ValueError(f"Snapshot of {len(payload)} bytes does not fit in {self.path}")
+        self.HEADER.pack_into(self._mmap, 0, self._version + 1, len(payload), zlib.crc32(payload))
+        self._mmap[self.HEADER.size:self.HEADER.size + len(payload)] = payload
+        self._version += 2
+        self.VERSION.pack_into(self._mmap, 0, self._version)
+
+    def read(self, attempts=1000):
+        """Return (version, payload), or None if nothing was published yet"""
+        for _ in range(attempts):
+            version, length, crc = self.HEADER.unpack_from(self._mmap, 0)
+            if version == 0:
+                return None
+            if version & 1 or length > self.size - self.HEADER.size:
+                time.sleep(0)
+                continue
+            payload = self._mmap[self.HEADER.size:self.HEADER.size + length]
+            if self.version == version and zlib.crc32(payload) == crc:
+                return version, payload
+        raise RuntimeError(f"Could not get a consistent read of {self.path}")
+
+class SnapshotPublisher:
+    """Publishes a ThermalMonitor's snapshots into a shared directory
+
+    The snapshot segment only carries the tick itself plus a tag per
+    section. Each section (see SECTION_NAMES) is serialized into its own
+    segment when its tag changes: the inventory and rules with the
+    inventory version, the alert log with the newest event id and the
+    diagnostics every DIAGNOSTICS_INTERVAL seconds. A section is always
+    written before the snapshot that names its tag.
+
+    The monitor must keep its history in the same directory (data_dir), so
+    readers can map the history rings next to the snapshot segment.
+    """
+
+    def __init__(self, monitor, directory):
+        self.monitor = monitor
+        self.segment = SnapshotSegment(os.path.join(directory, SEGMENT_NAME), create=True)
+        self.sections = {name: SnapshotSegment(os.path.join(directory, filename), create=True)
+                         for name, filename in SECTION_NAMES.items()}
+        self.tags = {}
+        self._diagnostics_due = 0.0
+        monitor.listeners.append(self.publish)
+
+    def publish(self, snapshot):
+        monitor = self.monitor
+        self._publish_section('inventory', monitor.inventory_version, lambda: {
+            'zones': [zone.to_dict() for zone in monitor.thermal_zones],
+            'fan_sensors': [fan.to_dict() for fan in monitor.fan_sensors],
+            'rollups': {name: rollup.bucket_ms for name, rollup in monitor.rollups.items()},
+            'alert_rules': monitor.alert_rules()
+        })
+        self._publish_section('alerts', monitor.alerts.last_event_id, lambda: {
+            'events': monitor.alerts.events
+        })
+        now = time.monotonic()
+        if now >= self._diagnostics_due:
+            self._diagnostics_due = now + DIAGNOSTICS_INTERVAL
+            self._publish_section('diagnostics', snapshot.sequence, lambda: {
+                'sampler': monitor.sampler_info(),
+                'health': {path: health.info() for path, health in monitor.sensor_health.items()},
+                'read_latency': {path: health.latency.state()
+                                 for path, health in monitor.sensor_health.items()}
+            })
+        self._write(self.segment, {
+            'snapshot': snapshot.to_dict(),
+            'snapshot_monotonic': snapshot.monotonic,
+            'sections': self.tags
+        })
+
+    def _publish_section(self, name, tag, build):
+        if self.tags.get(name) != tag and self._write(self.sections[name], dict(build(), tag=tag)):
+            self.tags[name] = tag
+
+    def _write(self, segment, payload):
+        try:
+            segment.write(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+            return True
+        except ValueError as e:
+            print(f"Error publishing snapshot: {e}")
+            return False
+
+class SharedMonitorClient:
+    """Read-only stand-in for ThermalMonitor in HTTP worker processes
+
+    Serves snapshots, sensor inventory and history published by a sampler
+    process through the shared directory, without touching sysfs. Each new
+    snapshot is decoded once; the sections it refers to are only read
+    again when their tag changed, so the sensor descriptors are decoded
+    once per inventory change.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._segment = None
+        self._version = None
+        self._state = None
+        self._snapshot = Snapshot.empty()
+        self._sections = {}   # name -> SnapshotSegment
+        self._shared = {}     # name -> decoded section
+        self._history = None
+        self._rollups = {}
+        self._zones = []
+        self._fans = []
+        self._registry = SensorRegistry()
+        self._registry_version = None
+
+    def start(self):
+        """Nothing to start: the sampler process does the sampling"""
+
+    def _load(self):
+        if self._segment is None:
+            try:
+                self._segment = SnapshotSegment(os.path.join(self.directory, SEGMENT_NAME))
+            except FileNotFoundError:
+                return None  # the sampler has not started yet
+        if self._segment.version != self._version:
+            published = self._segment.read()
+            if published is not None:
+                self._version = published[0]
+                self._state = state = json.loads(published[1])
+                for name, tag in state['sections'].items():
+                    if self._shared.get(name, {}).get('tag') != tag:
+                        self._load_section(name)
+                sensors = {sensor.id: sensor for sensor in self._zones + self._fans}
+                self._snapshot = Snapshot.from_dict(state['snapshot'], sensors, state['snapshot_monotonic'])
+        return self._state
+
+    def _load_section(self, name):
+        segment = self._sections.get(name)
+        if segment is None:
+            segment = self._sections[name] = SnapshotSegment(os.path.join(self.directory, SECTION_NAMES[name]))
+        published = segment.read()
+        if published is None:
+            return
+        self._shared[name] = section = json.loads(published[1])
+        if name == 'inventory':
+            self._zones = [Sensor.from_dict(zone) for zone in section['zones']]
+            self._fans = [Sensor.from_dict(fan) for fan in section['fan_sensors']]
+            registry = SensorRegistry()
+            registry.update(self._zones + self._fans)
+            self._registry, self._registry_version = registry, section['tag']
+
+    def _section(self, name):
+        """The latest decoded section, or None before the sampler published it"""
+        self._load()
+        return self._shared.get(name)
+
+    @property
+    def snapshot(self):
+        self._load()
+        return self._snapshot
+
+    @property
+    def sequence(self):
+        return self.snapshot.sequence
+
+    @property
+    def inventory_version(self):
+        self._load()
+        return self._registry_version
+
+    @property
+    def thermal_zones(self):
+        self._load()
+        return self._zones
+
+    @property
+    def fan_sensors(self):
+        self._load()
+        return self._fans
+
+    @property
+    def registry(self):
+        """The sampler's sensors, re-indexed only when its inventory changes"""
+        self._load()
+        return self._registry
+
+    def health_info(self, path):
+        diagnostics = self._section('diagnostics')
+        return diagnostics['health'].get(path) if diagnostics else None
+
+    def sampler_info(self):
+        diagnostics = self._section('diagnostics')
+        return diagnostics['sampler'] if diagnostics else {}
+
+    def read_latency_info(self):
+        diagnostics = self._section('diagnostics')
+        histograms = {path: Histogram.from_state(counts, FINE_BUCKETS)
+                      for path, counts in (diagnostics['read_latency'] if diagnostics else {}).items()}
+        return read_latency_info(self._zones, self._fans, histograms, self.sequence)
+
+    def alert_events(self, after_id=0):
+        alerts = self._section('alerts')
+        return [event for event in (alerts['events'] if alerts else ()) if event['id'] > after_id]
+
+    def alert_rules(self):
+        inventory = self._section('inventory')
+        return inventory['alert_rules'] if inventory else []
+
+    def _open_store(self, name):
+        try:
+            return MappedHistoryStore.open_readonly(os.path.join(self.directory, f"{name}.ring"))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    @property
+    def history(self):
+        if self._history is None:
+            self._history = self._open_store('raw')
+            if self._history is None:
+                return HistoryStore(1)
+        self._history.refresh()
+        return self._history
+
+    @property
+    def rollups(self):
+        inventory = self._section('inventory')
+        for name, bucket_ms in (inventory['rollups'] if inventory else {}).items():
+            if name not in self._rollups:
+                store = self._open_store(name)
+                if store is None:
+                    continue
+                self._rollups[name] = RollupStore(store, bucket_ms)
+            self._rollups[name].store.refresh()
+        return self._rollups
+
+    def wait_for_snapshot(self, after_sequence, timeout=None):
+        """Poll the segment until a snapshot newer than after_sequence appears"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self.snapshot
+            if snapshot.sequence > after_sequence:
+                return snapshot
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(POLL_INTERVAL)